@@ -0,0 +1,3 @@
+"""
+Micro-benchmarks del extractor con corpus golden (ver benchmarks/bench_extractor.py).
+"""
@@ -0,0 +1,370 @@
+"""
+Micro-benchmark de UltraReceiptExtractor sobre el corpus golden.
+
+El corpus (benchmarks/golden/) tiene recibos Yape chicos, correos de banco
+envueltos en marketing (bloques de promociones agregados al cargar) y HTML
+malformado (tags sin cerrar, truncado, entidades). expected.json trae el
+valor real de cada campo, leído del propio recibo.
+
+Por modo (regex = sin modelo, ai = regex + QA de respaldo) mide:
+    - analyze(): docs/s, latencia por documento y ms por etapa (dict timings)
+    - analyze_batch(): docs/s sobre el corpus completo
+    - adapt_to_transaction_schema(): docs/s y exactitud del esquema final
+y la exactitud por campo contra expected.json (global y por categoría).
+
+Uso (desde agent/):
+    python -m benchmarks.bench_extractor --modes regex,ai --repeat 5
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import re
+import subprocess
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from extractor import UltraReceiptExtractor, adapt_to_transaction_schema
+
+GOLDEN_DIR = Path(__file__).resolve().parent / "golden"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+ACCOUNT_FIELDS = ("Origen_Cuenta", "Destino_Cuenta")
+NAME_FIELDS = ("Origen", "Destino")
+
+PROMOS = [
+    ("Smart TV 55\" 4K", "1,899.00"),
+    ("Laptop 15.6\" 16GB RAM", "2,499.90"),
+    ("Audífonos inalámbricos", "149.90"),
+    ("Freidora de aire 5L", "299.00"),
+    ("Zapatillas running", "219.50"),
+]
+
+
+# ============================================================================
+# CORPUS
+# ============================================================================
+
+def marketing_header(blocks: int) -> str:
+    """Banner y menú típicos de un correo de banco (sin montos)"""
+    links = "".join(
+        f'<td><a href="https://example.com/seccion/{n}" style="color:#fff">Sección {n}</a></td>'
+        for n in range(max(1, blocks // 10))
+    )
+    return (
+        '<table width="600" align="center" bgcolor="#002a8d"><tr>'
+        '<td><img src="https://example.com/logo.png" alt="Banco" width="120"></td>'
+        f"{links}</tr></table>"
+        '<table width="600" align="center"><tr><td class="promo">'
+        "<h1>¡Aprovecha este mes!</h1><p>Descuentos exclusivos pagando con tus tarjetas.</p>"
+        "</td></tr></table>"
+    )
+
+
+def marketing_footer(blocks: int) -> str:
+    """Promociones con precios, redes sociales y texto legal largo"""
+    parts = []
+    for n in range(blocks):
+        name, price = PROMOS[n % len(PROMOS)]
+        parts.append(
+            '<table width="600" align="center" class="promo"><tr>'
+            f'<td><img src="https://example.com/promo/{n}.jpg" width="180"></td>'
+            f"<td><h3>{name}</h3><p>Antes S/ {price}, ahora con 20% de descuento "
+            f"pagando en cuotas sin intereses.</p>"
+            f'<a href="https://example.com/promo/{n}?utm_source=email">Ver oferta</a></td>'
+            "</tr></table>"
+        )
+    parts.append(
+        '<p class="legal">'
+        + "Promoción válida hasta agotar stock. Sujeto a evaluación crediticia. "
+        "Consulta términos y condiciones en nuestra web. " * max(1, blocks // 4)
+        + "</p>"
+    )
+    return "".join(parts)
+
+
+def load_corpus(golden_dir: Path = GOLDEN_DIR):
+    """Documentos golden con el HTML ya expandido y los valores esperados"""
+    spec = json.loads((golden_dir / "expected.json").read_text(encoding="utf-8"))
+    documents = []
+    for doc in spec["documents"]:
+        html = (golden_dir / doc["file"]).read_text(encoding="utf-8")
+        blocks = doc.get("marketing_blocks", 0)
+        html = html.replace("{{MARKETING_HEADER}}", marketing_header(blocks) if blocks else "")
+        html = html.replace("{{MARKETING_FOOTER}}", marketing_footer(blocks) if blocks else "")
+        documents.append({**doc, "html": html})
+    return spec["fields"], documents
+
+
+# ============================================================================
+# EXACTITUD
+# ============================================================================
+
+def _fold(value: str) -> str:
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return " ".join(value.split()).casefold()
+
+
+def normalize(field: str, value):
+    """Forma comparable de un campo (formato del extractor vs. valor del recibo)"""
+    if value is None or str(value).strip() == "":
+        return None
+    value = str(value)
+    if field == "Monto":
+        number = re.search(r"\d[\d,]*(?:\.\d+)?", value)
+        return round(float(number.group().replace(",", "")), 2) if number else None
+    if field == "Operacion":
+        return re.sub(r"\D", "", value) or None
+    if field in ACCOUNT_FIELDS:
+        # El extractor enmascara con su propio número de X: comparar los últimos dígitos
+        digits = re.sub(r"\D", "", value)
+        return digits[-3:] if digits else None
+    if field in NAME_FIELDS:
+        return _fold(value.strip(" ,.!¡"))
+    return _fold(value)
+
+
+def field_hits(fields, expected: dict, result: dict) -> dict:
+    return {f: normalize(f, expected.get(f)) == normalize(f, result.get(f)) for f in fields}
+
+
+def schema_hits(expected: dict, schema: dict) -> dict:
+    variables = schema.get("transactionVariables", {})
+    return {key: variables.get(key) == value for key, value in expected.items()}
+
+
+def accuracy(hit_rows) -> dict:
+    """hit_rows: lista de {campo: bool} → {campo: fracción, '_all': global}"""
+    totals, ok = Counter(), Counter()
+    for row in hit_rows:
+        for field, hit in row.items():
+            totals[field] += 1
+            ok[field] += int(hit)
+    report = {f: round(ok[f] / totals[f], 3) for f in totals}
+    report["_all"] = round(sum(ok.values()) / sum(totals.values()), 3) if totals else None
+    return report
+
+
+# ============================================================================
+# MEDICIÓN
+# ============================================================================
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q
+    lo, hi = int(pos), min(int(pos) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def summarize(values):
+    return {
+        "p50": _round(percentile(values, 0.5)),
+        "p90": _round(percentile(values, 0.9)),
+        "max": _round(max(values) if values else None),
+        "mean": _round(sum(values) / len(values) if values else None),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+def stage_totals(timings: dict) -> dict:
+    """Aplana el dict timings de analyze(): ms totales por etapa (+ por campo)"""
+    flat = {}
+    for stage, value in timings.items():
+        if stage == "inference":
+            flat["inference_runs"] = len(value)
+            flat["inference_ms"] = sum(run["ms"] for run in value)
+            flat["inference_queue_ms"] = sum(run["queue_ms"] for run in value)
+        elif isinstance(value, dict):
+            flat[stage] = sum(value.values())
+            for field, ms in value.items():
+                flat[f"{stage}.{field}"] = ms
+        else:
+            flat[stage] = value
+    return flat
+
+
+@contextlib.contextmanager
+def quiet(enabled: bool):
+    """El extractor imprime por documento: silenciarlo para no medir el print"""
+    if not enabled:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def bench_analyze(extractor, fields, documents, repeat, silent):
+    latencies = defaultdict(list)
+    stages = defaultdict(list)
+    hits, by_category, methods = [], defaultdict(list), defaultdict(Counter)
+    results = {}
+
+    started = time.perf_counter()
+    for run in range(repeat):
+        for doc in documents:
+            timings = {}
+            t0 = time.perf_counter()
+            with quiet(silent):
+                result = extractor.analyze(doc["html"], timings=timings)
+            latencies[doc["category"]].append((time.perf_counter() - t0) * 1000)
+            for stage, ms in stage_totals(timings).items():
+                stages[stage].append(ms)
+            if run == 0:
+                results[doc["id"]] = result
+                row = field_hits(fields, doc["expected"], result)
+                hits.append(row)
+                by_category[doc["category"]].append(row)
+                for field in fields:
+                    methods[field][result.get(f"{field}_metodo", "none")] += 1
+    elapsed = time.perf_counter() - started
+
+    all_latencies = [ms for values in latencies.values() for ms in values]
+    return results, {
+        "docs": len(documents) * repeat,
+        "docs_per_s": round(len(documents) * repeat / elapsed, 2),
+        "latency_ms": summarize(all_latencies),
+        "latency_ms_by_category": {c: summarize(v) for c, v in sorted(latencies.items())},
+        "stage_ms_mean": {s: _round(sum(v) / len(v)) for s, v in sorted(stages.items())},
+        "field_accuracy": accuracy(hits),
+        "field_accuracy_by_category": {c: accuracy(rows) for c, rows in sorted(by_category.items())},
+        "field_methods": {f: dict(c) for f, c in methods.items()},
+        "misses": {
+            doc["id"]: {
+                f: {"expected": doc["expected"].get(f), "got": results[doc["id"]].get(f)}
+                for f, hit in field_hits(fields, doc["expected"], results[doc["id"]]).items()
+                if not hit
+            }
+            for doc in documents
+        },
+    }
+
+
+def bench_batch(extractor, documents, repeat, silent):
+    html_list = [doc["html"] for doc in documents]
+    walls = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        with quiet(silent):
+            frame = extractor.analyze_batch(html_list)
+        walls.append(time.perf_counter() - t0)
+    return {
+        "docs": len(html_list) * repeat,
+        "rows": len(frame),
+        "docs_per_s": round(len(html_list) * repeat / sum(walls), 2),
+        "wall_ms": summarize([w * 1000 for w in walls]),
+    }
+
+
+def bench_schema(results, documents, iterations):
+    ordered = [(doc, results[doc["id"]]) for doc in documents]
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        for _, result in ordered:
+            adapt_to_transaction_schema(result)
+    elapsed = time.perf_counter() - t0
+
+    hits = [schema_hits(doc["schema"], adapt_to_transaction_schema(result)) for doc, result in ordered]
+    return {
+        "docs": len(ordered) * iterations,
+        "docs_per_s": round(len(ordered) * iterations / elapsed, 2),
+        "schema_accuracy": accuracy(hits),
+    }
+
+
+def run_mode(mode, fields, documents, args):
+    t0 = time.perf_counter()
+    with quiet(not args.verbose):
+        extractor = UltraReceiptExtractor(use_ai=(mode == "ai"))
+    init_s = time.perf_counter() - t0
+
+    if mode == "ai" and not extractor.ai_available:
+        print("⚠️ Modo ai sin modelo disponible: se omite")
+        return {"skipped": "ai model unavailable", "init_s": round(init_s, 3)}
+
+    # Calentamiento: primera pasada de regex/tokenizer fuera de la medición
+    with quiet(True):
+        for doc in documents:
+            extractor.analyze(doc["html"])
+
+    results, analyze_report = bench_analyze(extractor, fields, documents, args.repeat, not args.verbose)
+    return {
+        "init_s": round(init_s, 3),
+        "ai_available": extractor.ai_available,
+        "analyze": analyze_report,
+        "analyze_batch": bench_batch(extractor, documents, args.repeat, not args.verbose),
+        "adapt_to_transaction_schema": bench_schema(results, documents, args.schema_iterations),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UltraReceiptExtractor micro-benchmark")
+    parser.add_argument("--modes", default="regex,ai", help="regex, ai o ambos separados por coma")
+    parser.add_argument("--repeat", type=int, default=5, help="pasadas sobre el corpus por modo")
+    parser.add_argument("--schema-iterations", type=int, default=2000)
+    parser.add_argument("--golden-dir", default=str(GOLDEN_DIR))
+    parser.add_argument("--verbose", action="store_true", help="no silenciar los print del extractor")
+    parser.add_argument("--out", help="JSON de salida (por defecto benchmarks/results/)")
+    args = parser.parse_args()
+
+    fields, documents = load_corpus(Path(args.golden_dir))
+    print(f"📚 Corpus golden: {len(documents)} documentos, "
+          f"{sum(len(d['html']) for d in documents) / 1024:.1f} KB")
+
+    results = {}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        print(f"⏱️ {mode}: {args.repeat} pasadas...")
+        results[mode] = run_mode(mode, fields, documents, args)
+
+    report = {
+        "benchmark": "extractor",
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": vars(args),
+        "corpus": {
+            "documents": len(documents),
+            "bytes_by_document": {d["id"]: len(d["html"].encode("utf-8")) for d in documents},
+        },
+        "results": results,
+    }
+
+    out = Path(args.out) if args.out else RESULTS_DIR / (
+        f"extractor_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}_{report['commit'] or 'nogit'}.json"
+    )
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+
+    for mode, result in results.items():
+        if "analyze" not in result:
+            continue
+        print(f"\n📊 {mode}: analyze {result['analyze']['docs_per_s']} docs/s, "
+              f"batch {result['analyze_batch']['docs_per_s']} docs/s, "
+              f"schema {result['adapt_to_transaction_schema']['docs_per_s']} docs/s")
+        print(f"   exactitud campos: {json.dumps(result['analyze']['field_accuracy'])}")
+        print(f"   exactitud esquema: "
+              f"{json.dumps(result['adapt_to_transaction_schema']['schema_accuracy'])}")
+    print(f"✅ Results saved to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
 # !pip install -q transformers torch beautifulsoup4 pandas lxml
 
+import os
 import re
 import json
+import time
+import inspect
+import threading
+from contextlib import contextmanager, nullcontext
+from bisect import bisect_left, bisect_right
 import pandas as pd
 from bs4 import BeautifulSoup
 from transformers import pipeline
@@ -10,13 +16,106 @@ from datetime import datetime
 import warnings
 warnings.filterwarnings('ignore')
 
+# Serializar las inferencias con un lock (opt-in): solo si el backend del
+# modelo no tolera llamadas concurrentes; con él, queue_ms es la espera del lock
+SERIALIZE_INFERENCE = os.getenv("AGENT_SERIALIZE_INFERENCE", "false").lower() in ("1", "true", "yes")
+
+class ContextSelector:
+    """
+    Selector de contexto para el fallback de IA.
+    Tokeniza el documento UNA sola vez y, para cada campo, elige las
+    ventanas de tokens con más hits del set de keywords compilado.
+    """
+
+    def __init__(self, tokenizer, context: str, max_seq_len: int = 384, top_k: int = 2):
+        self.context = context
+        self.max_seq_len = max_seq_len
+        self.top_k = max(1, top_k)
+        self.special_tokens = tokenizer.num_special_tokens_to_add(pair=True)
+
+        # Requiere tokenizer "fast" (offsets para volver a caracteres)
+        encoding = tokenizer(
+            context,
+            add_special_tokens=False,
+            return_offsets_mapping=True,
+            truncation=False,
+        )
+        self.input_ids = encoding['input_ids']
+        self.offsets = encoding['offset_mapping']
+        self._token_starts = [start for start, _ in self.offsets]
+
+    def _token_index(self, char_pos: int) -> int:
+        return max(0, bisect_right(self._token_starts, char_pos) - 1)
+
+    def select(self, keyword_re: re.Pattern, question_len: int) -> List[Tuple[int, int]]:
+        """
+        Retorna rangos de tokens [inicio, fin) ordenados por posición.
+        Los top-k rangos caben juntos en una sola secuencia del modelo.
+        """
+        total = len(self.input_ids)
+        # Margen para los separadores ' | ' entre ventanas
+        budget = self.max_seq_len - question_len - self.special_tokens - 2 * self.top_k
+        budget = max(32, budget)
+
+        if total <= budget:
+            return [(0, total)]
+
+        window = max(16, budget // self.top_k)
+        stride = max(1, window // 2)
+
+        hits = sorted(self._token_index(m.start()) for m in keyword_re.finditer(self.context))
+        if not hits:
+            # Sin keywords: el encabezado suele tener saludo y datos clave
+            return [(0, budget)]
+
+        starts = list(range(0, total - window + 1, stride))
+        if starts[-1] != total - window:
+            starts.append(total - window)
+
+        scored = []
+        for start in starts:
+            score = bisect_left(hits, start + window) - bisect_left(hits, start)
+            if score:
+                scored.append((-score, start))
+        scored.sort()
+
+        chosen = []
+        for _, start in scored:
+            if all(start >= s + window or start + window <= s for s in chosen):
+                chosen.append(start)
+            if len(chosen) == self.top_k:
+                break
+
+        return [(start, start + window) for start in sorted(chosen)]
+
+    def text(self, ranges: List[Tuple[int, int]]) -> str:
+        """Reconstruye el texto original de los rangos de tokens"""
+        return ' | '.join(
+            self.context[self.offsets[start][0]:self.offsets[end - 1][1]]
+            for start, end in ranges
+        )
+
+
 class UltraReceiptExtractor:
     """Extractor híbrido ultra-robusto para recibos HTML"""
     
-    def __init__(self):
+    def __init__(self, context_top_k: int = 2, shared_encoding: bool = True, use_ai: bool = True,
+                 serialize_inference: bool = SERIALIZE_INFERENCE):
         print("🧠 Inicializando extractor híbrido avanzado...")
-        self._init_ai_model()
+        self.context_top_k = context_top_k
+        # Una sola pasada del modelo para todas las preguntas de un documento
+        self.shared_encoding = shared_encoding
+        # Una inferencia a la vez solo si se pide; sin lock queue_ms es 0
+        self._model_lock = threading.Lock() if serialize_inference else None
+        # Tiempos por etapa del análisis en curso (por hilo de request)
+        self._local = threading.local()
+        if use_ai:
+            self._init_ai_model()
+        else:
+            print("⚠️ IA deshabilitada (modo solo regex)")
+            self.ai_available = False
         self.patterns = self._build_comprehensive_patterns()
+        self.ai_keywords = self._build_ai_keywords()
         print("✅ Sistema completamente configurado")
     
     def _init_ai_model(self):
@@ -27,12 +126,50 @@ class UltraReceiptExtractor:
                 model="mrm8488/distill-bert-base-spanish-wwm-cased-finetuned-spa-squad2-es",
                 tokenizer="mrm8488/distill-bert-base-spanish-wwm-cased-finetuned-spa-squad2-es"
             )
+            tokenizer = self.qa_pipeline.tokenizer
+            # model_max_length puede ser un centinela enorme: acotar al default del pipeline
+            self.max_seq_len = min(384, tokenizer.model_max_length or 384)
+            self._question_token_ids = {}
+            # DistilBERT no acepta token_type_ids
+            forward_params = inspect.signature(self.qa_pipeline.model.forward).parameters
+            self._accepts_token_type_ids = 'token_type_ids' in forward_params
             self.ai_available = True
             print("✅ Modelo IA cargado correctamente")
         except Exception as e:
             print(f"⚠️ IA no disponible (modo solo regex): {str(e)[:60]}")
             self.ai_available = False
     
+    @contextmanager
+    def _stage(self, stage: str, field: Optional[str] = None):
+        """Acumula ms de una etapa en los timings del análisis en curso (si hay)"""
+        timings = getattr(self._local, 'timings', None)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if timings is not None:
+                ms = (time.perf_counter() - started) * 1000
+                if field is None:
+                    timings[stage] = round(timings.get(stage, 0.0) + ms, 3)
+                else:
+                    timings.setdefault(stage, {})[field] = round(ms, 3)
+    
+    def _run_model(self, fn, batch_size: int):
+        """Ejecuta una inferencia (bajo el lock, si está activo) registrando espera y duración"""
+        requested = time.perf_counter()
+        with self._model_lock if self._model_lock is not None else nullcontext():
+            started = time.perf_counter()
+            try:
+                return fn()
+            finally:
+                timings = getattr(self._local, 'timings', None)
+                if timings is not None:
+                    timings.setdefault('inference', []).append({
+                        'batch_size': batch_size,
+                        'queue_ms': round((started - requested) * 1000, 3),
+                        'ms': round((time.perf_counter() - started) * 1000, 3),
+                    })
+    
     def _build_comprehensive_patterns(self) -> Dict:
         """Construye patrones regex exhaustivos con transformadores y confianza"""
         return {
@@ -127,6 +264,61 @@ class UltraReceiptExtractor:
             ],
         }
     
+    def _build_ai_keywords(self) -> Dict[str, re.Pattern]:
+        """Keywords compiladas por campo para puntuar ventanas de contexto"""
+        meses = 'enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre'
+        keywords = {
+            'Monto': r'monto|importe|total|S/',
+            'Fecha': rf'fecha|hora|{meses}|\d{{1,2}}/\d{{1,2}}/\d{{4}}',
+            'Operacion': r'operaci[oó]n|c[oó]digo|N[°º]',
+            'Origen': r'hola|yapero|remitente|origen|titular',
+            'Origen_Cuenta': r'celular|cuenta\s+cargo|origen|X{5,}',
+            'Destino': r'beneficiario|destino|yapeaste|enviado|para',
+            'Destino_Cuenta': r'beneficiario|destino|X{5,}',
+        }
+        compiled = {field: re.compile(kw, re.IGNORECASE) for field, kw in keywords.items()}
+        compiled['default'] = re.compile(r'yapero|beneficiario|operaci[oó]n|monto|celular', re.IGNORECASE)
+        return compiled
+    
+    def _build_selector(self, context: str) -> Optional[ContextSelector]:
+        """Crea el selector de contexto (una tokenización por documento)"""
+        if not self.ai_available:
+            return None
+        try:
+            return ContextSelector(
+                self.qa_pipeline.tokenizer,
+                context,
+                max_seq_len=self.max_seq_len,
+                top_k=self.context_top_k,
+            )
+        except Exception:
+            # Tokenizer lento (sin offsets): se usa el recorte heurístico
+            return None
+    
+    def _question_ids(self, question: str) -> List[int]:
+        """Token ids de la pregunta (las preguntas son fijas: se cachean)"""
+        if question not in self._question_token_ids:
+            ids = self.qa_pipeline.tokenizer(question, add_special_tokens=False)['input_ids']
+            self._question_token_ids[question] = ids
+        return self._question_token_ids[question]
+    
+    def _truncate_context(self, context: str) -> str:
+        """Recorte heurístico (fallback sin selector): inicio + primera sección clave"""
+        lines = context.split('\n')
+        relevant_parts = []
+        
+        # Tomar inicio (saludo, encabezado)
+        relevant_parts.append('\n'.join(lines[:25]))
+        
+        # Buscar sección con datos clave
+        for i, line in enumerate(lines):
+            if any(kw in line.lower() for kw in 
+                  ['yapero', 'beneficiario', 'operación', 'monto', 'celular']):
+                relevant_parts.append('\n'.join(lines[max(0,i-5):min(len(lines),i+25)]))
+                break
+        
+        return ' | '.join(relevant_parts)[:2000]
+    
     def _clean_name(self, name: str) -> str:
         """Limpia y normaliza nombres propios"""
         name = re.sub(r'\s+', ' ', name).strip()
@@ -170,6 +362,29 @@ class UltraReceiptExtractor:
         
         return structured_text, html_clean
     
+    def clean_canonical(self, canonical: Dict) -> Tuple[str, str]:
+        """
+        Equivalente a clean_html() a partir de la representación canónica
+        que envía el servicio IMAP (lines, tables), sin volver a parsear.
+        Desde la versión 2 no trae html: la pasada "html" de los patrones
+        corre sobre las líneas separadas por salto de línea.
+        """
+        lines = canonical.get('lines') or []
+        text = ' | '.join(lines)
+        text = re.sub(r'\s+', ' ', text)
+        text = re.sub(r'\|\s+\|', '|', text)
+        
+        # Celdas iguales a una línea llegan como su índice en `lines`
+        cell = lambda c: lines[c] if isinstance(c, int) and 0 <= c < len(lines) else str(c)
+        table_data = [f"{cell(row[0])}: {cell(row[1])}" for row in canonical.get('tables') or []
+                      if len(row) >= 2]
+        if table_data:
+            structured_text = '\n'.join(table_data) + '\n\n' + text
+        else:
+            structured_text = text
+        
+        return structured_text, canonical.get('html') or '\n'.join(lines)
+    
     def extract_with_patterns(self, html: str, text: str, field: str) -> Optional[Dict]:
         """
         Extrae usando patrones regex con validación exhaustiva
@@ -298,30 +513,30 @@ class UltraReceiptExtractor:
         
         return True
     
-    def extract_with_ai(self, context: str, question: str, min_score: float = 0.02) -> Optional[Dict]:
-        """Extracción con IA optimizada para contextos largos"""
+    def extract_with_ai(self, context: str, question: str, min_score: float = 0.02,
+                        field: Optional[str] = None,
+                        selector: Optional[ContextSelector] = None) -> Optional[Dict]:
+        """
+        Extracción con IA optimizada para contextos largos.
+        Con selector, la pregunta recibe solo las ventanas relevantes del campo.
+        """
         if not self.ai_available or len(context) < 50:
             return None
         
         try:
             # Optimizar contexto para IA
-            if len(context) > 1500:
-                lines = context.split('\n')
-                relevant_parts = []
-                
-                # Tomar inicio (saludo, encabezado)
-                relevant_parts.append('\n'.join(lines[:25]))
-                
-                # Buscar sección con datos clave
-                for i, line in enumerate(lines):
-                    if any(kw in line.lower() for kw in 
-                          ['yapero', 'beneficiario', 'operación', 'monto', 'celular']):
-                        relevant_parts.append('\n'.join(lines[max(0,i-5):min(len(lines),i+25)]))
-                        break
-                
-                context = ' | '.join(relevant_parts)[:2000]
+            if selector is not None:
+                keyword_re = self.ai_keywords.get(field, self.ai_keywords['default'])
+                ranges = selector.select(keyword_re, len(self._question_ids(question)))
+                context = selector.text(ranges)
+            elif len(context) > 1500:
+                context = self._truncate_context(context)
             
-            result = self.qa_pipeline(question=question, context=context)
+            with self._stage('qa_ms', field or 'unknown'):
+                result = self._run_model(
+                    lambda: self.qa_pipeline(question=question, context=context,
+                                             max_seq_len=self.max_seq_len),
+                    batch_size=1)
             
             if result['score'] >= min_score:
                 value = result['answer'].strip(' .:,<>/\\')
@@ -337,11 +552,152 @@ class UltraReceiptExtractor:
         
         return None
     
-    def analyze(self, html: str) -> Dict:
-        """Análisis completo híbrido con todas las capas de fallback"""
-        # Limpieza y preparación
-        text, html_clean = self.clean_html(html)
+    def extract_with_ai_batch(self, context: str, questions: Dict[str, str],
+                              selector: Optional[ContextSelector] = None,
+                              min_score: float = 0.02) -> Dict[str, Optional[Dict]]:
+        """
+        Responde todas las preguntas pendientes de un documento.
+        Con encoding compartido se reutilizan los token ids del selector y
+        se ejecuta UNA sola llamada al modelo para todo el lote.
+        """
+        if not questions:
+            return {}
+        
+        if self.ai_available and self.shared_encoding and selector is not None:
+            try:
+                with self._stage('qa_ms', 'shared'):
+                    return self._answer_shared(selector, questions, min_score)
+            except Exception as e:
+                print(f"⚠️ Encoding compartido falló, usando preguntas individuales: {str(e)[:60]}")
         
+        return {
+            field: self.extract_with_ai(context, question, min_score=min_score,
+                                        field=field, selector=selector)
+            for field, question in questions.items()
+        }
+    
+    @staticmethod
+    def _pair_inputs(tokenizer, q_ids: List[int], ctx_ids: List[int]) -> Tuple[List[int], List[int]]:
+        """
+        (input_ids, token_type_ids) de [pregunta, contexto] ya tokenizados.
+        transformers 5 quitó build_inputs_with_special_tokens de los
+        tokenizers rápidos: ahí se arma a mano el layout BERT del modelo.
+        """
+        if hasattr(tokenizer, 'build_inputs_with_special_tokens'):
+            return (tokenizer.build_inputs_with_special_tokens(q_ids, ctx_ids),
+                    tokenizer.create_token_type_ids_from_sequences(q_ids, ctx_ids))
+        cls_id, sep_id = tokenizer.cls_token_id, tokenizer.sep_token_id
+        input_ids = [cls_id, *q_ids, sep_id, *ctx_ids, sep_id]
+        return input_ids, [0] * (len(q_ids) + 2) + [1] * (len(ctx_ids) + 1)
+    
+    def _answer_shared(self, selector: ContextSelector, questions: Dict[str, str],
+                       min_score: float, max_answer_len: int = 15) -> Dict[str, Optional[Dict]]:
+        """Arma el batch [pregunta + ventanas] desde el encoding cacheado y decodifica spans"""
+        import torch
+        
+        tokenizer = self.qa_pipeline.tokenizer
+        model = self.qa_pipeline.model
+        
+        features = []
+        for field, question in questions.items():
+            q_ids = self._question_ids(question)
+            keyword_re = self.ai_keywords.get(field, self.ai_keywords['default'])
+            ranges = selector.select(keyword_re, len(q_ids))
+            
+            ctx_ids, ctx_tokens, ctx_segments = [], [], []
+            for segment, (start, end) in enumerate(ranges):
+                ctx_ids.extend(selector.input_ids[start:end])
+                ctx_tokens.extend(range(start, end))
+                ctx_segments.extend([segment] * (end - start))
+            
+            input_ids, token_type_ids = self._pair_inputs(tokenizer, q_ids, ctx_ids)
+            ctx_start = token_type_ids.index(1) if 1 in token_type_ids else len(q_ids) + 2
+            features.append((field, input_ids, token_type_ids, ctx_start, ctx_tokens, ctx_segments))
+        
+        max_len = max(len(f[1]) for f in features)
+        pad_id = tokenizer.pad_token_id or 0
+        batch_ids, batch_types, batch_mask = [], [], []
+        for _, input_ids, token_type_ids, _, _, _ in features:
+            padding = max_len - len(input_ids)
+            batch_ids.append(input_ids + [pad_id] * padding)
+            batch_types.append(token_type_ids + [0] * padding)
+            batch_mask.append([1] * len(input_ids) + [0] * padding)
+        
+        inputs = {
+            'input_ids': torch.tensor(batch_ids, device=model.device),
+            'attention_mask': torch.tensor(batch_mask, device=model.device),
+        }
+        if self._accepts_token_type_ids:
+            inputs['token_type_ids'] = torch.tensor(batch_types, device=model.device)
+        
+        def _forward():
+            with torch.no_grad():
+                return model(**inputs)
+        
+        outputs = self._run_model(_forward, batch_size=len(features))
+        
+        answers = {}
+        for i, (field, _, _, ctx_start, ctx_tokens, ctx_segments) in enumerate(features):
+            n = len(ctx_tokens)
+            if n == 0:
+                answers[field] = None
+                continue
+            
+            # Softmax solo sobre tokens de contexto (como el pipeline)
+            p_start = torch.softmax(outputs.start_logits[i, ctx_start:ctx_start + n].float(), dim=-1)
+            p_end = torch.softmax(outputs.end_logits[i, ctx_start:ctx_start + n].float(), dim=-1)
+            
+            scores = torch.outer(p_start, p_end)
+            scores = torch.triu(scores) - torch.triu(scores, diagonal=max_answer_len)
+            # Un span no puede cruzar el corte entre dos ventanas
+            segments = torch.tensor(ctx_segments, device=scores.device)
+            scores = scores * (segments[:, None] == segments[None, :])
+            
+            best = int(torch.argmax(scores))
+            start, end = divmod(best, n)
+            score = float(scores[start, end])
+            
+            if score < min_score:
+                answers[field] = None
+                continue
+            
+            char_start = selector.offsets[ctx_tokens[start]][0]
+            char_end = selector.offsets[ctx_tokens[end]][1]
+            value = selector.context[char_start:char_end].strip(' .:,<>/\\')
+            
+            answers[field] = {
+                'value': value,
+                'confidence': round(score, 3),
+                'method': 'ai'
+            }
+        
+        return answers
+    
+    def analyze(self, html: str, timings: Optional[Dict] = None) -> Dict:
+        """
+        Análisis completo híbrido con todas las capas de fallback.
+        Si se pasa `timings` (dict), se llena con los ms de cada etapa.
+        """
+        self._local.timings = timings
+        try:
+            # Limpieza y preparación
+            with self._stage('clean_ms'):
+                text, html_clean = self.clean_html(html)
+            return self._analyze_clean(text, html_clean)
+        finally:
+            self._local.timings = None
+    
+    def analyze_canonical(self, canonical: Dict, timings: Optional[Dict] = None) -> Dict:
+        """Igual que analyze() pero con el HTML ya preprocesado por el servicio IMAP"""
+        self._local.timings = timings
+        try:
+            with self._stage('clean_ms'):
+                text, html_clean = self.clean_canonical(canonical)
+            return self._analyze_clean(text, html_clean)
+        finally:
+            self._local.timings = None
+    
+    def _analyze_clean(self, text: str, html_clean: str) -> Dict:
         if len(text) < 50:
             return {"error": "Contenido HTML insuficiente para análisis"}
         
@@ -358,38 +714,53 @@ class UltraReceiptExtractor:
             'Destino_Cuenta': '¿Cuál es el celular del beneficiario?',
         }
         
+        fields = ['Monto', 'Fecha', 'Operacion', 'Origen', 'Origen_Cuenta',
+                  'Destino', 'Destino_Cuenta']
+        
+        # NIVEL 1: Regex en HTML estructurado
+        extracted = {}
+        for field in fields:
+            with self._stage('regex_ms', field):
+                extracted[field] = self.extract_with_patterns(html_clean, text, field)
+        
+        # NIVEL 2: IA como fallback (todas las preguntas pendientes juntas)
+        pending = {field: ai_questions[field] for field in fields
+                   if not extracted[field] and field in ai_questions}
+        if pending and self.ai_available and len(text) >= 50:
+            # Se tokeniza solo si algún campo necesita IA
+            selector = self._build_selector(text)
+            ai_results = self.extract_with_ai_batch(text, pending, selector=selector)
+        else:
+            ai_results = {}
+        
         results = {}
         used_accounts = set()
         
-        # Extracción ordenada por prioridad
-        for field in ['Monto', 'Fecha', 'Operacion', 'Origen', 'Origen_Cuenta',
-                      'Destino', 'Destino_Cuenta']:
-            
-            result = None
-            
-            # NIVEL 1: Regex en HTML estructurado
-            result = self.extract_with_patterns(html_clean, text, field)
-            
-            # NIVEL 2: IA como fallback
-            if not result and field in ai_questions:
-                result = self.extract_with_ai(text, ai_questions[field])
+        # Validación y armado ordenados por prioridad
+        with self._stage('validation_ms'):
+            for field in fields:
+                
+                result = extracted[field]
                 
-                # Validar output de IA
+                if not result and field in ai_results:
+                    result = ai_results[field]
+                    
+                    # Validar output de IA
+                    if result:
+                        if not self._validate_value(field, result['value'], used_accounts):
+                            result = None
+                        elif field in ['Origen_Cuenta', 'Destino_Cuenta']:
+                            used_accounts.add(result['value'])
+                
+                # Guardar resultados
                 if result:
-                    if not self._validate_value(field, result['value'], used_accounts):
-                        result = None
-                    elif field in ['Origen_Cuenta', 'Destino_Cuenta']:
-                        used_accounts.add(result['value'])
-            
-            # Guardar resultados
-            if result:
-                results[field] = result['value']
-                results[f'{field}_confianza'] = result['confidence']
-                results[f'{field}_metodo'] = result['method']
-            else:
-                results[field] = None
-                results[f'{field}_confianza'] = 0.0
-                results[f'{field}_metodo'] = 'none'
+                    results[field] = result['value']
+                    results[f'{field}_confianza'] = result['confidence']
+                    results[f'{field}_metodo'] = result['method']
+                else:
+                    results[field] = None
+                    results[f'{field}_confianza'] = 0.0
+                    results[f'{field}_metodo'] = 'none'
         
         # Campos derivados con alta confianza
         results['Moneda'] = 'PEN' if results.get('Monto') else None
@@ -1,7 +1,14 @@
-from fastapi import FastAPI, HTTPException
+import time
+from fastapi import FastAPI, HTTPException, Response, Header, Query
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Union
 from extractor import UltraReceiptExtractor, adapt_to_transaction_schema
+from metrics import timed_request, record_analysis, render_latest
+from tracing import span, timing_attributes
+from profiling import (
+    maybe_profile, profile_requested, profiling_available, list_profiles, profile_path
+)
 
 app = FastAPI(
     title="Ultra Receipt Extractor API",
@@ -21,17 +28,72 @@ class ExtractRequest(BaseModel):
 class BatchRequest(BaseModel):
     html_list: List[str]
 
+class CanonicalEmail(BaseModel):
+    version: int = 1
+    lines: List[str] = []
+    tables: List[List[Union[int, str]]] = []  # int = índice en lines
+    html: str = ""
+
+class CanonicalRequest(BaseModel):
+    canonical: CanonicalEmail
+    formato: Optional[str] = "dict"
+    detalles: Optional[bool] = False
+
 # =========================
 # ENDPOINTS
 # =========================
 @app.post("/extract")
-def extract_receipt(req: ExtractRequest):
+def extract_receipt(
+    req: ExtractRequest,
+    response: Response,
+    profile: bool = Query(default=False),
+    x_profile: Optional[str] = Header(default=None),
+    traceparent: Optional[str] = Header(default=None)
+):
     if len(req.html.strip()) < 50:
         raise HTTPException(status_code=400, detail="HTML insuficiente")
 
-    raw = extractor.analyze(req.html)
+    timings = {}
+    started = time.perf_counter()
+    with span("agent.extract", kind="server", traceparent=traceparent) as request_span:
+        with maybe_profile("extract", profile_requested(profile, x_profile), response), \
+                timed_request("extract"):
+            raw = extractor.analyze(req.html, timings=timings)
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        request_span.set(**timing_attributes(timings))
+    record_analysis(raw, timings)
+    adapted = adapt_to_transaction_schema(raw)
+
+    if req.detalles:
+        adapted["timings"] = timings
+    return adapted
+
+
+@app.post("/extract/canonical")
+def extract_canonical(
+    req: CanonicalRequest,
+    response: Response,
+    profile: bool = Query(default=False),
+    x_profile: Optional[str] = Header(default=None),
+    traceparent: Optional[str] = Header(default=None)
+):
+    """Extracción sobre el HTML ya preprocesado por el servicio IMAP (sin re-parsear)"""
+    if not req.canonical.lines and len(req.canonical.html.strip()) < 50:
+        raise HTTPException(status_code=400, detail="Contenido insuficiente")
+
+    timings = {}
+    started = time.perf_counter()
+    with span("agent.canonical", kind="server", traceparent=traceparent) as request_span:
+        with maybe_profile("canonical", profile_requested(profile, x_profile), response), \
+                timed_request("canonical"):
+            raw = extractor.analyze_canonical(req.canonical.dict(), timings=timings)
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        request_span.set(**timing_attributes(timings))
+    record_analysis(raw, timings)
     adapted = adapt_to_transaction_schema(raw)
 
+    if req.detalles:
+        adapted["timings"] = timings
     return adapted
 
 
@@ -40,10 +102,32 @@ def extract_batch(req: BatchRequest):
     if not req.html_list:
         raise HTTPException(status_code=400, detail="Lista vacía")
 
-    df = extractor.analyze_batch(req.html_list)
+    with timed_request("batch"):
+        df = extractor.analyze_batch(req.html_list)
     return df.to_dict(orient="records")
 
 
+@app.get("/profiles")
+def get_profiles(limit: int = Query(default=50, ge=1, le=500)):
+    """Perfiles guardados por ?profile=true / X-Profile, más recientes primero"""
+    return {"profiling_available": profiling_available(), "profiles": list_profiles(limit)}
+
+
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = Query(default="html")):
+    path = profile_path(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "text/html" if format == "html" else "application/json"
+    return FileResponse(path, media_type=media_type, filename=path.name)
+
+
+@app.get("/metrics")
+def metrics():
+    payload, content_type = render_latest()
+    return Response(content=payload, media_type=content_type)
+
+
 @app.get("/health")
 def health():
     return {
@@ -0,0 +1,63 @@
+"""
+Métricas Prometheus del agente de extracción (expuestas en GET /metrics).
+
+Se alimentan del dict `timings` que llena UltraReceiptExtractor.analyze()
+y de los `{campo}_metodo` del resultado.
+"""
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+MS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+REQUEST_SECONDS = Histogram(
+    "agent_request_seconds", "Extraction request latency", ["endpoint"]
+)
+STAGE_MS = Histogram(
+    "agent_stage_ms", "Time per analysis stage (ms)", ["stage", "field"], buckets=MS_BUCKETS
+)
+FIELD_METHOD = Counter(
+    "agent_field_method_total", "How each field was resolved", ["field", "method"]
+)
+INFERENCE_BATCH_SIZE = Histogram(
+    "agent_inference_batch_size", "Questions per model forward pass", buckets=(1, 2, 3, 4, 5, 6, 7, 8, 16)
+)
+INFERENCE_QUEUE_MS = Histogram(
+    "agent_inference_queue_ms", "Wait for the model lock (ms, 0 unless AGENT_SERIALIZE_INFERENCE)", buckets=MS_BUCKETS
+)
+INFERENCE_MS = Histogram(
+    "agent_inference_ms", "Model forward pass (ms)", buckets=MS_BUCKETS
+)
+
+
+@contextmanager
+def timed_request(endpoint: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        REQUEST_SECONDS.labels(endpoint=endpoint).observe(time.perf_counter() - started)
+
+
+def record_analysis(result: dict, timings: dict):
+    """Registra timings por etapa y el método (_metodo) de cada campo"""
+    for stage, value in timings.items():
+        if stage == "inference":
+            for run in value:
+                INFERENCE_BATCH_SIZE.observe(run["batch_size"])
+                INFERENCE_QUEUE_MS.observe(run["queue_ms"])
+                INFERENCE_MS.observe(run["ms"])
+        elif isinstance(value, dict):
+            for field, ms in value.items():
+                STAGE_MS.labels(stage=stage, field=field).observe(ms)
+        else:
+            STAGE_MS.labels(stage=stage, field="").observe(value)
+
+    for key, method in result.items():
+        if key.endswith("_metodo"):
+            FIELD_METHOD.labels(field=key[:-len("_metodo")], method=method).inc()
+
+
+def render_latest():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,139 @@
+"""
+Profiling por request con muestreo (pyinstrument), opt-in por flag.
+
+Un request con `?profile=true` o `X-Profile: 1` corre bajo el profiler y
+deja en PROFILE_DIR:
+    <id>.html             flamegraph navegable de pyinstrument
+    <id>.speedscope.json  para https://www.speedscope.app
+    <id>.meta.json        endpoint, duración y archivos
+
+El id vuelve en el header X-Profile-Id. Sin flag no se crea profiler ni se
+toca el request: `maybe_profile` devuelve un nullcontext.
+
+Solo se muestrea el hilo del request (FastAPI corre los endpoints sync en
+el threadpool): el forward del modelo aparece dentro de analyze().
+
+Versión reducida de imap/app/profiling.py (sin tenant ni perfiles anidados):
+mismos archivos, mismo header y mismas variables de entorno PROFILING_ENABLED,
+PROFILE_DIR, PROFILE_INTERVAL y PROFILE_MAX_FILES que en el servicio IMAP.
+"""
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:  # dependencia opcional
+    Profiler = None
+    SpeedscopeRenderer = None
+
+PROFILE_HEADER = "X-Profile-Id"
+FORMATS = {"html": ".html", "speedscope": ".speedscope.json"}
+_ID_RE = re.compile(r"^[\w-]+$")
+
+
+def profiling_available() -> bool:
+    return PROFILING_ENABLED and Profiler is not None
+
+
+def profile_requested(flag, header) -> bool:
+    """
+    ?profile=true o X-Profile: 1|true|yes. Compara por identidad/tipo para
+    que los defaults Query()/Header() de una llamada directa cuenten como off.
+    """
+    if flag is True:
+        return True
+    return isinstance(header, str) and header.strip().lower() in ("1", "true", "yes")
+
+
+def maybe_profile(endpoint: str, requested: bool, response=None):
+    """Context manager: profiler real si se pidió y está disponible, si no nullcontext"""
+    if not requested:
+        return nullcontext()
+    if not profiling_available():
+        print("⚠️ Profiling solicitado pero deshabilitado o sin pyinstrument")
+        return nullcontext()
+    return _profile(endpoint, response)
+
+
+@contextmanager
+def _profile(endpoint: str, response):
+    profile_id = f"{endpoint}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    if response is not None:
+        response.headers[PROFILE_HEADER] = profile_id
+
+    profiler = Profiler(interval=PROFILE_INTERVAL, async_mode="disabled")
+    started_at = datetime.utcnow().isoformat()
+    started = time.perf_counter()
+    profiler.start()
+    try:
+        yield profile_id
+    finally:
+        profiler.stop()
+        duration = time.perf_counter() - started
+        try:
+            _save(profiler, profile_id, {
+                "id": profile_id,
+                "endpoint": endpoint,
+                "started_at": started_at,
+                "duration_ms": round(duration * 1000, 1),
+            })
+        except Exception as e:
+            print(f"❌ Could not save profile {profile_id}: {e}")
+
+
+def _save(profiler, profile_id: str, meta: dict):
+    directory = Path(PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    (directory / f"{profile_id}.html").write_text(profiler.output_html(), encoding="utf-8")
+    (directory / f"{profile_id}.speedscope.json").write_text(
+        profiler.output(renderer=SpeedscopeRenderer()), encoding="utf-8"
+    )
+    meta["formats"] = list(FORMATS)
+    (directory / f"{profile_id}.meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    print(f"🔬 Profile {profile_id} saved ({meta['duration_ms']} ms)")
+    _prune(directory)
+
+
+def _prune(directory: Path):
+    metas = sorted(directory.glob("*.meta.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for meta in metas[PROFILE_MAX_FILES:]:
+        profile_id = meta.name[:-len(".meta.json")]
+        for suffix in (".meta.json", *FORMATS.values()):
+            (directory / f"{profile_id}{suffix}").unlink(missing_ok=True)
+
+
+def list_profiles(limit: int = 50) -> list:
+    """Perfiles guardados, más recientes primero"""
+    directory = Path(PROFILE_DIR)
+    if not directory.exists():
+        return []
+    metas = sorted(directory.glob("*.meta.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    profiles = []
+    for path in metas[:limit]:
+        try:
+            profiles.append(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(profile_id: str, fmt: str = "html") -> Optional[Path]:
+    """Archivo del perfil, o None si el id/formato no es válido o no existe"""
+    if fmt not in FORMATS or not _ID_RE.match(profile_id):
+        return None
+    path = Path(PROFILE_DIR) / f"{profile_id}{FORMATS[fmt]}"
+    return path if path.exists() else None
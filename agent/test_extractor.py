@@ -0,0 +1,92 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from extractor import ContextSelector, UltraReceiptExtractor
+
+WORDS = ["yapeaste", "monto", "operacion", "beneficiario", "relleno", "a", "juan", "s/", "25.50", "nro", "123",
+         "cual", "es", "el", "la", "de"]
+KEYWORD = re.compile("monto")
+
+
+@pytest.fixture(scope="module")
+def tokenizer(tmp_path_factory):
+    vocab = tmp_path_factory.mktemp("tok") / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", *WORDS]) + "\n")
+    return transformers.BertTokenizerFast(str(vocab), do_lower_case=True)
+
+
+def _context(total, keyword_at):
+    # Una palabra = un token: el índice de palabra es el índice de token
+    return " ".join("monto" if i in keyword_at else "relleno" for i in range(total))
+
+
+def test_select_short_context_is_whole(tokenizer):
+    selector = ContextSelector(tokenizer, "yapeaste monto a juan", max_seq_len=64)
+    assert selector.select(KEYWORD, question_len=4) == [(0, 4)]
+
+
+def test_select_skips_windows_overlapping_a_chosen_one(tokenizer):
+    dense = set(range(40, 56, 2))   # 8 hits: varias ventanas solapadas puntúan alto
+    sparse = {150, 153, 156}
+    selector = ContextSelector(tokenizer, _context(200, dense | sparse), max_seq_len=64, top_k=2)
+    question_len = 4
+    ranges = selector.select(KEYWORD, question_len)
+
+    assert len(ranges) == 2
+    assert ranges == sorted(ranges)
+    (a_start, a_end), (b_start, b_end) = ranges
+    assert a_end <= b_start
+    assert all(a_start <= hit < a_end for hit in dense)
+    assert all(b_start <= hit < b_end for hit in sparse)
+    # Las ventanas elegidas entran juntas en una secuencia del modelo
+    used = sum(end - start for start, end in ranges) + question_len + selector.special_tokens + 2 * 2
+    assert used <= selector.max_seq_len
+
+
+def test_select_without_hits_uses_header(tokenizer):
+    selector = ContextSelector(tokenizer, _context(200, set()), max_seq_len=64)
+    assert selector.select(KEYWORD, question_len=4) == [(0, 53)]
+
+
+@pytest.fixture
+def extractor(tokenizer):
+    torch.manual_seed(0)
+    config = transformers.BertConfig(
+        vocab_size=tokenizer.vocab_size, hidden_size=32, num_hidden_layers=1,
+        num_attention_heads=2, intermediate_size=37, max_position_embeddings=128,
+    )
+    model = transformers.BertForQuestionAnswering(config).eval()
+
+    ext = UltraReceiptExtractor(use_ai=False)
+    ext.qa_pipeline = SimpleNamespace(tokenizer=tokenizer, model=model)
+    ext.ai_available = True
+    ext.max_seq_len = 64
+    ext._question_token_ids = {}
+    ext._accepts_token_type_ids = True
+    return ext
+
+
+def test_shared_encoding_answers_all_fields_in_one_call(extractor):
+    context = "yapeaste s/ 25.50 a juan " + _context(150, {60, 62, 120}) + " nro de operacion 123"
+    selector = extractor._build_selector(context)
+    questions = {
+        "monto": "cual es el monto",
+        "beneficiario": "cual es el beneficiario",
+        "numero_operacion": "cual es la operacion",
+    }
+    extractor._local.timings = {}
+
+    answers = extractor.extract_with_ai_batch(context, questions, selector=selector, min_score=0.0)
+
+    inference = extractor._local.timings["inference"]
+    assert len(inference) == 1
+    assert inference[0]["batch_size"] == len(questions)
+    assert set(answers) == set(questions)
+    for answer in answers.values():
+        assert answer["method"] == "ai"
+        assert answer["value"] in context
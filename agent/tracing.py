@@ -0,0 +1,247 @@
+"""
+Spans del agente unidos al trace del servicio IMAP.
+
+/extract y /extract/canonical leen el header `traceparent` (W3C Trace
+Context) que envía la ingesta y abren un span server hijo del
+`agent.extract` del email, con los ms por etapa del análisis como
+atributos. Sin header se abre un trace nuevo.
+
+Export por lotes en un hilo aparte: TRACE_EXPORTER = none | file (JSONL en
+TRACE_FILE) | otlp (OTLP/HTTP JSON a OTLP_TRACES_ENDPOINT).
+
+Versión reducida de imap/app/tracing.py: solo un span server por request
+(sin spans hijos ni propagación saliente). Mantener en sync con ese módulo
+el formato de traceparent, el registro JSONL / OTLP y los nombres de las
+variables TRACE_*; un trace se arma juntando los spans de ambos servicios.
+"""
+import atexit
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+import urllib.request
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").strip().lower()
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("traces", "spans.jsonl"))
+OTLP_TRACES_ENDPOINT = os.getenv("OTLP_TRACES_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "receipt-agent")
+TRACE_EXPORT_BATCH = int(os.getenv("TRACE_EXPORT_BATCH", "200"))
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", "2"))
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+OTLP_KIND = {"internal": 1, "server": 2, "client": 3}
+
+
+class Span:
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "kind", "attributes",
+        "start_ns", "end_ns", "_started", "duration_ms", "error",
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: str, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.end_ns = None
+        self.duration_ms = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def record_error(self, exc: BaseException):
+        self.error = f"{type(exc).__name__}: {exc}"[:500]
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 3)
+        self.end_ns = self.start_ns + int(self.duration_ms * 1e6)
+        _export(self)
+
+    def to_record(self) -> dict:
+        """Una línea del JSONL local"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": TRACE_SERVICE_NAME,
+            "start": datetime.fromtimestamp(self.start_ns / 1e9, tz=timezone.utc).isoformat(),
+            "duration_ms": self.duration_ms,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": OTLP_KIND.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def parse_traceparent(value) -> Optional[tuple]:
+    """(trace_id, parent_span_id) de un header traceparent válido, si no None"""
+    if not isinstance(value, str):
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    return match.groups() if match else None
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", traceparent: str = None, **attributes):
+    """Span hijo del traceparent recibido (o raíz de un trace nuevo)"""
+    trace_id, parent_id = parse_traceparent(traceparent) or (secrets.token_hex(16), None)
+    current = Span(name, trace_id, parent_id, kind, attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        current.end()
+
+
+def timing_attributes(timings: dict) -> dict:
+    """Aplana el dict timings de analyze() a atributos del span (ms por etapa)"""
+    attributes = {}
+    for stage, value in timings.items():
+        if stage == "inference":
+            attributes["inference.runs"] = len(value)
+            attributes["inference.ms"] = round(sum(run["ms"] for run in value), 3)
+            attributes["inference.queue_ms"] = round(sum(run["queue_ms"] for run in value), 3)
+        elif isinstance(value, dict):
+            attributes[stage] = round(sum(value.values()), 3)
+        else:
+            attributes[stage] = value
+    return attributes
+
+
+# ============================================================================
+# EXPORT
+# ============================================================================
+
+class SpanExporter:
+    """Cola + hilo daemon: exporta por lotes sin bloquear el request"""
+
+    def __init__(self, kind: str, batch_size: int = TRACE_EXPORT_BATCH,
+                 interval: float = TRACE_EXPORT_INTERVAL):
+        self.kind = kind
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=batch_size * 50)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, finished: Span):
+        try:
+            self.queue.put_nowait(finished)
+        except queue.Full:
+            pass  # Cola llena: se pierde el span, nunca se frena el request
+
+    def _drain(self, first=None) -> list:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first))
+
+    def flush(self):
+        batch = self._drain()
+        while batch:
+            self._write(batch)
+            batch = self._drain()
+
+    def _write(self, batch: list):
+        try:
+            if self.kind == "otlp":
+                self._post_otlp(batch)
+            else:
+                self._append_jsonl(batch)
+        except Exception as e:
+            print(f"⚠️ Could not export {len(batch)} spans ({self.kind}): {e}")
+
+    def _append_jsonl(self, batch: list):
+        os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            for finished in batch:
+                f.write(json.dumps(finished.to_record(), ensure_ascii=False, default=str) + "\n")
+
+    def _post_otlp(self, batch: list):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", TRACE_SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "agent"}, "spans": [s.to_otlp() for s in batch]}],
+        }]}
+        request = urllib.request.Request(
+            OTLP_TRACES_ENDPOINT, data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=5):
+            pass
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> Optional[SpanExporter]:
+    global _exporter
+    if TRACE_EXPORTER not in ("file", "otlp"):
+        return None
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = SpanExporter(TRACE_EXPORTER)
+    return _exporter
+
+
+def _export(finished: Span):
+    exporter = get_exporter()
+    if exporter is not None:
+        exporter.submit(finished)
+
@@ -1,23 +1,45 @@
+import time
+_import_started = time.perf_counter()
+
 from pydantic import BaseModel
-from .db import email_setup_col, imap_config_col, raw_emails_col, processed_emails_col, get_tenant_db
-from fastapi import FastAPI, Query, Header
+from .db import get_tenant_collections
+from .resources import record_phase, get_startup_report
+from .body_codec import encode_bodies, decode_bodies, expand_bodies, BODY_FIELDS
+from .parser_registry import get_parser_registry
+from .html_preprocess import preprocess_html, canonical_json
+from .tenant_cache import (
+    invalidate_setups, invalidate_imap_config, get_cache_stats, start_change_stream_invalidator
+)
+from .config import TENANT_CACHE_CHANGE_STREAM
+from .keyword_matcher import get_refund_matcher, get_matcher_stats
+from .metrics import (
+    AGENT_SECONDS, AGENT_ERRORS, MONGO_INSERT_SECONDS, MESSAGES_STORED,
+    timed, filtered, observe_lag, tenant_label, render_latest,
+)
+from .tracing import span, start_span, propagation_headers, get_trace_stats
+from .config import TRACE_SLOW_EMAIL_MS, IA_CONNECT_TIMEOUT, EXTRACTION_WORKER_ENABLED
+from .circuit_breaker import get_agent_breaker
+from .extraction_queue import (
+    AgentUnavailable, PENDING, mark_pending, mark_pending_tenant, apply_payload,
+    start_extraction_worker, wake_worker, get_queue_stats,
+)
+from .profiling import profiling_available, maybe_profile, profile_requested, list_profiles, profile_path
+from fastapi import FastAPI, Query, Header, Response
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .ingest_email import connect_and_download_pdfs
+from .ingest_email import connect_and_download_pdfs, release_attachments
 from datetime import datetime, timedelta
-import re
 import logging
 from bson import ObjectId
 from fastapi import HTTPException
 from typing import Optional
-from pymongo import MongoClient
-from .config import MONGO_URI, MONGO_DB
-from bs4 import BeautifulSoup
 import requests
 from datetime import datetime
 import dotenv
 import os
 dotenv.load_dotenv()
 IA_EXTRACT_URL = os.getenv("IA_EXTRACT_URL") or "http://localhost:8080/extract"
+IA_CANONICAL_URL = os.getenv("IA_CANONICAL_URL") or IA_EXTRACT_URL.rstrip("/") + "/canonical"
 IA_TIMEOUT = 10
 
 
@@ -25,16 +47,6 @@ app = FastAPI()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# MongoDB client global
-mongo_client = MongoClient(MONGO_URI)
-
-# Colecciones globales (fallback - solo usar si no hay tenant específico)
-db = mongo_client[MONGO_DB]
-email_setup_col = db["Email_Setup_IMAP"]
-imap_config_col = db["IMAP_Config"]
-raw_emails_col = db["Transaction_Raw_IMAP"]
-processed_emails_col = db["Transaction_Processed_IMAP"]
-
 # === CORS ===
 app.add_middleware(
     CORSMiddleware,
@@ -44,34 +56,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ============================================================================
-# 🆕 HELPER: Get tenant-specific collections
-# ============================================================================
-
-def get_tenant_collections(db_name: str):
-    """
-    Retorna las colecciones específicas de un tenant.
-    
-    Args:
-        db_name: Nombre de la base de datos del tenant
-    
-    Returns:
-        dict con las colecciones: email_setup_col, imap_config_col, raw_emails_col, processed_emails_col
-    """
-    tenant_db = mongo_client[db_name]
-    
-    return {
-        "email_setup_col": tenant_db["email_setups"],
-        "imap_config_col": tenant_db["imap_config"],
-        "raw_emails_col": tenant_db["Transaction_Raw_IMAP"],
-        "processed_emails_col": tenant_db["Transaction_Processed_IMAP"]
-    }
-
 # ============================================================================
 # Normalize functions (sin cambios)
 # ============================================================================
 
 def normalize(email_item):
+    html_body, text_body = decode_bodies(email_item)
     return {
         "_id": str(email_item.get("_id")),
         "uid": email_item.get("uid"),
@@ -80,12 +70,13 @@ def normalize(email_item):
         "subject": email_item.get("subject"),
         "date": email_item.get("date"),
         "attachments": email_item.get("pdfs", []),
-        "html_body": email_item.get("html_body") or "",
-        "body": email_item.get("html_body") or email_item.get("text_body") or "",
-        "text_body": email_item.get("text_body") or "",
+        "html_body": html_body or "",
+        "body": html_body or text_body or "",
+        "text_body": text_body or "",
         "source": email_item.get("source"),
         "transactionVariables": email_item.get("transactionVariables"),
         "transactionType": email_item.get("transactionType"),
+        "extraction_status": email_item.get("extraction_status"),
     }
 
 def normalize_raw(email_data):
@@ -95,215 +86,29 @@ def normalize_raw(email_data):
         "from": email_data.get("from"),
         "subject": email_data.get("subject"),
         "date": email_data.get("date"),
-        "html_body": email_data.get("html_body"),
-        "text_body": email_data.get("text_body"),
-        "body": email_data.get("html_body") or email_data.get("text_body") or "",
+        **encode_bodies(email_data.get("html_body"), email_data.get("text_body")),
         "pdfs": email_data.get("pdfs", []),
         "source": email_data.get("source"),  
         "fetched_at": email_data.get("fetched_at", datetime.utcnow().isoformat())
     }
 
 # ============================================================================
-# Parser functions (sin cambios - mantengo solo las firmas)
+# Parser functions (registro compilado en parser_registry / parsers/bank_parsers.json)
 # ============================================================================
 
-def extract(body, patterns):
-    """Extrae valores usando lista de patrones regex"""
-    for p in patterns:
-        m = re.search(p, body, re.IGNORECASE)
-        if m and m.group(1):
-            return m.group(1).strip()
-    return "-"
-
 def parse_email_text(body):
     """Parser para emails en texto plano - SIEMPRE retorna dict"""
-    if not body:
-        return {
-            "monto": "-",
-            "yapero": "-",
-            "origen": "-",
-            "fecha": "-",
-            "nombreBenef": "-",
-            "cuentaBenef": "-",
-            "nroOperacion": "-",
-            "celularBenef": "-"
-        }
-    
-    try:
-        body = body.replace("\r", "").replace("\u00a0", " ").strip()
-        
-        monto = extract(body, [
-            r"Monto(?: Total)?:?\s*S\/\s*([\d,.]+)",
-            r"Total del consumo:?\s*S\/\s*([\d,.]+)",
-            r"S\/\s*([\d,.]+)\s*(?:PEN)?",
-        ])
-        
-        nroOperacion = extract(body, [
-            r"N(?:ú|u)mero de operación:?\s*(\d+)",
-            r"N° de operación:?\s*(\d+)",
-            r"Nº de operación:?\s*(\d+)",
-            r"Código de operación:?\s*(\d+)",
-            r"\bOperación[: ]+(\d{5,})",
-        ])
-        
-        fecha = extract(body, [
-            r"(\d{1,2}\s+(?:enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre)\s+\d{4}\s*-\s*\d{1,2}:\d{2}\s*(?:a\.?m\.?|p\.?m\.?))",
-            r"\bFecha(?: y hora)?:?\s*(.+)",
-            r"(\d{1,2}/\d{1,2}/\d{4}\s+\d{1,2}:\d{2}\s*(?:AM|PM))",
-            r"(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2})",
-        ])
-        
-        yapero = extract(body, [
-            r"Hola[, ]+([A-Za-zÁÉÍÓÚÑáéíóúñ ]+)",
-            r"De: ([A-Za-zÁÉÍÓÚÑáéíóúñ ]+)",
-            r"Titular:?\s*([A-Za-zÁÉÍÓÚÑáéíóúñ ]+)",
-        ])
-        
-        origen = extract(body, [
-            r"Cuenta cargo:?\s*([\d ]+)",
-            r"Desde el número:?\s*(\d{6,})",
-            r"Tu número de celular:?\s*(\d{6,})",
-            r"Cuenta origen:?\s*([\d ]{6,})",
-        ])
-        
-        nombreBenef = extract(body, [
-            r"Nombre del Beneficiario:?\s*(.+)",
-            r"Enviado a:?\s*(.+)",
-            r"Beneficiario:?\s*(.+)",
-            r"Para:?\s*([A-Za-zÁÉÍÓÚÑáéíóúñ ]+)",
-        ])
-        
-        cuentaBenef = extract(body, [
-            r"Cuenta destino:?\s*([\d ]+)",
-            r"Celular del Beneficiario:?\s*(\d{6,})",
-            r"Nro destino:?\s*(\d{6,})",
-        ])
-        
-        celularBenef = extract(body, [
-            r"celular del beneficiario[:\s]*([x\d]{6,})",
-            r"celular[:\s]*([x\d]{6,})",
-            r"destinatario[:\s]*([x\d]{6,})",
-            r"cuenta destino[:\s]*([x\d]{6,})",
-        ])
-        
-        return {
-            "monto": monto,
-            "yapero": yapero,
-            "origen": origen,
-            "fecha": fecha,
-            "nombreBenef": nombreBenef,
-            "cuentaBenef": cuentaBenef,
-            "nroOperacion": nroOperacion,
-            "celularBenef": celularBenef,
-        }
-    
-    except Exception as e:
-        logger.error(f"Error in parse_email_text: {e}")
-        return {
-            "monto": "-",
-            "yapero": "-",
-            "origen": "-",
-            "fecha": "-",
-            "nombreBenef": "-",
-            "cuentaBenef": "-",
-            "nroOperacion": "-",
-            "celularBenef": "-"
-        }
+    return get_parser_registry().get("generico_texto").parse(text_body=body)
 
 
 def parse_email_html(body):
     """Parser para emails HTML - SIEMPRE retorna dict"""
-    if not body:
-        return {
-            "monto": "-",
-            "yapero": "-",
-            "origen": "-",
-            "fecha": "-",
-            "nombreBenef": "-",
-            "cuentaBenef": "-",
-            "nroOperacion": "-",
-            "celularBenef": "-"
-        }
-    
-    try:
-        # TODO: Implementar parseo HTML real
-        # Por ahora usar parser de texto como fallback
-        logger.warning("parse_email_html not fully implemented, using text parser")
-        
-        # Intentar extraer texto del HTML
-        soup = BeautifulSoup(body, 'html.parser')
-        text = soup.get_text(separator='\n', strip=True)
-        
-        return parse_email_text(text)
-    
-    except Exception as e:
-        logger.error(f"Error in parse_email_html: {e}")
-        return {
-            "monto": "-",
-            "yapero": "-",
-            "origen": "-",
-            "fecha": "-",
-            "nombreBenef": "-",
-            "cuentaBenef": "-",
-            "nroOperacion": "-",
-            "celularBenef": "-"
-        }
+    return get_parser_registry().get("generico_html").parse(html_body=body)
 
 
 def parse_interbank(text_body):
     """Parser específico para Interbank - SIEMPRE retorna dict"""
-    if not text_body:
-        return {
-            "monto": "-",
-            "yapero": "-",
-            "origen": "-",
-            "fecha": "-",
-            "nombreBenef": "-",
-            "cuentaBenef": "-",
-            "nroOperacion": "-",
-            "tipoOperacion": "-",
-            "comision": "-",
-            "celularBenef": "-"
-        }
-    
-    try:
-        monto = extract(text_body, [r"Monto Total:\s*S\/\s*([\d,.]+)"])
-        yapero = extract(text_body, [r"Hola\s+([^\n,]+)"])
-        origen = extract(text_body, [r"Cuenta cargo:\s*Cuenta Simple Soles\s*([\d\s]+)"]).replace(" ", "")
-        fecha = extract(text_body, [r"(\d{2}\s\w{3}\s\d{4}\s\d{2}:\d{2}\s[AP]M)"])
-        nombreBenef = extract(text_body, [r"Cuenta destino:\s*([^\n]+)"])
-        cuentaBenef = extract(text_body, [r"Cuenta destino:[^\n]+\n([\d\s]+)"]).replace(" ", "")
-        nroOperacion = extract(text_body, [r"Código de operación:\s*(\d+)"])
-        tipoOperacion = extract(text_body, [r"Tipo de operación:\s*([^\n]+)"])
-        comision = extract(text_body, [r"Comisión:\s*S\/\s*([\d,.]+)"])
-        
-        return {
-            "monto": monto,
-            "yapero": yapero,
-            "origen": origen,
-            "fecha": fecha,
-            "nombreBenef": nombreBenef,
-            "cuentaBenef": cuentaBenef,
-            "nroOperacion": nroOperacion,
-            "tipoOperacion": tipoOperacion,
-            "comision": comision,
-            "celularBenef": "-"
-        }
-    
-    except Exception as e:
-        logger.error(f"Error in parse_interbank: {e}")
-        return {
-            "monto": "-",
-            "yapero": "-",
-            "origen": "-",
-            "fecha": "-",
-            "nombreBenef": "-",
-            "cuentaBenef": "-",
-            "nroOperacion": "-",
-            "tipoOperacion": "-",
-            "comision": "-",
-            "celularBenef": "-"
-        }
+    return get_parser_registry().get("interbank").parse(text_body=text_body)
 
 # ============================================================================
 # 🆕 EMAIL SETUP ENDPOINTS - Multi-tenant aware
@@ -358,6 +163,7 @@ def create_email_setup(
     doc["updated_at"] = datetime.utcnow()
     
     result = cols["email_setup_col"].insert_one(doc)
+    invalidate_setups(x_database_name)
     
     logger.info(f"✅ Email setup created in DB: {x_database_name}")
     
@@ -421,6 +227,7 @@ def update_email_setup(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Setup not found")
     
+    invalidate_setups(x_database_name)
     return {"status": "success"}
 
 @app.delete("/email/setup/{setup_id}")
@@ -434,6 +241,7 @@ def delete_email_setup(
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Setup not found")
     
+    invalidate_setups(x_database_name)
     return {"status": "success"}
 
 # ============================================================================
@@ -466,6 +274,7 @@ def create_imap_config(
     doc["updated_at"] = datetime.utcnow()
     
     cols["imap_config_col"].insert_one(doc)
+    invalidate_imap_config(x_database_name)
     
     logger.info(f"✅ IMAP config created in DB: {x_database_name}")
     
@@ -514,6 +323,7 @@ def update_imap_config(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Config not found")
     
+    invalidate_imap_config(x_database_name)
     return {"status": "success"}
 
 @app.delete("/imap/config/{config_id}")
@@ -527,6 +337,7 @@ def delete_imap_config(
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Config not found")
     
+    invalidate_imap_config(x_database_name)
     return {"status": "success"}
 
 # ============================================================================
@@ -535,11 +346,15 @@ def delete_imap_config(
 
 @app.get("/ingest")
 def ingest(
+    response: Response = None,
     x_database_name: str = Header(..., description="Nombre de la base de datos del tenant"),
     limit: int | None = Query(default=None),
     force: bool = Query(default=False),
     date_from: str | None = Query(default=None, description="Fecha inicial (YYYY-MM-DD)"),
-    date_to: str | None = Query(default=None, description="Fecha final (YYYY-MM-DD)")
+    date_to: str | None = Query(default=None, description="Fecha final (YYYY-MM-DD)"),
+    profile: bool = Query(default=False, description="Correr bajo el profiler (ver /profiles)"),
+    x_profile: str | None = Header(default=None, description="1 = correr bajo el profiler"),
+    traceparent: str | None = Header(default=None, description="W3C trace context del llamador")
 ):
     """
     Ingesta emails y los guarda en la base de datos del tenant especificado.
@@ -552,21 +367,43 @@ def ingest(
         - force: Si es true, reprocesa emails ya guardados
         - date_from: Fecha inicial (YYYY-MM-DD)
         - date_to: Fecha final (YYYY-MM-DD)
+        - profile / X-Profile: guarda un perfil de la corrida (id en X-Profile-Id)
+
+    Cada corrida es un trace (un span por email, ver tracing.py); su id va en
+    la respuesta como `trace_id`.
     """
+    requested = profile_requested(profile, x_profile)
+    with maybe_profile("ingest", requested, response, tenant=x_database_name), \
+            span("ingest", kind="server", traceparent=traceparent, tenant=x_database_name) as root:
+        result = _ingest(x_database_name, limit, force, date_from, date_to)
+        root.set(**{f"ingest.{k}": v for k, v in result["summary"].items()})
+    result["trace_id"] = root.trace_id
+    return result
+
+
+def _filtered_email(email_span, db_name, stage: str):
+    """Email descartado: métrica por etapa y resultado en su span"""
+    filtered(db_name, stage)
+    email_span.set(outcome=stage)
+
+
+def _ingest(x_database_name: str, limit, force, date_from, date_to):
     logger.info(f"🔄 Starting ingest for database: {x_database_name}")
     
     # Obtener colecciones del tenant
     cols = get_tenant_collections(x_database_name)
     
     # Download emails (ya viene con deduplicación de is_uid_processed)
-    raw_emails = connect_and_download_pdfs(
-        limit=limit, 
-        force=force,
-        date_from=date_from,
-        date_to=date_to,
-        verbose=True,
-        db_name=x_database_name
-    )
+    with span("imap.download") as download_span:
+        raw_emails = connect_and_download_pdfs(
+            limit=limit, 
+            force=force,
+            date_from=date_from,
+            date_to=date_to,
+            verbose=True,
+            db_name=x_database_name
+        )
+        download_span.set(emails=len(raw_emails))
     
     logger.info(f"✅ Downloaded {len(raw_emails)} emails from IMAP")
     
@@ -594,9 +431,11 @@ def ingest(
     skipped_already_processed = 0
     skipped_parse_error = 0
     skipped_refund = 0
+    extraction_pending = 0
     
     for email_item in raw_emails:
         uid = email_item.get("uid")
+        email_span = start_span("ingest.email", uid=uid, fetch_span_id=email_item.get("fetch_span_id"))
         
         try:
             metadata = email_item.get("metadata", {})
@@ -608,6 +447,7 @@ def ingest(
 
             if not metadata:
                 logger.warning(f"⚠️ Email UID {uid} missing metadata, skipping...")
+                _filtered_email(email_span, x_database_name, "no_metadata")
                 continue
             
             subject = metadata.get("subject", "")
@@ -615,18 +455,21 @@ def ingest(
             html_body = metadata.get("html_body")
             from_addr = metadata.get("from", "")
             message_id = metadata.get("message_id", "unknown")
+            email_span.set(message_id=message_id, sender=from_addr)
             
             # === 🔥 DEDUPLICACIÓN ROBUSTA ===
             if not force:
                 # Estrategia 1: Verificar UID
                 if uid in processed_uids:
                     logger.info(f"⏭️  UID {uid} already processed (found in raw_emails), skipping")
+                    _filtered_email(email_span, x_database_name, "dedup")
                     skipped_already_processed += 1
                     continue
                 
                 # Estrategia 2: Verificar Message-ID (más confiable)
                 if message_id and message_id != "unknown" and message_id in processed_message_ids:
                     logger.info(f"⏭️  Message-ID {message_id} already processed (UID {uid}), skipping")
+                    _filtered_email(email_span, x_database_name, "dedup")
                     skipped_already_processed += 1
                     continue
                 
@@ -645,37 +488,46 @@ def ingest(
                     processed_uids.add(uid)
                     if message_id != "unknown":
                         processed_message_ids.add(message_id)
+                    _filtered_email(email_span, x_database_name, "dedup")
                     skipped_already_processed += 1
                     continue
             
             # Validación mínima
             if not any([subject, text_body, html_body, from_addr, message_id]):
                 logger.error(f"❌ UID {uid} completely empty, NOT SAVING")
+                release_attachments(uid, metadata.get("pdfs"), x_database_name)
+                _filtered_email(email_span, x_database_name, "empty")
                 continue
             
             # Detectar devoluciones
-            is_refund = "devolución" in subject.lower() or "devolucion" in subject.lower()
+            refund_rule = get_refund_matcher().match(subject)
             
-            if is_refund:
-                logger.info(f"⚠️ UID {uid} is a REFUND → Skipping (not implemented yet)")
+            if refund_rule:
+                logger.info(f"⚠️ UID {uid} is a REFUND ('{refund_rule}') → Skipping (not implemented yet)")
+                release_attachments(uid, metadata.get("pdfs"), x_database_name)
+                _filtered_email(email_span, x_database_name, "refund")
                 skipped_refund += 1
                 continue
             
             # === GUARDAR RAW EMAIL en BD del tenant ===
             raw_data = normalize_raw({"uid": uid, **metadata})
             raw_data["source"] = "imap"
-            ai_payload = extract_transaction_via_ai(html_body)
-
-            if ai_payload:
-                raw_data["transactionVariables"] = normalize_transaction_variables(
-                    ai_payload.get("transactionVariables")
-                )
-                raw_data["transactionType"] = ai_payload.get("transactionType")
-                raw_data["transactionConfidence"] = ai_payload.get("confidence")
-
+            # HTML parseado una sola vez: lo usan el agente y los parsers locales
+            with span("preprocess_html"):
+                canonical = preprocess_html(html_body)
+            # Sin agente no se espera: el raw queda pendiente para el worker
+            try:
+                ai_payload = extract_transaction_via_ai(html_body, canonical, db_name=x_database_name)
+                apply_payload(raw_data, ai_payload, normalize_transaction_variables)
+            except AgentUnavailable as unavailable:
+                mark_pending(raw_data, str(unavailable))
+            email_span.set(extraction=raw_data["extraction_status"])
             
             try:
-                raw_result = cols["raw_emails_col"].insert_one(raw_data)
+                with span("mongo.insert_raw"), \
+                        timed(MONGO_INSERT_SECONDS, tenant=tenant_label(x_database_name), collection="raw"):
+                    raw_result = cols["raw_emails_col"].insert_one(raw_data)
+                MESSAGES_STORED.labels(tenant=tenant_label(x_database_name), collection="raw").inc()
                 raw_id = raw_result.inserted_id
                 logger.info(f"✅ Raw email saved: {raw_id} (UID: {uid})")
                 
@@ -687,19 +539,24 @@ def ingest(
             except Exception as insert_error:
                 # Si falla el insert (por duplicate key, etc.)
                 logger.warning(f"⚠️ Could not insert UID {uid}: {insert_error}")
+                email_span.set(outcome="raw_insert_error")
                 skipped_already_processed += 1
                 continue
             
+            if raw_data["extraction_status"] == PENDING:
+                extraction_pending += 1
+                mark_pending_tenant(x_database_name)
+            
             # === PARSEAR EMAIL ===
             processed_data = None
+            parser = None
             
             try:
-                if "interbank" in subject.lower() or not html_body:
-                    processed_data = parse_interbank(text_body)
-                elif html_body:
-                    processed_data = parse_email_html(html_body)
-                else:
-                    processed_data = parse_email_text(text_body)
+                with span("parse") as parse_span:
+                    parser, processed_data = get_parser_registry().parse(
+                        from_addr, subject, text_body=text_body, html_body=html_body, canonical=canonical
+                    )
+                    parse_span.set(parser=parser.name if parser else None)
             except Exception as parse_error:
                 logger.error(f"❌ Parser exception for UID {uid}: {parse_error}")
                 processed_data = None
@@ -707,6 +564,7 @@ def ingest(
             # 🔥 VALIDACIÓN: Parser debe retornar dict
             if not isinstance(processed_data, dict):
                 logger.warning(f"⚠️ UID {uid} parser returned {type(processed_data)}, skipping processed save")
+                _filtered_email(email_span, x_database_name, "parse_error")
                 skipped_parse_error += 1
                 continue
             
@@ -720,11 +578,18 @@ def ingest(
             processed_data["processed_at"] = datetime.utcnow()
             processed_data["type"] = "consumo"
             processed_data["source"] = "imap"
+            processed_data["parser"] = parser.name
+            processed_data["parser_version"] = parser.version
             
             # === GUARDAR PROCESSED EMAIL en BD del tenant ===
             try:
-                processed_result = cols["processed_emails_col"].insert_one(processed_data)
+                with span("mongo.insert_processed"), \
+                        timed(MONGO_INSERT_SECONDS, tenant=tenant_label(x_database_name), collection="processed"):
+                    processed_result = cols["processed_emails_col"].insert_one(processed_data)
+                MESSAGES_STORED.labels(tenant=tenant_label(x_database_name), collection="processed").inc()
+                observe_lag(x_database_name, metadata.get("date"))
                 logger.info(f"✅ Processed email saved: {processed_result.inserted_id}")
+                email_span.set(outcome="stored")
                 
                 results.append({
                     "uid": uid,
@@ -738,11 +603,21 @@ def ingest(
                 })
             except Exception as proc_insert_error:
                 logger.error(f"❌ Could not insert processed email for UID {uid}: {proc_insert_error}")
+                email_span.set(outcome="processed_insert_error")
                 continue
         
         except Exception as e:
             logger.error(f"❌ Error processing UID {uid}: {e}", exc_info=True)
+            email_span.record_error(e)
             continue
+        
+        finally:
+            email_span.end()
+            if TRACE_SLOW_EMAIL_MS and email_span.duration_ms > TRACE_SLOW_EMAIL_MS:
+                logger.warning(
+                    f"🐢 UID {uid} took {email_span.duration_ms:.0f} ms "
+                    f"(trace {email_span.trace_id}, span {email_span.span_id})"
+                )
     
     # === RESUMEN FINAL ===
     logger.info("=" * 70)
@@ -752,6 +627,7 @@ def ingest(
     logger.info(f"   ⏭️  Skipped (already processed): {skipped_already_processed}")
     logger.info(f"   ⚠️  Skipped (parse error): {skipped_parse_error}")
     logger.info(f"   🔄 Skipped (refunds): {skipped_refund}")
+    logger.info(f"   ⏳ Extraction deferred (agent unavailable): {extraction_pending}")
     logger.info("=" * 70)
     
     return {
@@ -762,34 +638,101 @@ def ingest(
             "processed": len(results),
             "skipped_already_processed": skipped_already_processed,
             "skipped_parse_error": skipped_parse_error,
-            "skipped_refund": skipped_refund
+            "skipped_refund": skipped_refund,
+            "extraction_pending": extraction_pending
         },
         "emails": results
     }
 
-def extract_transaction_via_ai(html: str) -> dict | None:
+# Se apaga si el agente desplegado no expone /extract/canonical (404)
+_canonical_supported = True
+
+def extract_transaction_via_ai(html: str, canonical: dict | None = None, db_name: str = None,
+                               count_failures: bool = True) -> dict | None:
+    """
+    Llama al agente (/extract/canonical, o /extract si no existe).
+
+    Retorna el payload, o None si no hay HTML o el agente respondió con error.
+    Lanza AgentUnavailable si el circuit breaker está abierto o el agente no
+    responde (timeout, conexión, 5xx/429): el email queda para el worker de
+    extracción diferida en vez de bloquear la ingesta.
+
+    count_failures=False: la falla no cuenta para el breaker (reintentos de
+    un email que ya falló antes, que puede ser el problema y no el agente).
+    """
+    global _canonical_supported
+
     if not html or len(html.strip()) < 50:
         return None
 
-    try:
-        resp = requests.post(
-            IA_EXTRACT_URL,
-            json={
-                "html": html,
-                "formato": "dict",
-                "detalles": True
-            },
-            timeout=IA_TIMEOUT
-        )
+    tenant = tenant_label(db_name)
+    breaker = get_agent_breaker()
+    if not breaker.allow():
+        AGENT_ERRORS.labels(tenant=tenant, reason="circuit_open").inc()
+        raise AgentUnavailable("circuit open", rejected=True)
 
-        if resp.status_code != 200:
-            return None
+    timeout = (IA_CONNECT_TIMEOUT, IA_TIMEOUT)
+    try:
+        if canonical and _canonical_supported:
+            with span("agent.extract", kind="client", endpoint="canonical") as agent_span, \
+                    timed(AGENT_SECONDS, tenant=tenant, endpoint="canonical"):
+                resp = requests.post(
+                    IA_CANONICAL_URL,
+                    data=canonical_json({
+                        "canonical": canonical,
+                        "formato": "dict",
+                        "detalles": True
+                    }),
+                    headers={"Content-Type": "application/json", **propagation_headers()},
+                    timeout=timeout
+                )
+                agent_span.set(status_code=resp.status_code)
+            if resp.status_code != 404:
+                return _agent_response(resp, tenant, breaker, count_failures)
+
+            logger.warning("⚠️ IA service has no /extract/canonical, falling back to /extract")
+            _canonical_supported = False
+
+        with span("agent.extract", kind="client", endpoint="extract") as agent_span, \
+                timed(AGENT_SECONDS, tenant=tenant, endpoint="extract"):
+            resp = requests.post(
+                IA_EXTRACT_URL,
+                json={
+                    "html": html,
+                    "formato": "dict",
+                    "detalles": True
+                },
+                headers=propagation_headers(),
+                timeout=timeout
+            )
+            agent_span.set(status_code=resp.status_code)
 
-        return resp.json()
+        return _agent_response(resp, tenant, breaker, count_failures)
 
     except requests.RequestException as e:
         logger.warning(f"⚠️ IA service unreachable: {e}")
+        AGENT_ERRORS.labels(tenant=tenant, reason=type(e).__name__).inc()
+        _record_agent_failure(breaker, count_failures)
+        raise AgentUnavailable(type(e).__name__) from e
+
+def _record_agent_failure(breaker, count_failures: bool):
+    if count_failures:
+        breaker.record_failure()
+    else:
+        breaker.record_inconclusive()
+
+def _agent_response(resp, tenant: str, breaker, count_failures: bool = True) -> dict | None:
+    """5xx/429 cuentan como caída del agente; cualquier otra respuesta lo da por vivo"""
+    if resp.status_code >= 500 or resp.status_code == 429:
+        AGENT_ERRORS.labels(tenant=tenant, reason=f"http_{resp.status_code}").inc()
+        _record_agent_failure(breaker, count_failures)
+        raise AgentUnavailable(f"http_{resp.status_code}")
+
+    breaker.record_success()
+    if resp.status_code != 200:
+        AGENT_ERRORS.labels(tenant=tenant, reason=f"http_{resp.status_code}").inc()
         return None
+    return resp.json()
 
 from datetime import datetime, timedelta
 
@@ -825,24 +768,33 @@ def normalize_transaction_variables(tv: dict | None) -> dict | None:
 # EMAIL LISTING ENDPOINTS - Multi-tenant aware
 # ============================================================================
 
+def _body_projection(include_body: bool, base: dict = None):
+    """Proyección que omite los cuerpos (en claro o comprimidos) si no se piden"""
+    projection = dict(base or {})
+    if not include_body:
+        projection.update({field: 0 for field in BODY_FIELDS})
+    return projection or None
+
 @app.get("/emails")
 def get_emails(
-    x_database_name: str = Header(..., description="Nombre de la base de datos del tenant")
+    x_database_name: str = Header(..., description="Nombre de la base de datos del tenant"),
+    include_body: bool = Query(default=True, description="Incluir html/text del email")
 ):
     """Retorna emails raw del tenant"""
     cols = get_tenant_collections(x_database_name)
     
-    emails = list(cols["raw_emails_col"].find().sort("date", -1))
+    emails = list(cols["raw_emails_col"].find({}, _body_projection(include_body)).sort("date", -1))
     return [normalize(e) for e in emails]
 
 @app.get("/emails/raw")
 def get_raw_emails(
-    x_database_name: str = Header(..., description="Nombre de la base de datos del tenant")
+    x_database_name: str = Header(..., description="Nombre de la base de datos del tenant"),
+    include_body: bool = Query(default=True, description="Incluir html/text del email")
 ):
     """Retorna emails raw del tenant"""
     cols = get_tenant_collections(x_database_name)
     
-    emails = list(cols["raw_emails_col"].find({}, {"_id": 0}))
+    emails = list(cols["raw_emails_col"].find({}, _body_projection(include_body, {"_id": 0})))
     return [normalize(e) for e in emails]
 
 @app.get("/emails/raw/{raw_id}")
@@ -857,7 +809,109 @@ def get_raw_email(
         email = cols["raw_emails_col"].find_one({"_id": ObjectId(raw_id)}, {"_id": 0})
         if not email:
             return {"error": "Email not found"}
-        return email
+        return expand_bodies(email)
     except Exception as e:
         logger.error(f"Error fetching raw email: {e}")
-        return {"error": "Invalid ID format"}
\ No newline at end of file
+        return {"error": "Invalid ID format"}
+
+@app.delete("/emails/raw/{raw_id}")
+def delete_raw_email(
+    raw_id: str,
+    x_database_name: str = Header(..., description="Nombre de la base de datos del tenant")
+):
+    """Elimina un email raw y suelta sus referencias a adjuntos"""
+    cols = get_tenant_collections(x_database_name)
+
+    try:
+        raw = cols["raw_emails_col"].find_one_and_delete({"_id": ObjectId(raw_id)}, {"uid": 1, "pdfs": 1})
+    except Exception as e:
+        logger.error(f"Error deleting raw email: {e}")
+        return {"error": "Invalid ID format"}
+
+    if not raw:
+        raise HTTPException(status_code=404, detail="Email not found")
+
+    release_attachments(raw.get("uid"), raw.get("pdfs"), x_database_name)
+    return {"status": "success"}
+
+# ============================================================================
+# PARSERS
+# ============================================================================
+
+@app.get("/parsers/stats")
+def parser_stats():
+    """Hit-rate por campo y tiempo medio de cada parser desde el arranque"""
+    return get_parser_registry().stats()
+
+@app.post("/parsers/reload")
+def reload_parsers():
+    """Recarga el registro desde PARSER_CONFIG_PATH (los contadores se reinician)"""
+    registry = get_parser_registry()
+    try:
+        registry.load()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid parser config: {e}")
+    return {"status": "success", "version": registry.version, "parsers": list(registry.parsers)}
+
+# ============================================================================
+# EXTRACCIÓN DIFERIDA
+# ============================================================================
+
+@app.get("/extraction/status")
+def extraction_status():
+    """Estado del circuit breaker del agente y raws pendientes por tenant"""
+    return {"agent_circuit": get_agent_breaker().stats(), **get_queue_stats()}
+
+@app.post("/extraction/drain")
+def drain_extraction():
+    """Adelanta la próxima vuelta del worker de extracción diferida"""
+    wake_worker()
+    return {"status": "scheduled", "agent_circuit": get_agent_breaker().stats()}
+
+# ============================================================================
+# PROFILES
+# ============================================================================
+
+@app.get("/profiles")
+def get_profiles(limit: int = Query(default=50, ge=1, le=500)):
+    """Perfiles guardados por ?profile=true / X-Profile, más recientes primero"""
+    return {"profiling_available": profiling_available(), "profiles": list_profiles(limit)}
+
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = Query(default="html", description="html | speedscope")):
+    path = profile_path(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    media_type = "text/html" if format == "html" else "application/json"
+    return FileResponse(path, media_type=media_type, filename=path.name)
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+@app.get("/metrics")
+def metrics():
+    """Métricas en formato de exposición Prometheus"""
+    payload, content_type = render_latest()
+    return Response(content=payload, media_type=content_type)
+
+# ============================================================================
+# HEALTH / STARTUP
+# ============================================================================
+
+@app.on_event("startup")
+def report_startup():
+    logger.info(f"🚀 Startup phases: {get_startup_report()}")
+    if TENANT_CACHE_CHANGE_STREAM:
+        start_change_stream_invalidator()
+    if EXTRACTION_WORKER_ENABLED:
+        start_extraction_worker()
+
+@app.get("/health")
+def health():
+    """Estado del servicio y fases de arranque (qué recursos ya se inicializaron)"""
+    return {"status": "ok", **get_startup_report(),
+            "tenant_cache": get_cache_stats(), "keyword_matchers": get_matcher_stats(),
+            "tracing": get_trace_stats(), "agent_circuit": get_agent_breaker().stats()}
+
+record_phase("import:app.api", time.perf_counter() - _import_started)
@@ -0,0 +1,201 @@
+"""
+Store de adjuntos direccionado por contenido.
+
+Cada adjunto se guarda una sola vez en `<root>/<sha[:2]>/<sha[2:4]>/<sha>.pdf`,
+escrito por bloques mientras se calcula el SHA-256. Las referencias
+(tenant:uid:archivo) y metadatos viven en la colección `attachments` de la
+BD por defecto, lo que permite un GC por retención.
+
+Uso del GC:
+    python -m app.attachment_store gc --older-than-days 90 [--purge-referenced] [--dry-run]
+"""
+import argparse
+import binascii
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from .config import ATTACHMENT_STORE_DIR
+from .db import get_default_db
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_part_chunks(part, chunk_size=CHUNK_SIZE):
+    """
+    Decodifica el payload de un MailPart de pyzmail por bloques.
+    Para base64 se decodifica incrementalmente sin armar el binario completo.
+    """
+    message = getattr(part, "part", None)
+    encoding = (message.get("Content-Transfer-Encoding", "") if message is not None else "").strip().lower()
+    encoded = message.get_payload(decode=False) if message is not None else None
+
+    if encoding != "base64" or not isinstance(encoded, str):
+        payload = part.get_payload()
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8", errors="ignore")
+        for i in range(0, len(payload or b""), chunk_size):
+            yield payload[i:i + chunk_size]
+        return
+
+    carry = ""
+    for i in range(0, len(encoded), chunk_size):
+        block = carry + "".join(encoded[i:i + chunk_size].split())
+        usable = len(block) - len(block) % 4
+        carry = block[usable:]
+        if usable:
+            yield binascii.a2b_base64(block[:usable])
+    if carry.strip("="):
+        # Padding faltante en el último bloque
+        yield binascii.a2b_base64(carry + "=" * (-len(carry) % 4))
+
+
+class AttachmentStore:
+    def __init__(self, root: str = ATTACHMENT_STORE_DIR, suffix: str = ".pdf"):
+        self.root = Path(root)
+        self.suffix = suffix
+
+    def blob_path(self, sha: str) -> Path:
+        return self.root / sha[:2] / sha[2:4] / f"{sha}{self.suffix}"
+
+    def _metadata(self):
+        return get_default_db()["attachments"]
+
+    def put_stream(self, chunks, filename: str, ref: str):
+        """
+        Escribe el adjunto por bloques. Si el contenido ya existe, el
+        temporal se descarta y solo se agrega la referencia.
+
+        La referencia se registra antes de decidir: desde ahí el GC ya no
+        borra el documento, y si el blob desapareció igual (GC en curso) se
+        vuelve a escribir desde el temporal.
+
+        Returns:
+            (sha256, ruta absoluta del blob, tamaño en bytes)
+        """
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        tmp = tmp_dir / f"{uuid.uuid4().hex}.part"
+
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            sha = digest.hexdigest()
+            path = self.blob_path(sha)
+            self._add_ref(sha, path, size, filename, ref)
+            try:
+                # Refresca el mtime: el GC de huérfanos tampoco lo toca
+                os.utime(path)
+                tmp.unlink()
+                logger.info(f"♻️ Attachment already stored: {filename} ({sha[:12]})")
+            except FileNotFoundError:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+        return sha, str(path.resolve()), size
+
+    def _add_ref(self, sha, path, size, filename, ref):
+        now = datetime.utcnow()
+        try:
+            self._metadata().update_one(
+                {"_id": sha},
+                {
+                    "$setOnInsert": {"path": str(path), "size": size, "created_at": now},
+                    "$set": {"last_seen": now},
+                    "$addToSet": {"refs": ref, "filenames": filename},
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            # El blob ya quedó en disco; sin metadatos el GC lo trata como huérfano
+            logger.warning(f"⚠️ Could not record attachment metadata {sha[:12]}: {e}")
+
+    def sha_from_path(self, path) -> str:
+        name = Path(path).name
+        return name[:-len(self.suffix)] if self.suffix and name.endswith(self.suffix) else name
+
+    def release(self, sha: str, ref: str):
+        """Quita una referencia; el blob se borra en el próximo GC si queda sin refs"""
+        self._metadata().update_one({"_id": sha}, {"$pull": {"refs": ref}})
+
+    def release_prefix(self, paths, ref_prefix: str):
+        """Quita de esos blobs todas las referencias que empiezan con `ref_prefix`"""
+        shas = [self.sha_from_path(p) for p in paths if p]
+        if not shas:
+            return
+        self._metadata().update_many(
+            {"_id": {"$in": shas}},
+            {"$pull": {"refs": {"$regex": f"^{re.escape(ref_prefix)}"}}},
+        )
+
+    def gc(self, older_than_days: int, purge_referenced: bool = False, dry_run: bool = False):
+        """
+        Borra blobs sin referencias (o todos si purge_referenced) no vistos
+        en `older_than_days`, archivos huérfanos sin metadatos y temporales viejos.
+        """
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        query = {"last_seen": {"$lt": cutoff}}
+        if not purge_referenced:
+            query["$or"] = [{"refs": {"$exists": False}}, {"refs": {"$size": 0}}]
+
+        removed, freed = 0, 0
+        for doc in self._metadata().find(query, {"_id": 1, "size": 1}):
+            if not dry_run:
+                # Se re-chequea al borrar: si una ingesta agregó una ref entre medio, el blob queda
+                if self._metadata().delete_one({**query, "_id": doc["_id"]}).deleted_count != 1:
+                    continue
+                self.blob_path(doc["_id"]).unlink(missing_ok=True)
+            removed += 1
+            freed += doc.get("size", 0)
+
+        # Huérfanos: blobs en disco sin documento de metadatos
+        cutoff_ts = time.time() - older_than_days * 86400
+        known = None
+        for path in self.root.glob("??/??/*"):
+            if path.stat().st_mtime >= cutoff_ts:
+                continue
+            if known is None:
+                known = {d["_id"] for d in self._metadata().find({}, {"_id": 1})}
+            if self.sha_from_path(path) not in known:
+                freed += path.stat().st_size
+                removed += 1
+                if not dry_run:
+                    path.unlink(missing_ok=True)
+
+        for tmp in (self.root / "tmp").glob("*.part"):
+            if tmp.stat().st_mtime < time.time() - 86400 and not dry_run:
+                tmp.unlink(missing_ok=True)
+
+        logger.info(f"🧹 Attachment GC{' (dry run)' if dry_run else ''}: "
+                    f"{removed} blobs, {freed / 1024 / 1024:.1f} MB")
+        return {"removed": removed, "freed_bytes": freed, "dry_run": dry_run}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Content-addressed attachment store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    gc_parser = sub.add_parser("gc", help="Remove unreferenced / expired attachments")
+    gc_parser.add_argument("--older-than-days", type=int, default=90)
+    gc_parser.add_argument("--purge-referenced", action="store_true")
+    gc_parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "gc":
+        print(AttachmentStore().gc(args.older_than_days, args.purge_referenced, args.dry_run))
@@ -0,0 +1,101 @@
+"""
+Almacenamiento comprimido de cuerpos de email en `Transaction_Raw_IMAP`.
+
+Modo "compressed": en lugar de html_body + text_body + body (HTML dos veces),
+el documento guarda una sola copia canónica comprimida:
+    body_z      -> HTML (o texto si no hay HTML), BSON binary
+    text_z      -> text/plain, solo si además existe HTML
+    body_codec  -> "zstd" | "zlib"
+
+zstd se usa si `zstandard` está instalado (requirements.txt); si no, se
+escribe con zlib. Leer un documento zstd sin el módulo es un error explícito.
+"""
+import logging
+import zlib
+
+from bson.binary import Binary
+
+from .config import RAW_BODY_STORAGE, RAW_BODY_CODEC
+
+try:
+    import zstandard
+except ImportError:  # Dependencia opcional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+if RAW_BODY_STORAGE == "compressed" and RAW_BODY_CODEC == "zstd" and zstandard is None:
+    logger.warning("⚠️ RAW_BODY_CODEC=zstd but zstandard is not installed, compressing with zlib")
+
+BODY_FIELDS = ("html_body", "text_body", "body", "body_z", "text_z")
+
+
+def _codec():
+    if RAW_BODY_CODEC == "zstd" and zstandard is not None:
+        return "zstd"
+    return "zlib"
+
+
+def _compress(text: str, codec: str) -> Binary:
+    data = text.encode("utf-8")
+    if codec == "zstd":
+        return Binary(zstandard.ZstdCompressor(level=10).compress(data))
+    return Binary(zlib.compress(data, 6))
+
+
+def _decompress(blob, codec: str) -> str:
+    if blob is None:
+        return None
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Body stored with zstd but the zstandard module is not installed")
+        data = zstandard.ZstdDecompressor().decompress(bytes(blob))
+    else:
+        data = zlib.decompress(bytes(blob))
+    return data.decode("utf-8")
+
+
+def encode_bodies(html_body: str, text_body: str) -> dict:
+    """Campos de cuerpo a guardar según RAW_BODY_STORAGE"""
+    if RAW_BODY_STORAGE != "compressed":
+        return {
+            "html_body": html_body,
+            "text_body": text_body,
+            "body": html_body or text_body or "",
+        }
+
+    codec = _codec()
+    fields = {"body_codec": codec, "body_kind": "html" if html_body else "text"}
+    canonical = html_body or text_body
+    if canonical:
+        fields["body_z"] = _compress(canonical, codec)
+    if html_body and text_body:
+        fields["text_z"] = _compress(text_body, codec)
+    return fields
+
+
+def decode_bodies(doc: dict):
+    """
+    Retorna (html_body, text_body) de un documento, esté comprimido o no.
+    """
+    if "body_z" not in doc and "text_z" not in doc:
+        return doc.get("html_body"), doc.get("text_body")
+
+    codec = doc.get("body_codec", "zlib")
+    canonical = _decompress(doc.get("body_z"), codec)
+    if doc.get("body_kind") == "html":
+        return canonical, _decompress(doc.get("text_z"), codec)
+    return None, canonical
+
+
+def expand_bodies(doc: dict) -> dict:
+    """Reemplaza los campos comprimidos por html_body / text_body / body en claro"""
+    if "body_z" not in doc and "text_z" not in doc:
+        return doc
+
+    html_body, text_body = decode_bodies(doc)
+    expanded = {k: v for k, v in doc.items() if k not in ("body_z", "text_z", "body_codec", "body_kind")}
+    expanded["html_body"] = html_body
+    expanded["text_body"] = text_body
+    expanded["body"] = html_body or text_body or ""
+    return expanded
@@ -0,0 +1,105 @@
+"""
+Circuit breaker para dependencias HTTP (el agente de extracción).
+
+    closed     las llamadas pasan; N fallas seguidas lo abren
+    open       se rechaza sin llamar durante `reset_timeout` segundos
+    half_open  pasa UNA llamada de prueba: éxito → closed, falla → open
+
+Solo cuentan como falla las que indican que el servicio no está disponible
+(timeout, conexión, 5xx/429); un 4xx significa que el agente respondió.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from .config import AGENT_BREAKER_FAILURES, AGENT_BREAKER_RESET_SECONDS
+from .metrics import AGENT_CIRCUIT_STATE
+from .resources import lazy
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    def allow(self) -> bool:
+        """True si la llamada puede hacerse ahora (en half_open, solo una a la vez)"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.counters["rejected"] += 1
+                    return False
+                self._set_state(HALF_OPEN)
+                self._trial_in_flight = False
+
+            if self.state == HALF_OPEN:
+                if self._trial_in_flight:
+                    self.counters["rejected"] += 1
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.counters["success"] += 1
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.state != CLOSED:
+                logger.info(f"✅ Circuit '{self.name}' closed (dependency recovered)")
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.counters["failure"] += 1
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(
+                        f"⛔ Circuit '{self.name}' opened after {self.failures} failures "
+                        f"(retry in {self.reset_timeout:.0f}s)"
+                    )
+                    self.counters["opened"] += 1
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def record_inconclusive(self):
+        """La llamada falló pero no se atribuye al agente: libera el turno de prueba sin contar"""
+        with self._lock:
+            self.counters["inconclusive"] += 1
+            self._trial_in_flight = False
+
+    def _set_state(self, state: str):
+        self.state = state
+        AGENT_CIRCUIT_STATE.labels(dependency=self.name).set(_STATE_VALUE[state])
+
+    def stats(self) -> dict:
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "retry_in_s": retry_in,
+                **self.counters,
+            }
+
+
+def get_agent_breaker() -> CircuitBreaker:
+    return lazy("agent_breaker", lambda: CircuitBreaker(
+        "agent", AGENT_BREAKER_FAILURES, AGENT_BREAKER_RESET_SECONDS
+    ))
@@ -1,55 +1,170 @@
-from sentence_transformers import SentenceTransformer
-from sklearn.neighbors import NearestNeighbors
 import numpy as np
-import requests
+import csv
+import logging
 import os
+from .config import (
+    EMBED_MODEL, LABELED_EXAMPLES_PATH, EXAMPLE_INDEX_BACKEND,
+    LLM_MIN_SIMILARITY, LLM_MIN_MARGIN,
+)
+from .embedding_cache import EmbeddingCache
+from .example_index import ExampleIndex
+from .llm_client import OllamaClient
+from .resources import get_embedding_model
+
+logger = logging.getLogger(__name__)
 
 # --- Configuración desde variables de entorno ---
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "none")
 OLLAMA_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
 
-# --- Modelo local de embeddings ---
-model = SentenceTransformer("all-MiniLM-L6-v2")
+# Sin vecino en el índice (vacío o búsqueda sin resultados): baja confianza
+UNKNOWN_LABEL = "otros"
 
-class HybridClassifier:
-    def __init__(self):
-        self.examples = [
-            ("yape", "transferencia_personal"),
-            ("plin", "transferencia_personal"),
-            ("impuesto", "impuesto"),
-            ("spotify", "servicio_consumo"),
-            ("google", "servicio_consumo"),
-            ("otros.pag", "pago_sueldo"),
+def _normalize_rows(matrix):
+    """Normaliza filas a norma 1 (similitud coseno = producto punto)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# Ejemplos mínimos si el CSV no existe o está vacío
+SEED_EXAMPLES = [
+    ("yape", "transferencia_personal"),
+    ("plin", "transferencia_personal"),
+    ("impuesto", "impuesto"),
+    ("spotify", "servicio_consumo"),
+    ("google", "servicio_consumo"),
+    ("otros.pag", "pago_sueldo"),
+]
+
+
+def load_labeled_examples(path: str = LABELED_EXAMPLES_PATH):
+    """Lee el corpus etiquetado (columnas text,label). Retorna lista de tuplas."""
+    if not path or not os.path.exists(path):
+        return []
+
+    with open(path, newline="", encoding="utf-8") as f:
+        return [
+            (row["text"].strip(), row["label"].strip())
+            for row in csv.DictReader(f)
+            if row.get("text") and row.get("label")
         ]
-        self.texts = [x[0] for x in self.examples]
-        self.labels = [x[1] for x in self.examples]
-        self.embeddings = model.encode(self.texts, convert_to_numpy=True)
-        self.nn = NearestNeighbors(n_neighbors=1, metric="cosine").fit(self.embeddings)
+
+
+class HybridClassifier:
+    def __init__(
+        self,
+        batch_size: int = 256,
+        cache: EmbeddingCache = None,
+        examples_path: str = LABELED_EXAMPLES_PATH,
+        index_backend: str = EXAMPLE_INDEX_BACKEND,
+        llm_client: OllamaClient = None,
+    ):
+        self.batch_size = batch_size
+        self.cache = cache or EmbeddingCache(EMBED_MODEL)
+        self.index_backend = index_backend
+        self.index = None
+
+        # Si Ollama está activo, se usa como segunda opinión
+        if llm_client is None and LLM_PROVIDER.lower() == "ollama":
+            llm_client = OllamaClient(OLLAMA_URL, OLLAMA_MODEL)
+        self.llm_client = llm_client
+
+        examples = load_labeled_examples(examples_path) or SEED_EXAMPLES
+        self.add_examples(examples)
+        logger.info(f"✅ Classifier index ready: {len(self.index)} examples ({self.index.backend})")
+
+    @property
+    def labels(self):
+        return self.index.labels
+
+    def add_examples(self, examples):
+        """
+        Agrega ejemplos (text, label) al índice sin reconstruirlo.
+        Los embeddings pasan por la cache, así que recargar el corpus es barato.
+        """
+        examples = list(examples)
+        if not examples:
+            return
+
+        texts = [text for text, _ in examples]
+        labels = [label for _, label in examples]
+
+        vectors = np.vstack([
+            self.cache.get_many(texts[i:i + self.batch_size], self._encode)
+            for i in range(0, len(texts), self.batch_size)
+        ])
+        vectors = _normalize_rows(vectors.astype(np.float32))
+
+        if self.index is None:
+            self.index = ExampleIndex(vectors.shape[1], backend=self.index_backend)
+        self.index.add(vectors, labels, texts)
 
     def classify(self, text):
-        emb = model.encode([text], convert_to_numpy=True)
-        _, idx = self.nn.kneighbors(emb)
-        initial_category = self.labels[idx[0][0]]
-
-        # Si Ollama está activo, pedir una segunda opinión
-        if LLM_PROVIDER.lower() == "ollama":
-            try:
-                prompt = f"""Clasifica esta transacción en una categoría:
-transferencia_personal, impuesto, retiro_efectivo, servicio_consumo, pago_sueldo u otros.
-
-Transacción: "{text}"
-Categoría sugerida: {initial_category}
-
-Responde solo con una palabra de categoría."""
-                r = requests.post(
-                    f"{OLLAMA_URL}/api/generate",
-                    json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False},
-                    timeout=30,
-                )
-                if r.ok:
-                    respuesta = r.json().get("response", "").strip().split()[0].lower()
-                    return respuesta or initial_category
-            except Exception as e:
-                print(f"[Ollama] Error: {e}")
-        return initial_category
+        label, _ = self.classify_batch([text])[0]
+        return label
+
+    def classify_batch(self, texts):
+        """
+        Clasifica muchas descripciones a la vez.
+
+        Las descripciones repetidas se codifican una sola vez y la búsqueda
+        contra los ejemplos se hace en un solo lote sobre el índice vectorial.
+
+        Returns:
+            Lista de tuplas (label, score) en el mismo orden que `texts`,
+            donde score es la similitud coseno con el ejemplo más cercano del índice
+            (UNKNOWN_LABEL con score 0.0 si el índice no devolvió vecino).
+        """
+        if not texts:
+            return []
+
+        unique_texts = list(dict.fromkeys(texts))
+        emb = self.cache.get_many(unique_texts, self._encode)
+
+        # Top-k para medir ambigüedad contra la mejor etiqueta distinta
+        k = 5 if self.llm_client else 1
+        scores, idx = self.index.search(_normalize_rows(emb), k=k)
+
+        results = []
+        ambiguous = []
+        for n, text in enumerate(unique_texts):
+            if idx[n, 0] < 0:
+                results.append((UNKNOWN_LABEL, 0.0))
+                if self.llm_client:
+                    ambiguous.append(n)
+                continue
+
+            label = self.labels[idx[n, 0]]
+            score = float(scores[n, 0])
+            results.append((label, score))
+
+            if self.llm_client and self._is_ambiguous(label, scores[n], idx[n]):
+                ambiguous.append(n)
+
+        if ambiguous:
+            opinions = self.llm_client.classify_many(
+                [(unique_texts[n], results[n][0]) for n in ambiguous]
+            )
+            for n, label in zip(ambiguous, opinions):
+                results[n] = (label, results[n][1])
+
+        by_text = dict(zip(unique_texts, results))
+        return [by_text[text] for text in texts]
+
+    def _is_ambiguous(self, label, scores, idx):
+        """El vecino más cercano es poco similar o casi empata con otra etiqueta"""
+        if scores[0] < LLM_MIN_SIMILARITY:
+            return True
+
+        for score, row in zip(scores[1:], idx[1:]):
+            if row < 0:
+                break
+            if self.labels[row] != label:
+                return scores[0] - score < LLM_MIN_MARGIN
+        return False
+
+    def _encode(self, texts):
+        # El modelo se carga en el primer encode que no esté en cache
+        return get_embedding_model().encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
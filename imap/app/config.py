@@ -18,22 +18,45 @@ IMAP_LIMIT = int(os.getenv("IMAP_LIMIT", "0") or 0)
 # Only fetch messages that have attachments (useful to skip plain notifications)
 IMAP_ONLY_WITH_ATTACHMENTS = os.getenv("IMAP_ONLY_WITH_ATTACHMENTS", "false").lower() in ("1","true","yes")
 
-# Paths
-OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "output"))
-PDF_SAVE_DIR = OUTPUT_DIR / "pdfs"
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-PDF_SAVE_DIR.mkdir(parents=True, exist_ok=True)
-
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 MONGO_DB = os.getenv("MONGO_DB", "finanzas")
 MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "movimientos")
 MONGO_EMAIL_SETUP_COLLECTION = os.getenv("MONGO_EMAIL_SETUP_COLLECTION", "email_setups")
+# Cuerpos de email en Transaction_Raw_IMAP: "full" (html_body/text_body/body en claro)
+# o "compressed" (una copia canónica comprimida, ver body_codec.py)
+RAW_BODY_STORAGE = os.getenv("RAW_BODY_STORAGE", "full").strip().lower()
+RAW_BODY_CODEC = os.getenv("RAW_BODY_CODEC", "zstd").strip().lower()
 
+# Paths
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "output")
 PDF_SAVE_DIR = os.path.join(OUTPUT_DIR, "pdfs")
 JSON_OUTPUT = os.path.join(OUTPUT_DIR, "movimientos.json")
+# Store de adjuntos direccionado por contenido (sha256)
+ATTACHMENT_STORE_DIR = os.getenv("ATTACHMENT_STORE_DIR", os.path.join(OUTPUT_DIR, "attachments"))
 
 TESSERACT_CMD = os.getenv("TESSERACT_CMD", "/usr/bin/tesseract")
+# OCR en paralelo por página (1 = serial)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+# Modo adaptativo: primera pasada en escala de grises a baja resolución,
+# re-render a OCR_DPI solo si la calidad no alcanza (opt-in)
+OCR_ADAPTIVE = os.getenv("OCR_ADAPTIVE", "false").lower() in ("1", "true", "yes")
+OCR_FAST_DPI = int(os.getenv("OCR_FAST_DPI", "150"))
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "70"))
+OCR_MIN_LINE_MATCH_RATE = float(os.getenv("OCR_MIN_LINE_MATCH_RATE", "0.9"))
+# Re-render también páginas con texto pero sin ninguna línea-candidato (fechas
+# perdidas a baja resolución). Apagado: portadas y resúmenes pasan a la primera
+OCR_RETRY_NO_CANDIDATES = os.getenv("OCR_RETRY_NO_CANDIDATES", "false").lower() in ("1", "true", "yes")
+# Recorte a la tabla de movimientos: "left,top,right,bottom" en fracciones (ej: "0,0.15,1,0.95")
+OCR_CROP_BOX = os.getenv("OCR_CROP_BOX", "").strip()
+# Fast path: usar la capa de texto del PDF (pdftotext de poppler) antes de OCR
+OCR_TEXT_LAYER = os.getenv("OCR_TEXT_LAYER", "true").lower() in ("1", "true", "yes")
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "20"))
+PDFTOTEXT_CMD = os.getenv("PDFTOTEXT_CMD", "pdftotext")
+# Cache de OCR por SHA-256 del PDF (checkpoint por página)
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join(OUTPUT_DIR, "ocr_cache"))
+# Salida streaming: un JSONL por PDF (nombre = SHA-256)
+OCR_JSONL_DIR = os.getenv("OCR_JSONL_DIR", os.path.join(OUTPUT_DIR, "ocr"))
 
 OLLAMA_ENABLED = os.getenv("OLLAMA_ENABLED", "false").lower() == "true"
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
@@ -41,6 +64,30 @@ OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1")
 
 EMBED_MODEL = os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2")
 
+# Cache persistente de embeddings (LRU en memoria + memmap en disco)
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", os.path.join(OUTPUT_DIR, "embeddings"))
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "50000"))
+# Corpus etiquetado del clasificador (CSV con columnas text,label)
+LABELED_EXAMPLES_PATH = os.getenv(
+    "LABELED_EXAMPLES_PATH",
+    str(Path(__file__).resolve().parent.parent / "examples" / "labeled_examples.csv"),
+)
+# Registro versionado de parsers por banco (remitente / plantilla)
+PARSER_CONFIG_PATH = os.getenv(
+    "PARSER_CONFIG_PATH",
+    str(Path(__file__).resolve().parent.parent / "parsers" / "bank_parsers.json"),
+)
+# numpy | faiss | faiss-hnsw
+EXAMPLE_INDEX_BACKEND = os.getenv("EXAMPLE_INDEX_BACKEND", "numpy")
+
+# Segunda opinión LLM del clasificador
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "20"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "10000"))
+# Solo se consulta al LLM si el vecino más cercano es ambiguo
+LLM_MIN_SIMILARITY = float(os.getenv("LLM_MIN_SIMILARITY", "0.6"))
+LLM_MIN_MARGIN = float(os.getenv("LLM_MIN_MARGIN", "0.05"))
+
 # Behavior
 MOVE_PROCESSED_TO_FOLDER = os.getenv("MOVE_PROCESSED_TO_FOLDER", "").strip()  # e.g. "Processed"
 MARK_AS_SEEN = os.getenv("MARK_AS_SEEN", "true").lower() in ("1","true","yes")
@@ -59,4 +106,59 @@ IMAP_RECONNECT_BACKOFF = int(os.getenv("IMAP_RECONNECT_BACKOFF", "5"))  # 5 segu
 IMAP_MAX_RETRIES = int(os.getenv("IMAP_MAX_RETRIES", "5"))  # 5 reintentos
 
 # Habilitar modo persistente (loop infinito)
-IMAP_PERSISTENT_MODE = os.getenv("IMAP_PERSISTENT_MODE", "false").lower() in ("1", "true", "yes")
\ No newline at end of file
+IMAP_PERSISTENT_MODE = os.getenv("IMAP_PERSISTENT_MODE", "false").lower() in ("1", "true", "yes")
+
+# ============================================================================
+# CACHE DE CONFIGURACIÓN POR TENANT
+# ============================================================================
+
+# Setups, mapa remitente→contexto y credenciales IMAP (segundos)
+TENANT_CACHE_TTL = float(os.getenv("TENANT_CACHE_TTL", "300"))
+# Nombre real de la carpeta IMAP (LIST) por tenant
+FOLDER_CACHE_TTL = float(os.getenv("FOLDER_CACHE_TTL", "3600"))
+# Invalidar por change stream de Mongo (requiere replica set)
+TENANT_CACHE_CHANGE_STREAM = os.getenv("TENANT_CACHE_CHANGE_STREAM", "false").lower() in ("1", "true", "yes")
+
+# ============================================================================
+# PROFILING BAJO DEMANDA (pyinstrument, ver profiling.py)
+# ============================================================================
+
+# Permite ?profile=true / X-Profile: 1 en /ingest (false = se ignora el flag)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(OUTPUT_DIR, "profiles"))
+# Intervalo de muestreo en segundos
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+# Perfiles guardados (se borran los más antiguos)
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+# ============================================================================
+# TRAZAS POR EMAIL (ver tracing.py)
+# ============================================================================
+
+# none | file (JSONL local) | otlp (OTLP/HTTP JSON a un collector)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").strip().lower()
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(OUTPUT_DIR, "traces", "spans.jsonl"))
+OTLP_TRACES_ENDPOINT = os.getenv("OTLP_TRACES_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "imap-service")
+# Spans por envío y espera máxima antes de exportar (segundos)
+TRACE_EXPORT_BATCH = int(os.getenv("TRACE_EXPORT_BATCH", "200"))
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", "2"))
+# Emails más lentos que esto se loguean con su trace id (0 = no loguear)
+TRACE_SLOW_EMAIL_MS = float(os.getenv("TRACE_SLOW_EMAIL_MS", "5000"))
+
+# ============================================================================
+# CIRCUIT BREAKER DEL AGENTE Y EXTRACCIÓN DIFERIDA (ver extraction_queue.py)
+# ============================================================================
+
+# Timeout de conexión al agente (el de lectura es IA_TIMEOUT en api.py)
+IA_CONNECT_TIMEOUT = float(os.getenv("IA_CONNECT_TIMEOUT", "2"))
+# Fallas seguidas (timeout, conexión, 5xx) que abren el circuito
+AGENT_BREAKER_FAILURES = int(os.getenv("AGENT_BREAKER_FAILURES", "3"))
+# Segundos abierto antes de dejar pasar una llamada de prueba
+AGENT_BREAKER_RESET_SECONDS = float(os.getenv("AGENT_BREAKER_RESET_SECONDS", "30"))
+# Worker que reintenta los raw con extraction_pending
+EXTRACTION_WORKER_ENABLED = os.getenv("EXTRACTION_WORKER_ENABLED", "true").lower() in ("1", "true", "yes")
+EXTRACTION_RETRY_INTERVAL = float(os.getenv("EXTRACTION_RETRY_INTERVAL", "30"))
+EXTRACTION_BATCH_SIZE = int(os.getenv("EXTRACTION_BATCH_SIZE", "20"))
+# Reintentos del worker antes de dejar el raw en extraction_failed
+EXTRACTION_MAX_ATTEMPTS = int(os.getenv("EXTRACTION_MAX_ATTEMPTS", "5"))
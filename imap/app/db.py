@@ -1,19 +1,32 @@
-from pymongo import MongoClient
-from .config import MONGO_URI, MONGO_DB, MONGO_COLLECTION
+from .config import MONGO_DB, MONGO_COLLECTION
+from .resources import get_mongo_client
 import logging
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
-# Cliente MongoDB global
-client = MongoClient(MONGO_URI)
-
 # Base de datos y colecciones por defecto (fallback)
-db = client[MONGO_DB]
-raw_emails_col = db[MONGO_COLLECTION]
-processed_emails_col = db["Transaction_Raw_IMAP"]
-email_setup_col = db["email_setups"]
-imap_config_col = db["imap_config"]
+# Se resuelven en el primer acceso: importar este módulo no abre conexiones
+_DEFAULT_COLLECTIONS = {
+    "raw_emails_col": MONGO_COLLECTION,
+    "processed_emails_col": "Transaction_Raw_IMAP",
+    "email_setup_col": "email_setups",
+    "imap_config_col": "imap_config",
+}
+
+
+def get_default_db():
+    return get_mongo_client()[MONGO_DB]
+
+
+def __getattr__(name):
+    if name == "client":
+        return get_mongo_client()
+    if name == "db":
+        return get_default_db()
+    if name in _DEFAULT_COLLECTIONS:
+        return get_default_db()[_DEFAULT_COLLECTIONS[name]]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # ============================================================================
 # 🆕 MULTI-TENANT DATABASE ACCESS
@@ -29,7 +42,7 @@ def get_tenant_db(db_name: str):
     Returns:
         Database object
     """
-    return client[db_name]
+    return get_mongo_client()[db_name]
 
 def get_tenant_collections(db_name: str):
     """
@@ -39,7 +52,8 @@ def get_tenant_collections(db_name: str):
         db_name: Nombre de la base de datos del tenant
     
     Returns:
-        Dict con las colecciones: email_setup_col, imap_config_col, raw_emails_col, processed_emails_col
+        Dict con las colecciones: email_setup_col, imap_config_col, raw_emails_col,
+        processed_emails_col, ocr_rows_col
     """
     tenant_db = get_tenant_db(db_name)
     
@@ -47,7 +61,8 @@ def get_tenant_collections(db_name: str):
         "email_setup_col": tenant_db["email_setups"],
         "imap_config_col": tenant_db["imap_config"],
         "raw_emails_col": tenant_db["Transaction_Raw_IMAP"],
-        "processed_emails_col": tenant_db["Transaction_Processed_IMAP"]
+        "processed_emails_col": tenant_db["Transaction_Processed_IMAP"],
+        "ocr_rows_col": tenant_db["Transaction_Raw_OCR"]
     }
 
 # ============================================================================
@@ -67,7 +82,7 @@ def is_uid_processed(uid, folder=None, db_name: str = None):
         cols = get_tenant_collections(db_name)
         raw_col = cols["raw_emails_col"]
     else:
-        raw_col = raw_emails_col
+        raw_col = get_default_db()[_DEFAULT_COLLECTIONS["raw_emails_col"]]
     
     query = {"_id": uid}
     if folder:
@@ -88,7 +103,7 @@ def mark_uid_processed(uid, metadata: dict, db_name: str = None):
         tenant_db = get_tenant_db(db_name)
         processed_col = tenant_db["processed_uids"]
     else:
-        processed_col = db["processed_uids"]
+        processed_col = get_default_db()["processed_uids"]
     
     processed_col.update_one(
         {"_id": uid},
@@ -167,14 +182,9 @@ def resolve_context(email_metadata: dict, db_name: str = None) -> EmailContext:
     
     logger.info(f"🔍 Resolving context for email from: {from_addr}")
     
-    # Buscar setup en la BD del tenant (o BD por defecto)
-    if db_name:
-        cols = get_tenant_collections(db_name)
-        setup_col = cols["email_setup_col"]
-    else:
-        setup_col = email_setup_col
-    
-    setup = setup_col.find_one({"bank_sender": from_addr})
+    # Buscar setup en la BD del tenant (o BD por defecto), mapa cacheado por remitente
+    from .tenant_cache import get_sender_map
+    setup = get_sender_map(db_name).get(from_addr.strip().lower())
     
     if not setup:
         logger.warning(f"⚠️ No setup found for sender: {from_addr}")
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos
+    fcntl = None
+
+from .config import EMBED_CACHE_DIR, EMBED_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_description(text: str) -> str:
+    """Normaliza una descripción para usarla como clave de cache"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return _WS_RE.sub(" ", text).strip().lower()
+
+
+class EmbeddingCache:
+    """
+    Cache persistente de embeddings por (texto normalizado, modelo).
+
+    Dos niveles:
+    - LRU en memoria para los textos más frecuentes.
+    - Store en disco: `vectors.f32` (float32 crudo, leído con memmap)
+      + `keys.txt` (`<hash>\t<fila>` por línea; una key repetida vale por
+      su última fila).
+
+    Varios procesos pueden compartir el directorio: los appends van bajo
+    `flock` y la fila sale del tamaño real de `vectors.f32`.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = EMBED_CACHE_DIR, lru_size: int = EMBED_CACHE_SIZE):
+        safe_model = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.model_name = model_name
+        self.dir = Path(cache_dir) / safe_model
+        self.lru_size = lru_size
+
+        self._lru = OrderedDict()
+        self._rows = {}
+        self._dim = None
+        self._mmap = None
+        self._lock = threading.Lock()
+
+        self._load_index()
+
+    @property
+    def _vectors_path(self):
+        return self.dir / "vectors.f32"
+
+    @property
+    def _keys_path(self):
+        return self.dir / "keys.txt"
+
+    @property
+    def _meta_path(self):
+        return self.dir / "meta.json"
+
+    @property
+    def _lock_path(self):
+        return self.dir / ".lock"
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(normalize_description(text).encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self._rows)
+
+    # ------------------------------------------------------------------
+    # Disco
+    # ------------------------------------------------------------------
+
+    def _load_index(self):
+        if not self._meta_path.exists():
+            return
+
+        try:
+            meta = json.loads(self._meta_path.read_text())
+            self._dim = int(meta["dim"])
+
+            # Si el proceso murió entre escribir vectores y keys, quedarse con lo consistente
+            stored_rows = self._stored_rows()
+            with open(self._keys_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    key, _, row = line.strip().partition("\t")
+                    if not key or not row.isdigit():
+                        continue  # línea cortada por un append interrumpido
+                    row = int(row)
+                    if row < stored_rows:
+                        self._rows[key] = row  # la última fila de la key gana
+
+            logger.info(f"📦 Embedding cache loaded: {len(self._rows)} vectors ({self.model_name})")
+        except Exception as e:
+            logger.warning(f"⚠️ Embedding cache unreadable, starting empty: {e}")
+            self._rows = {}
+            self._dim = None
+
+    def _stored_rows(self) -> int:
+        """Filas completas en vectors.f32 (incluye las de otros procesos)"""
+        if not self._vectors_path.exists():
+            return 0
+        return os.path.getsize(self._vectors_path) // (4 * self._dim)
+
+    def _disk_get(self, key: str):
+        row = self._rows.get(key)
+        if row is None:
+            return None
+
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            self._mmap = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r",
+                shape=(self._stored_rows(), self._dim),
+            )
+        return np.array(self._mmap[row])
+
+    def _disk_append(self, keys, vectors):
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+        with open(self._lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self._dim is None:
+                    # Otro proceso pudo crear el store mientras tanto
+                    if self._meta_path.exists():
+                        self._dim = int(json.loads(self._meta_path.read_text())["dim"])
+                    else:
+                        self._dim = int(vectors.shape[1])
+                        self._meta_path.write_text(json.dumps({"model": self.model_name, "dim": self._dim}))
+
+                start = self._stored_rows()
+                # Vectores primero: una key sin vector se descarta al cargar
+                with open(self._vectors_path, "ab") as f:
+                    f.truncate(start * 4 * self._dim)  # descarta una fila a medio escribir
+                    f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                with open(self._keys_path, "a", encoding="utf-8") as f:
+                    f.write("".join(f"{k}\t{start + offset}\n" for offset, k in enumerate(keys)))
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        for offset, key in enumerate(keys):
+            self._rows[key] = start + offset
+
+    # ------------------------------------------------------------------
+    # LRU
+    # ------------------------------------------------------------------
+
+    def _lru_get(self, key: str):
+        vector = self._lru.get(key)
+        if vector is not None:
+            self._lru.move_to_end(key)
+        return vector
+
+    def _lru_put(self, key: str, vector):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    def get_many(self, texts, encode_fn):
+        """
+        Retorna una matriz (len(texts), dim) de embeddings.
+
+        Solo los textos que no están en cache se pasan a `encode_fn`
+        (originales, uno por key) y se persisten; el texto normalizado
+        solo se usa como key.
+        """
+        keys = [self.key(t) for t in texts]
+        vectors = [None] * len(texts)
+        missing = OrderedDict()
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._lru_get(key)
+                if vector is None:
+                    vector = self._disk_get(key)
+                    if vector is not None:
+                        self._lru_put(key, vector)
+                if vector is None:
+                    missing.setdefault(key, texts[i])
+                vectors[i] = vector
+
+        if missing:
+            encoded = np.asarray(encode_fn(list(missing.values())), dtype=np.float32)
+            fresh = dict(zip(missing.keys(), encoded))
+
+            with self._lock:
+                new_keys = [k for k in fresh if k not in self._rows]
+                if new_keys:
+                    self._disk_append(new_keys, np.stack([fresh[k] for k in new_keys]))
+                for key, vector in fresh.items():
+                    self._lru_put(key, vector)
+
+            vectors = [v if v is not None else fresh[k] for v, k in zip(vectors, keys)]
+
+        return np.stack(vectors)
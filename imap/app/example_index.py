@@ -0,0 +1,118 @@
+import logging
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # Backend opcional
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+
+class ExampleIndex:
+    """
+    Índice vectorial de ejemplos etiquetados (similitud coseno).
+
+    Backends:
+    - "numpy": matriz normalizada + top-k por bloques (exacto, memoria acotada).
+    - "faiss": IndexFlatIP (exacto, SIMD).
+    - "faiss-hnsw": IndexHNSWFlat (aproximado, para 10^6+ ejemplos).
+
+    Los vectores de entrada deben venir normalizados a norma 1.
+    `add()` es incremental: no hay refit al agregar ejemplos.
+    """
+
+    def __init__(self, dim: int, backend: str = "numpy", chunk_size: int = 65536):
+        if backend.startswith("faiss") and faiss is None:
+            logger.warning(f"⚠️ faiss not installed, falling back to numpy index (requested: {backend})")
+            backend = "numpy"
+
+        self.dim = dim
+        self.backend = backend
+        self.chunk_size = chunk_size
+        self.labels = []
+        self.texts = []
+
+        self._size = 0
+        self._matrix = np.empty((1024, dim), dtype=np.float32)
+
+        if backend == "faiss":
+            self._faiss = faiss.IndexFlatIP(dim)
+        elif backend == "faiss-hnsw":
+            self._faiss = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        else:
+            self._faiss = None
+
+    def __len__(self):
+        return self._size
+
+    def add(self, vectors, labels, texts=None):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n = vectors.shape[0]
+        if n == 0:
+            return
+
+        if self._faiss is not None:
+            self._faiss.add(vectors)
+        else:
+            # Crecimiento amortizado (duplicar capacidad)
+            needed = self._size + n
+            if needed > self._matrix.shape[0]:
+                capacity = max(needed, 2 * self._matrix.shape[0])
+                grown = np.empty((capacity, self.dim), dtype=np.float32)
+                grown[:self._size] = self._matrix[:self._size]
+                self._matrix = grown
+            self._matrix[self._size:needed] = vectors
+
+        self._size += n
+        self.labels.extend(labels)
+        self.texts.extend(texts if texts is not None else [None] * n)
+
+    def search(self, queries, k: int = 1):
+        """
+        Retorna (scores, indices), ambos de forma (len(queries), k),
+        ordenados de mayor a menor similitud. Índices -1 si hay menos de k ejemplos.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        k_eff = min(k, self._size)
+
+        if k_eff == 0:
+            return (np.full((len(queries), k), -np.inf, dtype=np.float32),
+                    np.full((len(queries), k), -1, dtype=np.int64))
+
+        if self._faiss is not None:
+            scores, idx = self._faiss.search(queries, k_eff)
+        else:
+            scores, idx = self._search_numpy(queries, k_eff)
+
+        if k_eff < k:
+            pad = k - k_eff
+            scores = np.pad(scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+            idx = np.pad(idx, ((0, 0), (0, pad)), constant_values=-1)
+        return scores, idx
+
+    def _search_numpy(self, queries, k):
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_idx = np.full((len(queries), k), -1, dtype=np.int64)
+        rows = np.arange(len(queries))[:, None]
+
+        # Por bloques: memoria O(queries x chunk) aunque haya 10^6 ejemplos
+        for start in range(0, self._size, self.chunk_size):
+            block = self._matrix[start:min(start + self.chunk_size, self._size)]
+            sims = queries @ block.T
+
+            if sims.shape[1] > k:
+                part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            else:
+                part = np.broadcast_to(np.arange(sims.shape[1]), (len(queries), sims.shape[1]))
+
+            cand_scores = np.concatenate([best_scores, sims[rows, part]], axis=1)
+            cand_idx = np.concatenate([best_idx, part + start], axis=1)
+
+            top = np.argpartition(-cand_scores, k - 1, axis=1)[:, :k]
+            best_scores = cand_scores[rows, top]
+            best_idx = cand_idx[rows, top]
+
+        order = np.argsort(-best_scores, axis=1)
+        return best_scores[rows, order], best_idx[rows, order]
@@ -0,0 +1,226 @@
+"""
+Extracción diferida: emails guardados mientras el agente no estaba disponible.
+
+Si el circuit breaker del agente está abierto (o la llamada falla por
+timeout / conexión / 5xx), /ingest guarda el raw igual, sin esperar, con
+`extraction_status: "extraction_pending"` y anota el tenant en la
+colección `extraction_pending_tenants` de la BD por defecto.
+
+Un hilo daemon revisa esos tenants cada EXTRACTION_RETRY_INTERVAL y
+reintenta por lotes de EXTRACTION_BATCH_SIZE, una vez por documento y por
+vuelta, primero los que nunca fallaron (extraction_attempts, luego
+extraction_pending_since). Una falla de un email suma un intento y guarda
+el error; a los EXTRACTION_MAX_ATTEMPTS queda en `extraction_failed`. Los
+reintentos de emails que ya fallaron no cuentan para el breaker, así un
+email que siempre hace fallar al agente no vuelve a abrir el circuito.
+Solo un circuito realmente abierto corta la vuelta (todos los tenants).
+"""
+import logging
+import threading
+from datetime import datetime
+
+from .body_codec import decode_bodies
+from .config import EXTRACTION_BATCH_SIZE, EXTRACTION_RETRY_INTERVAL, EXTRACTION_MAX_ATTEMPTS
+from .db import get_default_db, get_tenant_collections
+from .html_preprocess import preprocess_html
+from .metrics import EXTRACTION_DEFERRED, EXTRACTION_RETRIED, tenant_label
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+EXTRACTED = "extracted"
+PENDING = "extraction_pending"
+NOT_EXTRACTED = "not_extracted"
+FAILED = "extraction_failed"
+
+PENDING_TENANTS_COLLECTION = "extraction_pending_tenants"
+
+_wake = threading.Event()
+_worker_lock = threading.Lock()
+_worker_started = False
+_last_run = {}
+
+
+class AgentUnavailable(Exception):
+    """El agente no está disponible (circuito abierto, timeout, conexión o 5xx)"""
+
+    def __init__(self, reason: str, rejected: bool = False):
+        super().__init__(reason)
+        # True: el breaker rechazó la llamada sin intentarla (circuito abierto)
+        self.rejected = rejected
+
+
+def mark_pending(raw_data: dict, reason: str):
+    """Marca un raw (antes del insert) para extracción diferida"""
+    raw_data["extraction_status"] = PENDING
+    raw_data["extraction_pending_since"] = datetime.utcnow()
+    raw_data["extraction_pending_reason"] = reason
+    raw_data["extraction_attempts"] = 0
+
+
+def mark_pending_tenant(db_name: str):
+    """Anota que el tenant tiene raws pendientes (se llama después del insert)"""
+    EXTRACTION_DEFERRED.labels(tenant=tenant_label(db_name)).inc()
+    get_default_db()[PENDING_TENANTS_COLLECTION].update_one(
+        {"_id": db_name}, {"$set": {"updated_at": datetime.utcnow()}}, upsert=True
+    )
+
+
+def apply_payload(update: dict, ai_payload: dict | None, normalize_tv):
+    """Campos de extracción de un raw a partir de la respuesta del agente"""
+    if ai_payload:
+        update["transactionVariables"] = normalize_tv(ai_payload.get("transactionVariables"))
+        update["transactionType"] = ai_payload.get("transactionType")
+        update["transactionConfidence"] = ai_payload.get("confidence")
+    update["extraction_status"] = EXTRACTED if ai_payload else NOT_EXTRACTED
+    return update
+
+
+def drain_tenant(db_name: str, batch_size: int = EXTRACTION_BATCH_SIZE, pass_started: datetime = None) -> tuple:
+    """
+    Reintenta un lote de raws pendientes del tenant no intentados en esta vuelta.
+
+    Returns:
+        (procesados, estado) con estado "drained" | "more" | "unavailable"
+    """
+    # Import diferido: api importa este módulo
+    from .api import extract_transaction_via_ai, normalize_transaction_variables
+
+    pass_started = pass_started or datetime.utcnow()
+    raw_col = get_tenant_collections(db_name)["raw_emails_col"]
+    docs = list(
+        raw_col.find({
+            "extraction_status": PENDING,
+            "$or": [
+                {"extraction_last_attempt_at": {"$exists": False}},
+                {"extraction_last_attempt_at": {"$lt": pass_started}},
+            ],
+        })
+        .sort([("extraction_attempts", 1), ("extraction_pending_since", 1)])
+        .limit(batch_size)
+    )
+    tenant = tenant_label(db_name)
+
+    processed = 0
+    for doc in docs:
+        attempts = doc.get("extraction_attempts") or 0
+        with span("extraction.retry", tenant=db_name, raw_id=str(doc["_id"]), uid=doc.get("uid"),
+                  attempts=attempts) as retry_span:
+            try:
+                html_body, _ = decode_bodies(doc)
+                canonical = preprocess_html(html_body) if html_body else None
+                ai_payload = extract_transaction_via_ai(
+                    html_body, canonical, db_name=db_name, count_failures=attempts == 0
+                )
+                update = apply_payload({"extracted_at": datetime.utcnow()}, ai_payload, normalize_transaction_variables)
+                raw_col.update_one(
+                    {"_id": doc["_id"], "extraction_status": PENDING},
+                    {
+                        "$set": {**update, "extraction_last_attempt_at": datetime.utcnow()},
+                        "$unset": {"extraction_pending_since": "", "extraction_pending_reason": ""},
+                        "$inc": {"extraction_attempts": 1},
+                    },
+                )
+                result = update["extraction_status"]
+            except AgentUnavailable as unavailable:
+                if unavailable.rejected:
+                    EXTRACTION_RETRIED.labels(tenant=tenant, result="unavailable").inc()
+                    return processed, "unavailable"
+                _record_failed_attempt(raw_col, doc, attempts + 1, str(unavailable))
+                result = "error"
+            except Exception as e:
+                # Falla propia del email (body ilegible, HTML, payload): no frena al resto
+                logger.error(f"❌ Deferred extraction failed for raw {doc['_id']} ({db_name}): {e}")
+                retry_span.record_error(e)
+                _record_failed_attempt(raw_col, doc, attempts + 1, f"{type(e).__name__}: {e}")
+                result = "error"
+
+        EXTRACTION_RETRIED.labels(tenant=tenant, result=result).inc()
+        processed += 1
+
+    return processed, "more" if len(docs) == batch_size else "drained"
+
+
+def _record_failed_attempt(raw_col, doc: dict, attempts: int, error: str):
+    """Suma el intento y guarda el error; al llegar al máximo pasa a extraction_failed"""
+    update = {
+        "extraction_attempts": attempts,
+        "extraction_last_error": error,
+        "extraction_last_attempt_at": datetime.utcnow(),
+    }
+    if attempts >= EXTRACTION_MAX_ATTEMPTS:
+        update["extraction_status"] = FAILED
+        logger.warning(f"⚠️ Raw {doc['_id']} gave up after {attempts} extraction attempts ({error})")
+    raw_col.update_one({"_id": doc["_id"], "extraction_status": PENDING}, {"$set": update})
+
+
+def drain_pending(batch_size: int = EXTRACTION_BATCH_SIZE) -> dict:
+    """Una vuelta del worker sobre todos los tenants con pendientes"""
+    tenants_col = get_default_db()[PENDING_TENANTS_COLLECTION]
+    summary = {"processed": 0, "tenants": 0, "agent_unavailable": False}
+    pass_started = datetime.utcnow()
+
+    for entry in list(tenants_col.find({})):
+        db_name = entry["_id"]
+        summary["tenants"] += 1
+        while True:
+            processed, status = drain_tenant(db_name, batch_size, pass_started)
+            summary["processed"] += processed
+            if status != "more":
+                break
+
+        # Solo un circuito abierto corta la vuelta: el resto de los tenants espera
+        if status == "unavailable":
+            summary["agent_unavailable"] = True
+            break
+
+        # Solo si nadie volvió a marcar el tenant mientras se drenaba
+        pending_left = get_tenant_collections(db_name)["raw_emails_col"].count_documents(
+            {"extraction_status": PENDING}
+        )
+        if not pending_left:
+            tenants_col.delete_one({"_id": db_name, "updated_at": entry.get("updated_at")})
+
+    if summary["processed"]:
+        logger.info(f"🔁 Deferred extraction: {summary['processed']} emails from {summary['tenants']} tenants")
+    _last_run.update({"at": datetime.utcnow().isoformat(), **summary})
+    return summary
+
+
+def _run_worker():
+    while True:
+        _wake.wait(EXTRACTION_RETRY_INTERVAL)
+        _wake.clear()
+        try:
+            drain_pending()
+        except Exception as e:
+            logger.error(f"❌ Deferred extraction worker error: {e}", exc_info=True)
+
+
+def start_extraction_worker():
+    global _worker_started
+    with _worker_lock:
+        if _worker_started:
+            return
+        _worker_started = True
+    threading.Thread(target=_run_worker, name="extraction-retry", daemon=True).start()
+    logger.info(f"🔁 Deferred extraction worker started (every {EXTRACTION_RETRY_INTERVAL:.0f}s)")
+
+
+def wake_worker():
+    """Adelanta la próxima vuelta del worker (POST /extraction/drain)"""
+    _wake.set()
+
+
+def get_queue_stats() -> dict:
+    try:
+        tenants = {}
+        for entry in get_default_db()[PENDING_TENANTS_COLLECTION].find({}):
+            raw_col = get_tenant_collections(entry["_id"])["raw_emails_col"]
+            tenants[entry["_id"]] = {
+                "pending": raw_col.count_documents({"extraction_status": PENDING}),
+                "failed": raw_col.count_documents({"extraction_status": FAILED}),
+            }
+    except Exception as e:
+        tenants = {"error": str(e)}
+    return {"worker_running": _worker_started, "pending_by_tenant": tenants, "last_run": dict(_last_run)}
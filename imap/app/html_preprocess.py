@@ -0,0 +1,77 @@
+"""
+Preprocesamiento único del HTML de cada notificación.
+
+El HTML se parsea una sola vez en la ingesta y se reduce a una
+representación canónica compacta que consumen tanto los parsers locales
+como el agente de extracción (`POST /extract/canonical`):
+
+    {
+        "version": 2,
+        "lines":  [...],          # fragmentos de texto visibles, en orden
+        "tables": [[k, v], ...],  # filas de tabla con al menos dos celdas; una
+                                  # celda igual a una línea va como su índice (int)
+    }
+
+Mismo parser (lxml), mismas etiquetas descartadas y mismo recorrido de
+tablas que `clean_html` del agente: `lines` / `tables` dan el mismo texto
+estructurado. El HTML no viaja (con estilos y atributos pesaba más que el
+raw); el agente corre sus regex sobre las líneas. Con las celdas por índice
+y `canonical_json` el payload queda por debajo del HTML crudo.
+"""
+import json
+
+from bs4 import BeautifulSoup
+
+# Fijo: otro parser arma otro árbol y el resultado dejaría de coincidir con el agente
+PARSER = "lxml"
+
+CANONICAL_VERSION = 2
+
+DROP_TAGS = ["script", "style", "meta", "noscript", "link", "img"]
+
+
+def preprocess_html(html: str) -> dict:
+    """Parsea el HTML una vez y retorna la representación canónica"""
+    if not html:
+        return None
+
+    soup = BeautifulSoup(html, PARSER)
+    for tag in soup(DROP_TAGS):
+        tag.decompose()
+
+    lines = list(soup.stripped_strings)
+    # Primera aparición de cada línea, para referenciar celdas por índice
+    line_index = {}
+    for i, line in enumerate(lines):
+        line_index.setdefault(line, i)
+
+    tables = []
+    for table in soup.find_all("table"):
+        for tr in table.find_all("tr"):
+            cells = [td.get_text(strip=True) for td in tr.find_all(["td", "th"])]
+            if len(cells) >= 2:
+                tables.append([line_index.get(cell, cell) for cell in cells[:2]])
+
+    return {
+        "version": CANONICAL_VERSION,
+        "lines": lines,
+        "tables": tables,
+    }
+
+
+def canonical_tables(canonical: dict) -> list:
+    """Filas [k, v] con las celdas por índice resueltas a su línea"""
+    if not canonical:
+        return []
+    lines = canonical.get("lines", [])
+    return [[lines[c] if isinstance(c, int) else c for c in row] for row in canonical.get("tables", [])]
+
+
+def canonical_json(body: dict) -> bytes:
+    """JSON compacto en UTF-8 (sin escapes \\uXXXX) para el request al agente"""
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def canonical_text(canonical: dict, separator: str = "\n") -> str:
+    """Texto plano equivalente a soup.get_text(separator, strip=True)"""
+    return separator.join(canonical.get("lines", [])) if canonical else ""
@@ -5,30 +5,30 @@ from datetime import datetime, timedelta
 from imapclient import IMAPClient, SEEN
 import pyzmail
 from email.utils import parsedate_to_datetime
-from pathlib import Path
 from .config import (
     IMAP_HOST, IMAP_PORT, IMAP_USER, IMAP_PASS, IMAP_FOLDER,
-    IMAP_SENDER_FILTER, IMAP_SUBJECT_FILTER, IMAP_DATE_FROM,
-    IMAP_LIMIT, IMAP_ONLY_WITH_ATTACHMENTS, PDF_SAVE_DIR,
+    IMAP_SENDER_FILTER, IMAP_DATE_FROM,
+    IMAP_LIMIT, IMAP_ONLY_WITH_ATTACHMENTS,
     MOVE_PROCESSED_TO_FOLDER, MARK_AS_SEEN,
-    MONGO_URI, MONGO_DB, MONGO_EMAIL_SETUP_COLLECTION,
-    MONGO_COLLECTION
+    MONGO_DB, MONGO_EMAIL_SETUP_COLLECTION
+)
+from .db import is_uid_processed, mark_uid_processed, get_default_db
+from .attachment_store import AttachmentStore, iter_part_chunks
+from .tenant_cache import get_email_setups, get_imap_config, get_resolved_folder
+from .keyword_matcher import get_subject_matcher
+from .tracing import span
+from .metrics import (
+    IMAP_CONNECT_SECONDS, IMAP_SEARCH_SECONDS, IMAP_SEARCH_MATCHES,
+    IMAP_FETCH_SECONDS, IMAP_FETCH_BYTES, timed, filtered, tenant_label,
 )
-from .db import is_uid_processed, mark_uid_processed
-from pymongo import MongoClient
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Clientes MongoDB (fallback)
-client = MongoClient(MONGO_URI)
-db = client[MONGO_DB]
-email_setup_col = db[MONGO_EMAIL_SETUP_COLLECTION]
-raw_emails_col = db[MONGO_COLLECTION]
-imap_config_col = db["imap_config"]
-
 PDF_EXT_RE = re.compile(r"\.pdf$", re.IGNORECASE)
 
+_attachment_store = AttachmentStore()
+
 
 def resolve_imap_folder(imap, folder_name):
     """Resuelve el nombre de la carpeta IMAP (ej: All Mail en Gmail)"""
@@ -159,30 +159,38 @@ def _extract_text_html(msg):
     return text_body, html_body
 
 
-def _save_attachment(uid, filename, part):
-    """Guarda un attachment en disco"""
-    safe_name = filename.replace("/", "_").replace("\\", "_")
-    timestamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-    fname = f"{uid}_{timestamp}_{safe_name}"
-    path = Path(PDF_SAVE_DIR) / fname
-    payload = part.get_payload()
-    
-    if isinstance(payload, str):
-        payload = payload.encode("utf-8", errors="ignore")
-    
-    with open(path, "wb") as f:
-        f.write(payload)
-    
-    return str(path.resolve())
+def _attachment_ref_prefix(uid, db_name: str = None) -> str:
+    return f"{db_name or MONGO_DB}:{uid}:"
+
+
+def _save_attachment(uid, filename, part, db_name: str = None):
+    """
+    Guarda un attachment en el store direccionado por contenido.
+    Se escribe por bloques y un mismo PDF se guarda una sola vez.
+    """
+    ref = f"{_attachment_ref_prefix(uid, db_name)}{filename}"
+    _, path, _ = _attachment_store.put_stream(iter_part_chunks(part), filename, ref)
+    return path
+
+
+def release_attachments(uid, pdf_paths, db_name: str = None):
+    """
+    Suelta las referencias de un email a sus adjuntos (raw borrado o
+    descartado sin guardar); el GC borra los blobs que queden sin refs.
+    """
+    try:
+        _attachment_store.release_prefix(pdf_paths or [], _attachment_ref_prefix(uid, db_name))
+    except Exception as e:
+        logger.warning(f"⚠️ Could not release attachments of UID {uid}: {e}")
 
 
-def _extract_pdfs_from_pyzmessage(msg, uid):
+def _extract_pdfs_from_pyzmessage(msg, uid, db_name: str = None):
     """Extrae PDFs de un mensaje pyzmail"""
     saved = []
     for part in msg.mailparts:
         filename = part.filename
         if filename and PDF_EXT_RE.search(filename):
-            path = _save_attachment(uid, filename, part)
+            path = _save_attachment(uid, filename, part, db_name=db_name)
             saved.append({"filename": filename, "path": path, "mime": part.type})
     return saved
 
@@ -194,26 +202,26 @@ def _create_imap_client(db_name: str = None):
     """
     max_retries = 3
     
-    # Obtener configuración IMAP (de tenant o global)
+    # Obtener configuración IMAP (de tenant o global, cacheada)
+    imap_config = get_imap_config(db_name)
     if db_name:
-        from .db import get_tenant_collections
-        cols = get_tenant_collections(db_name)
-        imap_config = cols["imap_config_col"].find_one({"active": True}, {"_id": 0})
         logger.info(f"📦 Loading IMAP config from tenant DB: {db_name}")
     else:
-        imap_config = imap_config_col.find_one({"active": True}, {"_id": 0})
         logger.info("📦 Loading IMAP config from default DB")
     
+    tenant = tenant_label(db_name)
     for attempt in range(max_retries):
         try:
-            client = IMAPClient(IMAP_HOST, port=IMAP_PORT, use_uid=True, ssl=True, timeout=60)
+            with timed(IMAP_CONNECT_SECONDS, tenant=tenant, phase="connect"):
+                client = IMAPClient(IMAP_HOST, port=IMAP_PORT, use_uid=True, ssl=True, timeout=60)
             
-            if imap_config:
-                client.login(imap_config.get("user"), imap_config.get("password"))
-                logger.info(f"✅ IMAP connected with DB config")
-            else:
-                client.login(IMAP_USER, IMAP_PASS)
-                logger.info("✅ IMAP connected with environment config")
+            with timed(IMAP_CONNECT_SECONDS, tenant=tenant, phase="login"):
+                if imap_config:
+                    client.login(imap_config.get("user"), imap_config.get("password"))
+                    logger.info(f"✅ IMAP connected with DB config")
+                else:
+                    client.login(IMAP_USER, IMAP_PASS)
+                    logger.info("✅ IMAP connected with environment config")
             
             return client
             
@@ -260,38 +268,30 @@ def connect_and_download_pdfs(
     
     # === CONFIGURACIÓN MULTI-TENANT ===
     if db_name:
-        from .db import get_tenant_collections
-        cols = get_tenant_collections(db_name)
-        email_setup_col_target = cols["email_setup_col"]
         logger.info(f"📦 Using tenant database: {db_name}")
     else:
-        email_setup_col_target = email_setup_col
         logger.info(f"📦 Using default database: {MONGO_DB}")
     
     client = None
     try:
         # === CONECTAR A IMAP ===
-        client = _create_imap_client(db_name)
-        folder = resolve_imap_folder(client, folder or IMAP_FOLDER)
+        with span("imap.connect"):
+            client = _create_imap_client(db_name)
+        folder = get_resolved_folder(
+            db_name, folder or IMAP_FOLDER, lambda name: resolve_imap_folder(client, name)
+        )
         client.select_folder(folder, readonly=False)
         limit = limit if (limit is not None) else (IMAP_LIMIT or 0)
         
         # === OBTENER FILTROS DESDE BD ===
-        setups = list(email_setup_col_target.find({}))
+        setups = get_email_setups(db_name)
         senders = [s["bank_sender"].strip() for s in setups if s.get("bank_sender")]
         
         if verbose and senders:
             logger.info(f"📧 Found {len(senders)} email setups: {senders}")
         
-        # Subject keywords (para filtrado CLIENT-SIDE)
-        subject_keywords = []
-        if IMAP_SUBJECT_FILTER:
-            subject_keywords = [x.strip() for x in IMAP_SUBJECT_FILTER.split(",") if x.strip()]
-        else:
-            subject_keywords = [
-                "yape", "transferen", "consumo", "constancia", "terceros",
-                "retiro", "devolucion", "cargo", "abono", "movimiento", "operacion"
-            ]
+        # Subject keywords (para filtrado CLIENT-SIDE), compiladas una sola vez
+        subject_matcher = get_subject_matcher()
         
         # === CONSTRUIR CRITERIOS IMAP (SIN SUBJECT) ===
         criteria = _build_imap_search_criteria(
@@ -303,10 +303,14 @@ def connect_and_download_pdfs(
         
         if verbose:
             logger.info(f"🔍 Server-side criteria: {criteria}")
-            logger.info(f"🔍 Client-side SUBJECT filter: {subject_keywords}")
+            logger.info(f"🔍 Client-side SUBJECT filter: {list(subject_matcher.rules.values())}")
         
         # === BÚSQUEDA IMAP (SERVER-SIDE: fecha + remitente) ===
-        uids = client.search(criteria, charset="UTF-8")
+        tenant = tenant_label(db_name)
+        with span("imap.search") as search_span, timed(IMAP_SEARCH_SECONDS, tenant=tenant):
+            uids = client.search(criteria, charset="UTF-8")
+            search_span.set(matches=len(uids))
+        IMAP_SEARCH_MATCHES.labels(tenant=tenant).inc(len(uids))
         
         if not uids:
             logger.info("✅ No emails matching server-side criteria")
@@ -328,7 +332,12 @@ def connect_and_download_pdfs(
             batch = uids[i:i+chunk_size]
             logger.info(f"📬 Batch {i//chunk_size + 1}/{(len(uids)-1)//chunk_size + 1} ({len(batch)} emails)")
             
-            resp = _fetch_with_retry(client, batch, fetch_attrs, max_retries=3)
+            with span("imap.fetch", batch_size=len(batch)) as fetch_span, \
+                    timed(IMAP_FETCH_SECONDS, tenant=tenant):
+                resp = _fetch_with_retry(client, batch, fetch_attrs, max_retries=3)
+            fetched_bytes = sum(len(data.get(b'RFC822') or b"") for data in (resp or {}).values())
+            fetch_span.set(bytes=fetched_bytes)
+            IMAP_FETCH_BYTES.labels(tenant=tenant).observe(fetched_bytes)
             
             if not resp:
                 logger.warning(f"⚠️ Batch empty, continuing...")
@@ -343,6 +352,7 @@ def connect_and_download_pdfs(
                         already_processed = is_uid_processed(uid, folder=folder)
                     
                     if already_processed:
+                        filtered(db_name, "already_processed")
                         if verbose:
                             logger.info(f"⏭️  UID {uid} already processed, skipping")
                         continue
@@ -374,34 +384,36 @@ def connect_and_download_pdfs(
                     date_dt = None
                 
                 # === FILTRADO CLIENT-SIDE: SUBJECT KEYWORDS ===
-                # 🔥 NUEVO: Verificar si el subject contiene ALGUNA keyword
-                subject_lower = subject.lower()
-                
-                if subject_keywords:
-                    matches_keyword = any(kw.lower() in subject_lower for kw in subject_keywords)
+                # 🔥 NUEVO: Verificar si el subject contiene ALGUNA keyword (sin tildes)
+                if subject_matcher:
+                    subject_rule = subject_matcher.match(subject)
                     
-                    if not matches_keyword:
+                    if not subject_rule:
+                        filtered(db_name, "subject")
                         if verbose:
                             logger.info(f"⏭️  UID {uid} subject doesn't match keywords: '{subject[:50]}'")
                         continue
                     else:
                         if verbose:
-                            logger.info(f"✅ UID {uid} matches keyword in subject: '{subject[:50]}'")
+                            logger.info(f"✅ UID {uid} matches keyword '{subject_rule}' in subject: '{subject[:50]}'")
                 
                 # Validación mínima
                 if not any([subject, text_body, html_body, from_str, message_id]):
                     logger.error(f"❌ UID {uid} completely empty, skipping")
+                    filtered(db_name, "empty")
                     continue
                 
                 if not text_body and not html_body:
                     logger.warning(f"⚠️ UID {uid} has no body content, skipping")
+                    filtered(db_name, "no_body")
                     continue
                 
                 # Extract PDFs
-                pdfs = _extract_pdfs_from_pyzmessage(msg, uid)
+                pdfs = _extract_pdfs_from_pyzmessage(msg, uid, db_name=db_name)
                 
                 # Check attachment requirement
                 if IMAP_ONLY_WITH_ATTACHMENTS and not pdfs:
+                    filtered(db_name, "no_attachment")
                     if verbose:
                         logger.info(f"⏭️  UID {uid} has no PDF attachments")
                     continue
@@ -437,7 +449,7 @@ def connect_and_download_pdfs(
                     except Exception as e:
                         logger.warning(f"⚠️ Could not move email: {e}")
                 
-                results.append({"uid": uid, "metadata": metadata})
+                results.append({"uid": uid, "metadata": metadata, "fetch_span_id": fetch_span.span_id})
             
             # Pause between batches
             if i + chunk_size < len(uids):
@@ -482,7 +494,7 @@ def diagnose_imap_search(db_name: str = None):
             cols = get_tenant_collections(db_name)
             email_setup_col_target = cols["email_setup_col"]
         else:
-            email_setup_col_target = email_setup_col
+            email_setup_col_target = get_default_db()[MONGO_EMAIL_SETUP_COLLECTION]
         
         # Crear conexión IMAP
         client = _create_imap_client(db_name)
@@ -0,0 +1,93 @@
+"""
+Matcher de palabras clave precompilado, insensible a mayúsculas y tildes.
+
+Todas las keywords de una configuración se pliegan (minúsculas, sin tildes)
+y se compilan en UNA regex de alternancia; cada texto se pliega una sola vez
+y se recorre una sola vez. `match()` retorna la keyword que coincidió (la
+primera posición en el texto) para poder contarla por regla.
+
+Lo usan el filtro de asunto de `connect_and_download_pdfs` y la detección
+de devoluciones de `/ingest`.
+"""
+import re
+import threading
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+from .config import IMAP_SUBJECT_FILTER
+
+DEFAULT_SUBJECT_KEYWORDS = (
+    "yape", "transferen", "consumo", "constancia", "terceros",
+    "retiro", "devolucion", "cargo", "abono", "movimiento", "operacion",
+)
+
+REFUND_KEYWORDS = ("devolucion",)
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin tildes: "Devolución" -> "devolucion" """
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+class KeywordMatcher:
+    def __init__(self, keywords):
+        # Keyword plegada -> keyword original (la que se reporta)
+        self.rules = {}
+        for keyword in keywords:
+            folded = fold(keyword.strip())
+            if folded:
+                self.rules.setdefault(folded, keyword.strip())
+
+        # Más largas primero: ante prefijos comunes gana la más específica
+        alternatives = sorted(self.rules, key=len, reverse=True)
+        self.regex = re.compile("|".join(map(re.escape, alternatives))) if alternatives else None
+
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def __bool__(self):
+        return self.regex is not None
+
+    def match(self, text: str):
+        """Keyword que coincidió o None"""
+        if self.regex is None:
+            return None
+        m = self.regex.search(fold(text))
+        rule = self.rules[m.group(0)] if m else None
+        with self._lock:
+            self._counts[rule or "<no match>"] += 1
+        return rule
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+@lru_cache(maxsize=64)
+def get_matcher(keywords: tuple) -> KeywordMatcher:
+    """Un matcher por conjunto de keywords (se compila una sola vez)"""
+    return KeywordMatcher(keywords)
+
+
+def subject_keywords() -> tuple:
+    """Keywords del filtro de asunto: IMAP_SUBJECT_FILTER o las de por defecto"""
+    if IMAP_SUBJECT_FILTER:
+        return tuple(x.strip() for x in IMAP_SUBJECT_FILTER.split(",") if x.strip())
+    return DEFAULT_SUBJECT_KEYWORDS
+
+
+def get_subject_matcher() -> KeywordMatcher:
+    return get_matcher(subject_keywords())
+
+
+def get_refund_matcher() -> KeywordMatcher:
+    return get_matcher(REFUND_KEYWORDS)
+
+
+def get_matcher_stats() -> dict:
+    return {
+        "subject": get_subject_matcher().stats(),
+        "refund": get_refund_matcher().stats(),
+    }
@@ -0,0 +1,149 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .config import LLM_BATCH_SIZE, LLM_CACHE_SIZE, LLM_TIMEOUT
+from .embedding_cache import normalize_description
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = (
+    "transferencia_personal",
+    "impuesto",
+    "retiro_efectivo",
+    "servicio_consumo",
+    "pago_sueldo",
+    "otros",
+)
+
+
+class OllamaClient:
+    """
+    Cliente de segunda opinión contra Ollama (`/api/generate`).
+
+    - Sesión HTTP con pool de conexiones (keep-alive).
+    - Cache LRU por (texto normalizado, categoría sugerida, modelo).
+    - Prompts por lote: muchas transacciones por llamada.
+
+    `base_url` es inyectable para poder probarlo contra un servidor stub local.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        timeout: float = LLM_TIMEOUT,
+        batch_size: int = LLM_BATCH_SIZE,
+        cache_size: int = LLM_CACHE_SIZE,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.batch_size = max(1, batch_size)
+        self.cache_size = cache_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_key(self, text, suggested):
+        return (normalize_description(text), suggested, self.model)
+
+    def _cache_get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def classify_many(self, items):
+        """
+        Args:
+            items: lista de tuplas (texto, categoría sugerida)
+
+        Returns:
+            Lista de categorías en el mismo orden. Si el LLM falla o responde
+            algo fuera del catálogo, se conserva la categoría sugerida.
+        """
+        answers = [None] * len(items)
+        pending = OrderedDict()
+
+        for i, (text, suggested) in enumerate(items):
+            key = self._cache_key(text, suggested)
+            cached = self._cache_get(key)
+            if cached is not None:
+                answers[i] = cached
+            else:
+                pending.setdefault(key, []).append(i)
+
+        keys = list(pending.keys())
+        for start in range(0, len(keys), self.batch_size):
+            chunk = keys[start:start + self.batch_size]
+            batch_items = [(items[pending[k][0]][0], k[1]) for k in chunk]
+            labels = self._classify_chunk(batch_items)
+
+            for key, label in zip(chunk, labels):
+                if label is not None:
+                    self._cache_put(key, label)
+                for i in pending[key]:
+                    answers[i] = label
+
+        return [
+            answer if answer is not None else suggested
+            for answer, (_, suggested) in zip(answers, items)
+        ]
+
+    def _build_prompt(self, batch_items):
+        lines = "\n".join(
+            f'{n}. "{text}" (sugerida: {suggested})'
+            for n, (text, suggested) in enumerate(batch_items, 1)
+        )
+        return f"""Clasifica cada transacción en una categoría:
+{", ".join(CATEGORIES)}.
+
+Transacciones:
+{lines}
+
+Responde solo con un objeto JSON que mapee el número de cada transacción a su categoría, por ejemplo {{"1": "impuesto"}}."""
+
+    def _classify_chunk(self, batch_items):
+        try:
+            r = self.session.post(
+                f"{self.base_url}/api/generate",
+                json={
+                    "model": self.model,
+                    "prompt": self._build_prompt(batch_items),
+                    "format": "json",
+                    "stream": False,
+                },
+                timeout=self.timeout,
+            )
+            if not r.ok:
+                logger.warning(f"[Ollama] HTTP {r.status_code}")
+                return [None] * len(batch_items)
+
+            parsed = json.loads(r.json().get("response", "") or "{}")
+        except Exception as e:
+            logger.warning(f"[Ollama] Error: {e}")
+            return [None] * len(batch_items)
+
+        labels = []
+        for n in range(1, len(batch_items) + 1):
+            label = str(parsed.get(str(n), "")).strip().lower() if isinstance(parsed, dict) else ""
+            labels.append(label if label in CATEGORIES else None)
+        return labels
@@ -0,0 +1,98 @@
+"""
+Métricas Prometheus del servicio IMAP (expuestas en GET /metrics).
+
+Todas llevan la etiqueta `tenant` (BD del tenant, o "default") para poder
+ver qué etapa domina cuando la ingesta de un tenant es lenta.
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6)
+LAG_BUCKETS = (5, 30, 60, 300, 900, 3600, 4 * 3600, 24 * 3600, 7 * 24 * 3600)
+
+IMAP_CONNECT_SECONDS = Histogram(
+    "imap_connect_seconds", "IMAP connect / login latency", ["tenant", "phase"]
+)
+IMAP_SEARCH_SECONDS = Histogram(
+    "imap_search_seconds", "IMAP SEARCH latency", ["tenant"]
+)
+IMAP_SEARCH_MATCHES = Counter(
+    "imap_search_matches_total", "UIDs returned by SEARCH (date + sender, server-side)", ["tenant"]
+)
+IMAP_FETCH_SECONDS = Histogram(
+    "imap_fetch_seconds", "IMAP FETCH latency per batch", ["tenant"]
+)
+IMAP_FETCH_BYTES = Histogram(
+    "imap_fetch_bytes", "RFC822 bytes fetched per batch", ["tenant"], buckets=BYTES_BUCKETS
+)
+# Etapas contadas: already_processed, subject, empty, no_body, no_attachment y
+# las de /ingest. No hay etapa "sender": el remitente (y la fecha) se filtran
+# en el SEARCH del servidor IMAP, así que esos descartes nunca llegan al
+# cliente; imap_search_matches_total es lo que queda después de ese filtro.
+MESSAGES_FILTERED = Counter(
+    "ingest_messages_filtered_total", "Messages dropped, by stage", ["tenant", "stage"]
+)
+MESSAGES_STORED = Counter(
+    "ingest_messages_stored_total", "Messages stored, by collection", ["tenant", "collection"]
+)
+AGENT_SECONDS = Histogram(
+    "ia_agent_request_seconds", "Extraction agent call latency", ["tenant", "endpoint"]
+)
+AGENT_ERRORS = Counter(
+    "ia_agent_errors_total", "Extraction agent failures", ["tenant", "reason"]
+)
+AGENT_CIRCUIT_STATE = Gauge(
+    "ia_agent_circuit_state", "Agent circuit breaker (0 closed, 1 half-open, 2 open)", ["dependency"]
+)
+EXTRACTION_DEFERRED = Counter(
+    "ingest_extraction_deferred_total", "Raw emails stored as extraction_pending", ["tenant"]
+)
+EXTRACTION_RETRIED = Counter(
+    "ingest_extraction_retried_total", "Deferred extractions retried by the worker", ["tenant", "result"]
+)
+MONGO_INSERT_SECONDS = Histogram(
+    "mongo_insert_seconds", "Mongo insert latency", ["tenant", "collection"]
+)
+EMAIL_TO_DOCUMENT_LAG = Histogram(
+    "email_to_document_lag_seconds", "Email Date header to processed document",
+    ["tenant"], buckets=LAG_BUCKETS,
+)
+
+
+def tenant_label(db_name) -> str:
+    return db_name or "default"
+
+
+@contextmanager
+def timed(histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - started)
+
+
+def filtered(db_name, stage: str, count: int = 1):
+    MESSAGES_FILTERED.labels(tenant=tenant_label(db_name), stage=stage).inc(count)
+
+
+def observe_lag(db_name, email_date: str):
+    """Lag entre el header Date (ISO) y ahora; ignora fechas ausentes o inválidas"""
+    if not email_date:
+        return
+    try:
+        sent = datetime.fromisoformat(email_date)
+    except (TypeError, ValueError):
+        return
+    if sent.tzinfo is None:
+        sent = sent.replace(tzinfo=timezone.utc)
+    lag = (datetime.now(timezone.utc) - sent).total_seconds()
+    EMAIL_TO_DOCUMENT_LAG.labels(tenant=tenant_label(db_name)).observe(max(lag, 0.0))
+
+
+def render_latest():
+    """(payload, content type) para el endpoint /metrics"""
+    return generate_latest(), CONTENT_TYPE_LATEST
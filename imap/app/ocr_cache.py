@@ -0,0 +1,86 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from .config import OCR_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Subir al cambiar el formato de page_NNNN.json / manifest.json
+CACHE_FORMAT_VERSION = 2
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 del contenido del archivo (lectura por bloques)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path: Path, data):
+    # Nombre temporal por proceso: varias corridas pueden escribir en paralelo
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class OcrCache:
+    """
+    Cache de resultados OCR por hash SHA-256 del PDF y huella de la configuración.
+
+    Layout:
+        <root>/<sha[:2]>/<sha>/<fp>/page_0001.json   texto + filas de cada página (checkpoint)
+        <root>/<sha[:2]>/<sha>/<fp>/manifest.json    total de páginas y settings (solo si terminó)
+
+    `fp` es el hash de `settings` (DPI, modo adaptativo, recorte, capa de
+    texto, config de Tesseract, regex de líneas...) más CACHE_FORMAT_VERSION:
+    cambiar cualquiera de ellos es un miss, nunca se sirven filas viejas.
+
+    Un PDF recibido dos veces (o reprocesado con force) no se vuelve a
+    procesar, y un job interrumpido retoma desde las páginas ya guardadas.
+    """
+
+    def __init__(self, root: str = OCR_CACHE_DIR, settings: dict = None):
+        self.root = Path(root)
+        self.settings = {"format": CACHE_FORMAT_VERSION, **(settings or {})}
+        encoded = json.dumps(self.settings, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        self.fingerprint = hashlib.sha256(encoded).hexdigest()[:16]
+
+    def _dir(self, sha: str) -> Path:
+        return self.root / sha[:2] / sha / self.fingerprint
+
+    def is_complete(self, sha: str) -> bool:
+        return (self._dir(sha) / "manifest.json").exists()
+
+    def page_total(self, sha: str) -> int:
+        with open(self._dir(sha) / "manifest.json", encoding="utf-8") as f:
+            return int(json.load(f)["pages"])
+
+    def get_page(self, sha: str, page_no: int):
+        path = self._dir(sha) / f"page_{page_no:04d}.json"
+        if not path.exists():
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            # Checkpoint a medio escribir: se rehace la página
+            return None
+
+    def put_page(self, sha: str, page_no: int, text: str, rows: list, source: str):
+        directory = self._dir(sha)
+        directory.mkdir(parents=True, exist_ok=True)
+        _write_json_atomic(
+            directory / f"page_{page_no:04d}.json",
+            {"page": page_no, "source": source, "text": text, "rows": rows},
+        )
+
+    def mark_complete(self, sha: str, pages: int):
+        directory = self._dir(sha)
+        directory.mkdir(parents=True, exist_ok=True)
+        _write_json_atomic(directory / "manifest.json", {"sha256": sha, "pages": pages, "settings": self.settings})
@@ -1,34 +1,417 @@
-import os, re, json
-from pdf2image import convert_from_path
+import os, re, json, subprocess
+import logging
+from itertools import islice
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
-from .config import TESSERACT_CMD, JSON_OUTPUT
+from .config import (
+    TESSERACT_CMD, JSON_OUTPUT, OCR_WORKERS, OCR_DPI,
+    OCR_ADAPTIVE, OCR_FAST_DPI, OCR_MIN_CONFIDENCE, OCR_MIN_LINE_MATCH_RATE, OCR_CROP_BOX,
+    OCR_RETRY_NO_CANDIDATES, OCR_TEXT_LAYER, OCR_MIN_TEXT_CHARS, PDFTOTEXT_CMD, OCR_JSONL_DIR
+)
+from .ocr_cache import OcrCache, file_sha256
+
+logger = logging.getLogger(__name__)
 
 pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+TESSERACT_LANG = "spa"
 
 LINE_RE = re.compile(
     r"^(\d{2}\w{3})\s+(\d{2}\w{3})\s+(.+?)\s+([\d,]+\.\d{2})?\s*([\d,]+\.\d{2})?$",
     re.IGNORECASE
 )
 
+# Línea que "parece" un movimiento (empieza con fecha tipo 05ENE)
+CANDIDATE_LINE_RE = re.compile(r"^\d{2}[A-Za-z]{3}\s")
+
+# Campos de procedencia que agrega el modo streaming a cada fila
+PROVENANCE_KEYS = ("pdf_sha256", "pdf_path", "page", "line")
+
 def to_float(v):
     return float(v.replace(",", "")) if v else None
 
-def ocr_pdf_to_json(pdf_paths):
-    data = []
+def _parse_page(text):
+    """Filas de una página, cada una con su número de línea (1-based)"""
+    rows = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        match = LINE_RE.match(line.strip())
+        if match:
+            rows.append({
+                "FECHA_PROC": match.group(1),
+                "FECHA_VALOR": match.group(2),
+                "DESCRIPCION": match.group(3).strip(),
+                "CARGOS_DEBE": to_float(match.group(4)),
+                "ABONOS_HABER": to_float(match.group(5)),
+                "line": line_no
+            })
+    return rows
+
+def parse_statement_text(text):
+    """Aplica LINE_RE a cada línea del texto de una página"""
+    return [_strip_provenance(row) for row in _parse_page(text)]
+
+def _strip_provenance(row):
+    return {k: v for k, v in row.items() if k not in PROVENANCE_KEYS}
+
+def page_count(pdf):
+    return int(pdfinfo_from_path(pdf)["Pages"])
+
+def extract_text_layer(pdf):
+    """
+    Texto embebido por página con `pdftotext -layout` (una llamada por PDF).
+    Retorna lista de textos (uno por página) o [] si no se pudo extraer.
+    """
+    try:
+        out = subprocess.run(
+            [PDFTOTEXT_CMD, "-layout", "-enc", "UTF-8", pdf, "-"],
+            capture_output=True, timeout=120, check=True
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"⚠️ pdftotext failed for {pdf}: {e}")
+        return []
+
+    pages = out.stdout.decode("utf-8", errors="ignore").split("\f")
+    # pdftotext termina cada página con \f: el último elemento queda vacío
+    if pages and not pages[-1].strip():
+        pages = pages[:-1]
+    return pages
+
+def has_usable_text(text):
+    return len(re.sub(r"\s+", "", text or "")) >= OCR_MIN_TEXT_CHARS
+
+def _parse_crop_box(spec):
+    if not spec:
+        return None
+    try:
+        box = tuple(float(x) for x in spec.split(","))
+        if len(box) == 4:
+            return box
+    except ValueError:
+        pass
+    logger.warning(f"⚠️ Invalid OCR_CROP_BOX '{spec}', ignoring")
+    return None
+
+CROP_BOX = _parse_crop_box(OCR_CROP_BOX)
+
+def _render_page(pdf, page_no, dpi, grayscale=False, crop_box=CROP_BOX):
+    images = convert_from_path(pdf, dpi=dpi, first_page=page_no, last_page=page_no, grayscale=grayscale)
+    if not images:
+        return None
+    image = images[0]
+    if crop_box:
+        left, top, right, bottom = crop_box
+        w, h = image.size
+        image = image.crop((int(left * w), int(top * h), int(right * w), int(bottom * h)))
+    return image
+
+def _recognize(image):
+    """
+    Una sola pasada de Tesseract que retorna (texto, confianza media).
+    El texto se rearma por líneas desde image_to_data.
+    """
+    data = pytesseract.image_to_data(image, lang=TESSERACT_LANG, output_type=pytesseract.Output.DICT)
+
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data["text"]):
+        conf = float(data["conf"][i])
+        if conf < 0 or not word.strip():
+            continue
+        confidences.append(conf)
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+
+    text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+    mean_conf = sum(confidences) / len(confidences) if confidences else 0.0
+    return text, mean_conf
+
+def page_quality_ok(text, mean_conf, retry_no_candidates=OCR_RETRY_NO_CANDIDATES):
+    """
+    Calidad suficiente: confianza media y % de líneas-candidato que matchean LINE_RE.
+    Una página sin líneas-candidato (portada, resumen) pasa si la confianza
+    alcanza; con retry_no_candidates se re-renderiza igual cuando trae texto.
+    """
+    if mean_conf < OCR_MIN_CONFIDENCE:
+        return False
+
+    candidates = [l.strip() for l in text.splitlines() if CANDIDATE_LINE_RE.match(l.strip())]
+    if not candidates:
+        return not (retry_no_candidates and text.strip())
+
+    matched = sum(1 for l in candidates if LINE_RE.match(l))
+    return matched / len(candidates) >= OCR_MIN_LINE_MATCH_RATE
+
+def ocr_page(pdf, page_no, dpi=OCR_DPI, adaptive=OCR_ADAPTIVE):
+    """Renderiza y reconoce UNA página (memoria acotada a una imagen)"""
+    if not adaptive:
+        image = _render_page(pdf, page_no, dpi)
+        if image is None:
+            return ""
+        return pytesseract.image_to_string(image, lang=TESSERACT_LANG)
+
+    # Pasada rápida: escala de grises a baja resolución
+    image = _render_page(pdf, page_no, OCR_FAST_DPI, grayscale=True)
+    if image is None:
+        return ""
+    text, mean_conf = _recognize(image)
+    if page_quality_ok(text, mean_conf):
+        return text
+
+    logger.info(f"🔁 Page {page_no} of {os.path.basename(pdf)} below quality "
+                f"(conf={mean_conf:.0f}), re-rendering at {dpi} DPI")
+    image = _render_page(pdf, page_no, dpi, grayscale=True)
+    if image is None:
+        return text
+    text, _ = _recognize(image)
+    return text
+
+def ocr_settings():
+    """Todo lo que cambia el texto o las filas de una página: huella del OcrCache"""
+    return {
+        "dpi": OCR_DPI,
+        "adaptive": OCR_ADAPTIVE,
+        "fast_dpi": OCR_FAST_DPI,
+        "min_confidence": OCR_MIN_CONFIDENCE,
+        "min_line_match_rate": OCR_MIN_LINE_MATCH_RATE,
+        "retry_no_candidates": OCR_RETRY_NO_CANDIDATES,
+        "crop_box": CROP_BOX,
+        "text_layer": OCR_TEXT_LAYER,
+        "min_text_chars": OCR_MIN_TEXT_CHARS,
+        "tesseract_lang": TESSERACT_LANG,
+        "line_re": [LINE_RE.pattern, LINE_RE.flags],
+    }
+
+def _ocr_page_task(task):
+    pdf, page_no = task
+    return ocr_page(pdf, page_no)
+
+def _init_worker():
+    # Tesseract ya usa OpenMP: un hilo por proceso evita sobre-suscribir CPUs
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+def _iter_ocr(tasks, workers):
+    """Ejecuta OCR y produce (task, texto) a medida que terminan las páginas"""
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield task, _ocr_page_task(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker) as pool:
+        # Ventana acotada de páginas en vuelo: memoria constante aunque haya miles
+        queue = iter(tasks)
+        in_flight = {pool.submit(_ocr_page_task, t): t for t in islice(queue, workers * 2)}
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = in_flight.pop(future)
+                following = next(queue, None)
+                if following is not None:
+                    in_flight[pool.submit(_ocr_page_task, following)] = following
+                yield task, future.result()
+
+def iter_pdf_pages(pdf_paths, workers=None, cache=None):
+    """
+    Procesa PDFs y produce una tupla por página terminada:
+        (pdf_path, sha256, page_no, n_pages, rows)
+
+    Las filas ya traen procedencia (pdf_sha256, pdf_path, page, line).
+    Las páginas salen en orden de finalización, no de documento.
+
+    Rutas distintas con el mismo contenido se procesan una sola vez (por
+    sha256), pero cada ruta recibe sus propias páginas con su pdf_path.
+    """
+    workers = OCR_WORKERS if workers is None else workers
+    cache = cache or OcrCache(settings=ocr_settings())
+
+    def with_provenance(pdf, sha, n, rows):
+        return [{**row, "pdf_sha256": sha, "pdf_path": pdf, "page": n} for row in rows]
+
+    shas = {}
+    seen = set()
+    aliases = {}  # sha -> otras rutas con el mismo contenido
+    pending = {}  # sha -> páginas que faltan por OCR
+    totals = {}
+    tasks = []
+
     for pdf in pdf_paths:
-        pages = convert_from_path(pdf, dpi=300)
-        for page in pages:
-            text = pytesseract.image_to_string(page, lang="spa")
-            for line in text.splitlines():
-                match = LINE_RE.match(line.strip())
-                if match:
-                    data.append({
-                        "FECHA_PROC": match.group(1),
-                        "FECHA_VALOR": match.group(2),
-                        "DESCRIPCION": match.group(3).strip(),
-                        "CARGOS_DEBE": to_float(match.group(4)),
-                        "ABONOS_HABER": to_float(match.group(5))
-                    })
+        if pdf in shas:
+            continue
+        sha = file_sha256(pdf)
+        shas[pdf] = sha
+
+        if sha in seen:
+            logger.info(f"♻️  Duplicate PDF content, reusing pages: {os.path.basename(pdf)} ({sha[:12]})")
+            aliases.setdefault(sha, []).append(pdf)
+            # Las páginas ya listas se repiten ahora; las que esperan OCR, al terminar
+            for n in range(1, totals[sha] + 1):
+                page = cache.get_page(sha, n)
+                if page is None and sha in pending:
+                    continue
+                rows = page["rows"] if page else []
+                yield pdf, sha, n, totals[sha], with_provenance(pdf, sha, n, rows)
+            continue
+        seen.add(sha)
+
+        if cache.is_complete(sha):
+            logger.info(f"⚡ OCR cache hit: {os.path.basename(pdf)} ({sha[:12]})")
+            n_pages = cache.page_total(sha)
+            totals[sha] = n_pages
+            for n in range(1, n_pages + 1):
+                page = cache.get_page(sha, n) or {"rows": []}
+                yield pdf, sha, n, n_pages, with_provenance(pdf, sha, n, page["rows"])
+            continue
+
+        n_pages = page_count(pdf)
+        totals[sha] = n_pages
+        layer = None
+        missing = 0
+
+        for n in range(1, n_pages + 1):
+            # Checkpoint de una corrida anterior interrumpida
+            checkpoint = cache.get_page(sha, n)
+            if checkpoint is not None:
+                yield pdf, sha, n, n_pages, with_provenance(pdf, sha, n, checkpoint["rows"])
+                continue
+
+            if layer is None:
+                layer = extract_text_layer(pdf) if OCR_TEXT_LAYER else []
+            page_text = layer[n - 1] if n <= len(layer) else ""
+
+            if has_usable_text(page_text):
+                rows = _parse_page(page_text)
+                cache.put_page(sha, n, page_text, rows, "text_layer")
+                yield pdf, sha, n, n_pages, with_provenance(pdf, sha, n, rows)
+            else:
+                tasks.append((pdf, n))
+                missing += 1
+
+        if missing:
+            pending[sha] = missing
+        else:
+            cache.mark_complete(sha, n_pages)
+
+    logger.info(f"📄 Pages needing OCR: {len(tasks)}")
+
+    for (pdf, n), text in _iter_ocr(tasks, workers):
+        sha = shas[pdf]
+        rows = _parse_page(text)
+        cache.put_page(sha, n, text, rows, "ocr")
+
+        pending[sha] -= 1
+        if pending[sha] == 0:
+            cache.mark_complete(sha, totals[sha])
+
+        for path in (pdf, *aliases.get(sha, ())):
+            yield path, sha, n, totals[sha], with_provenance(path, sha, n, rows)
+
+def iter_pdf_rows(pdf_paths, workers=None, cache=None):
+    """Filas con procedencia, en streaming a medida que terminan las páginas"""
+    for _, _, _, _, rows in iter_pdf_pages(pdf_paths, workers=workers, cache=cache):
+        yield from rows
+
+def ocr_pdfs_to_jsonl(pdf_paths, out_dir=OCR_JSONL_DIR, workers=None, cache=None):
+    """
+    Escribe un JSONL por PDF (`<sha256>.jsonl`) en memoria constante.
+    Cada archivo se escribe en un temporal propio del proceso y se renombra
+    al completar todas sus páginas: corridas concurrentes no se pisan.
+    Rutas con el mismo contenido comparten el JSONL (filas de la primera).
+
+    Returns:
+        Dict pdf_path -> ruta del JSONL generado
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    handles = {}
+    pages_done = {}
+    owners = {}      # sha -> ruta cuyas filas van al JSONL
+    same_content = {}  # sha -> rutas que apuntan al mismo JSONL
+    finished = {}
+    written = {}
+
+    try:
+        for pdf, sha, n, n_pages, rows in iter_pdf_pages(pdf_paths, workers=workers, cache=cache):
+            owner = owners.setdefault(sha, pdf)
+            same_content.setdefault(sha, {owner: None})[pdf] = None
+            if sha in finished:
+                written[pdf] = finished[sha]
+                continue
+            if pdf != owner:
+                continue
+
+            if sha not in handles:
+                tmp = out / f"{sha}.jsonl.{os.getpid()}.tmp"
+                handles[sha] = (open(tmp, "w", encoding="utf-8"), tmp)
+                pages_done[sha] = 0
+
+            f, tmp = handles[sha]
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+            pages_done[sha] += 1
+            if pages_done[sha] == n_pages:
+                f.close()
+                final = out / f"{sha}.jsonl"
+                os.replace(tmp, final)
+                del handles[sha]
+                finished[sha] = str(final)
+                for path in same_content[sha]:
+                    written[path] = finished[sha]
+    finally:
+        for f, tmp in handles.values():
+            f.close()
+            tmp.unlink(missing_ok=True)
+
+    return written
+
+def ocr_pdfs_to_mongo(pdf_paths, db_name, batch_size=500, workers=None, cache=None):
+    """
+    Inserta las filas en la BD del tenant por lotes (insert_many).
+    El _id es sha:página:línea, así reprocesar un PDF no duplica filas.
+
+    Returns:
+        Número de filas nuevas insertadas
+    """
+    from pymongo.errors import BulkWriteError
+    from .db import get_tenant_collections
+
+    col = get_tenant_collections(db_name)["ocr_rows_col"]
+    inserted = 0
+    batch = []
+
+    def flush():
+        nonlocal inserted
+        if not batch:
+            return
+        try:
+            inserted += len(col.insert_many(batch, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            inserted += e.details.get("nInserted", 0)
+        batch.clear()
+
+    for row in iter_pdf_rows(pdf_paths, workers=workers, cache=cache):
+        batch.append({"_id": f"{row['pdf_sha256']}:{row['page']}:{row['line']}", **row})
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    logger.info(f"✅ OCR rows inserted in {db_name}: {inserted}")
+    return inserted
+
+def ocr_pdf_to_json(pdf_paths, workers=None, cache=None):
+    # Modo legacy: un único JSON ordenado por documento y página
+    pages = {}
+    for pdf, _, n, _, rows in iter_pdf_pages(pdf_paths, workers=workers, cache=cache):
+        pages[(pdf, n)] = [_strip_provenance(row) for row in rows]
+
+    data = []
+    for pdf in dict.fromkeys(pdf_paths):
+        n = 1
+        while (pdf, n) in pages:
+            data.extend(pages[(pdf, n)])
+            n += 1
+
     os.makedirs(os.path.dirname(JSON_OUTPUT), exist_ok=True)
     with open(JSON_OUTPUT, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
@@ -0,0 +1,232 @@
+"""
+Motor de parsers de emails bancarios dirigido por registro.
+
+Los parsers se declaran en un JSON versionado (PARSER_CONFIG_PATH): cada
+entrada define remitentes, reglas de selección por asunto / presencia de
+HTML, la fuente del texto y los patrones de cada campo. Al cargar:
+
+- Los patrones de cada campo se compilan una vez y se prueban en orden:
+  gana el primer patrón cuyo primer match tiene grupo 1 no vacío.
+- Los parsers se indexan por remitente y se prueban primero para esos
+  remitentes. Los que no declaran remitentes (o marcan `"generic": true`)
+  quedan como genéricos y se evalúan en el orden del archivo.
+"""
+import json
+import logging
+import re
+import threading
+import time
+
+from .config import PARSER_CONFIG_PATH
+from .html_preprocess import preprocess_html, canonical_text
+from .resources import lazy
+
+logger = logging.getLogger(__name__)
+
+POST_PROCESSORS = {
+    "remove_spaces": lambda value: value.replace(" ", ""),
+}
+
+
+def sender_address(from_addr: str) -> str:
+    """Extrae el email del formato "Name <email@domain.com>" en minúsculas"""
+    from_addr = from_addr or ""
+    if "<" in from_addr and ">" in from_addr:
+        from_addr = from_addr.split("<")[1].split(">")[0]
+    return from_addr.strip().lower()
+
+
+class FieldMatcher:
+    """Lista ordenada de patrones de un campo, compilados una sola vez"""
+
+    def __init__(self, patterns, post=None, flags=re.IGNORECASE):
+        self.patterns = list(patterns)
+        self.post = POST_PROCESSORS[post] if post else None
+
+        self._compiled = []
+        for pattern in self.patterns:
+            compiled = re.compile(pattern, flags)
+            if compiled.groups < 1:
+                raise ValueError(f"Pattern without capture group: {pattern}")
+            self._compiled.append(compiled)
+
+    def search(self, text: str) -> str:
+        for compiled in self._compiled:
+            m = compiled.search(text)
+            if m and m.group(1):
+                value = m.group(1).strip()
+                return self.post(value) if self.post else value
+        return "-"
+
+
+class BankParser:
+    def __init__(self, spec: dict, fields: dict, version):
+        self.name = spec["name"]
+        self.template = spec.get("template", self.name)
+        self.version = version
+        self.senders = [s.lower() for s in spec.get("senders", [])]
+        self.generic = spec.get("generic", not self.senders)
+        self.rules = spec.get("match", [])
+        self.source = spec.get("source", "text")
+        self.normalize = spec.get("normalize", False)
+        self.defaults = spec.get("defaults", {})
+
+        self.fields = {
+            name: FieldMatcher(
+                field if isinstance(field, list) else field["patterns"],
+                post=None if isinstance(field, list) else field.get("post"),
+            )
+            for name, field in fields.items()
+        }
+
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._empty = 0
+        self._errors = 0
+        self._seconds = 0.0
+        self._hits = {name: 0 for name in self.fields}
+
+    def _empty_result(self) -> dict:
+        result = {name: "-" for name in self.fields}
+        result.update(self.defaults)
+        return result
+
+    def matches(self, subject_lower: str, has_html: bool) -> bool:
+        """Sin reglas aplica siempre; con reglas basta que una se cumpla"""
+        if not self.rules:
+            return True
+        for rule in self.rules:
+            if "has_html" in rule and rule["has_html"] != has_html:
+                continue
+            keywords = rule.get("subject_contains")
+            if keywords and not any(k.lower() in subject_lower for k in keywords):
+                continue
+            return True
+        return False
+
+    def _source_text(self, text_body, html_body, canonical):
+        if self.source == "html_text":
+            if canonical is None and html_body:
+                canonical = preprocess_html(html_body)
+            return canonical_text(canonical)
+        return text_body
+
+    def parse(self, text_body=None, html_body=None, canonical=None) -> dict:
+        """
+        Extrae los campos; SIEMPRE retorna dict (con "-" si no hay match).
+        `canonical` (de html_preprocess) evita volver a parsear el HTML.
+        """
+        started = time.perf_counter()
+        hits = []
+        try:
+            body = self._source_text(text_body, html_body, canonical)
+            if not body:
+                with self._lock:
+                    self._calls += 1
+                    self._empty += 1
+                return self._empty_result()
+
+            if self.normalize:
+                body = body.replace("\r", "").replace("\u00a0", " ").strip()
+
+            result = {}
+            for name, matcher in self.fields.items():
+                result[name] = matcher.search(body)
+                if result[name] != "-":
+                    hits.append(name)
+            result.update(self.defaults)
+            error = False
+        except Exception as e:
+            logger.error(f"Error in parser {self.name}: {e}")
+            result = self._empty_result()
+            error = True
+
+        with self._lock:
+            self._calls += 1
+            self._errors += error
+            self._seconds += time.perf_counter() - started
+            for name in hits:
+                self._hits[name] += 1
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            parsed = self._calls - self._empty
+            return {
+                "parser": self.name,
+                "template": self.template,
+                "version": self.version,
+                "calls": self._calls,
+                "empty_input": self._empty,
+                "errors": self._errors,
+                "avg_ms": round(self._seconds / self._calls * 1000, 3) if self._calls else 0.0,
+                "field_hit_rate": {
+                    name: round(count / parsed, 4) if parsed else 0.0
+                    for name, count in self._hits.items()
+                },
+            }
+
+
+class ParserRegistry:
+    def __init__(self, config_path: str = PARSER_CONFIG_PATH):
+        self.config_path = config_path
+        self.load()
+
+    def load(self):
+        with open(self.config_path, encoding="utf-8") as f:
+            config = json.load(f)
+
+        version = config.get("version")
+        specs = config["parsers"]
+        fields_by_name = {spec["name"]: spec.get("fields") for spec in specs}
+
+        parsers, by_sender, generic = {}, {}, []
+        for spec in specs:
+            fields = spec.get("fields") or fields_by_name.get(spec.get("fields_from"))
+            if not fields:
+                raise ValueError(f"Parser {spec['name']} has no fields")
+            parser = BankParser(spec, fields, version)
+            parsers[parser.name] = parser
+            for sender in parser.senders:
+                by_sender.setdefault(sender, []).append(parser)
+            if parser.generic:
+                generic.append(parser)
+
+        # Reemplazo atómico: los requests en curso siguen con el registro anterior
+        self.version = version
+        self.parsers, self._by_sender, self._generic = parsers, by_sender, generic
+        logger.info(f"🧩 Loaded {len(parsers)} bank parsers (config v{version})")
+
+    def get(self, name: str) -> BankParser:
+        return self.parsers[name]
+
+    def select(self, from_addr: str, subject: str, has_html: bool) -> BankParser:
+        subject_lower = (subject or "").lower()
+        candidates = self._by_sender.get(sender_address(from_addr), []) + self._generic
+        # Un parser por remitente que también es genérico no se evalúa dos veces
+        candidates = list(dict.fromkeys(candidates))
+        for parser in candidates:
+            if parser.matches(subject_lower, has_html):
+                return parser
+        return None
+
+    def parse(self, from_addr: str, subject: str, text_body=None, html_body=None, canonical=None):
+        """
+        Returns:
+            (parser, dict de campos) — parser es None si ninguno aplica
+        """
+        parser = self.select(from_addr, subject, bool(html_body))
+        if parser is None:
+            return None, None
+        return parser, parser.parse(text_body=text_body, html_body=html_body, canonical=canonical)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "config_path": self.config_path,
+            "parsers": [p.stats() for p in self.parsers.values()],
+        }
+
+
+def get_parser_registry() -> ParserRegistry:
+    return lazy("parser_registry", ParserRegistry)
@@ -0,0 +1,77 @@
+"""
+Inicialización perezosa de recursos pesados del servicio IMAP.
+
+Los modelos de ML y los clientes de MongoDB se crean en el primer uso a
+través de un accessor compartido (una sola instancia por proceso), y cada
+fase de arranque queda registrada para poder reportarla.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from .config import MONGO_URI, EMBED_MODEL
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_instances = {}
+_phases = []
+
+
+def record_phase(name: str, seconds: float):
+    """Registra una fase de arranque/inicialización"""
+    _phases.append({
+        "phase": name,
+        "seconds": round(seconds, 4),
+        "at": datetime.utcnow().isoformat(),
+    })
+    logger.info(f"⏱️ {name}: {seconds * 1000:.1f} ms")
+
+
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+def lazy(name: str, factory):
+    """Retorna la instancia `name`, creándola con `factory()` la primera vez"""
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+
+    with _lock:
+        if name not in _instances:
+            with startup_phase(f"init:{name}"):
+                _instances[name] = factory()
+        return _instances[name]
+
+
+def override(name: str, instance):
+    """Reemplaza un recurso (ej: mongomock en benchmarks)"""
+    with _lock:
+        _instances[name] = instance
+
+
+def get_mongo_client():
+    from pymongo import MongoClient
+    return lazy("mongo_client", lambda: MongoClient(MONGO_URI))
+
+
+def get_embedding_model():
+    def _load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(EMBED_MODEL)
+    return lazy("embedding_model", _load)
+
+
+def get_startup_report() -> dict:
+    return {
+        "phases": list(_phases),
+        "initialized": sorted(_instances.keys()),
+    }
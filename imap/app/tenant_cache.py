@@ -0,0 +1,199 @@
+"""
+Cache en proceso de la configuración de cada tenant.
+
+    setups       -> lista de email_setups
+    senders      -> mapa remitente (minúsculas) → setup, para resolve_context
+    imap_config  -> configuración IMAP activa
+    folder       -> nombre real de la carpeta IMAP resuelta con LIST
+
+Cada entrada expira por TTL y se invalida explícitamente desde los
+endpoints CRUD de `api.py`. Opcionalmente, un change stream de Mongo sobre
+`email_setups` / `imap_config` invalida el tenant afectado en cuanto otro
+proceso escribe (TENANT_CACHE_CHANGE_STREAM).
+"""
+import logging
+import threading
+import time
+from types import MappingProxyType
+
+from .config import (
+    TENANT_CACHE_TTL, FOLDER_CACHE_TTL, MONGO_DB, MONGO_EMAIL_SETUP_COLLECTION,
+)
+from .db import get_tenant_collections, get_default_db
+from .resources import get_mongo_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "__default__"
+
+# Colección que dispara la invalidación de cada tipo de entrada
+WATCHED_COLLECTIONS = {
+    "email_setups": ("setups", "senders"),
+    "imap_config": ("imap_config", "folder"),
+}
+
+
+def freeze(value):
+    """Vista de solo lectura, recursiva, de lo que devuelve Mongo"""
+    if isinstance(value, MappingProxyType):
+        return value
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class TTLCache:
+    """
+    Cache clave → valor con expiración; la carga ocurre fuera del lock.
+
+    Cada clave tiene una generación que `invalidate` incrementa: si cambió
+    mientras corría el loader, el valor cargado (quizás viejo) no se guarda.
+    Los valores se congelan al cargar (dicts → MappingProxyType, listas →
+    tuplas) y se entregan tal cual: un hit no copia nada.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_loads = 0
+
+    def get_or_load(self, key, loader, ttl: float):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generations.setdefault(key, 0)
+
+        value = freeze(loader())
+        with self._lock:
+            if self._generations.get(key) == generation:
+                self._entries[key] = (value, time.monotonic() + ttl)
+            else:
+                self.stale_loads += 1
+        return value
+
+    def invalidate(self, predicate):
+        with self._lock:
+            for key in [k for k in self._generations if predicate(k)]:
+                self._generations[key] += 1
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "stale_loads": self.stale_loads}
+
+
+_cache = TTLCache()
+
+
+def _tenant(db_name):
+    return db_name or DEFAULT_TENANT
+
+
+def _setup_col(db_name):
+    if db_name:
+        return get_tenant_collections(db_name)["email_setup_col"]
+    return get_default_db()[MONGO_EMAIL_SETUP_COLLECTION]
+
+
+def _imap_config_col(db_name):
+    if db_name:
+        return get_tenant_collections(db_name)["imap_config_col"]
+    return get_default_db()["imap_config"]
+
+
+def get_email_setups(db_name: str = None) -> list:
+    return _cache.get_or_load(
+        ("setups", _tenant(db_name)),
+        lambda: list(_setup_col(db_name).find({})),
+        TENANT_CACHE_TTL,
+    )
+
+
+def get_sender_map(db_name: str = None) -> dict:
+    """Mapa remitente → setup (el primero gana, como find_one)"""
+    def _load():
+        senders = {}
+        for setup in get_email_setups(db_name):
+            sender = (setup.get("bank_sender") or "").strip().lower()
+            if sender:
+                senders.setdefault(sender, setup)
+        return senders
+
+    return _cache.get_or_load(("senders", _tenant(db_name)), _load, TENANT_CACHE_TTL)
+
+
+def get_imap_config(db_name: str = None):
+    return _cache.get_or_load(
+        ("imap_config", _tenant(db_name)),
+        lambda: _imap_config_col(db_name).find_one({"active": True}, {"_id": 0}),
+        TENANT_CACHE_TTL,
+    )
+
+
+def get_resolved_folder(db_name: str, folder_name: str, resolver) -> str:
+    """`resolver(folder_name)` solo se ejecuta (IMAP LIST) si no está en cache"""
+    return _cache.get_or_load(
+        ("folder", _tenant(db_name), folder_name),
+        lambda: resolver(folder_name),
+        FOLDER_CACHE_TTL,
+    )
+
+
+def invalidate_tenant(db_name: str = None, *kinds):
+    """Invalida las entradas del tenant (todas si no se indican tipos)"""
+    tenants = {_tenant(db_name)}
+    if db_name == MONGO_DB:
+        # La BD por defecto también se cachea bajo DEFAULT_TENANT
+        tenants.add(DEFAULT_TENANT)
+    _cache.invalidate(lambda key: key[1] in tenants and (not kinds or key[0] in kinds))
+    logger.info(f"♻️ Tenant cache invalidated: {sorted(tenants)} {list(kinds) or 'all'}")
+
+
+def invalidate_setups(db_name: str = None):
+    invalidate_tenant(db_name, *WATCHED_COLLECTIONS["email_setups"])
+
+
+def invalidate_imap_config(db_name: str = None):
+    invalidate_tenant(db_name, *WATCHED_COLLECTIONS["imap_config"])
+
+
+def get_cache_stats() -> dict:
+    return _cache.stats()
+
+
+# ============================================================================
+# CHANGE STREAM (opcional)
+# ============================================================================
+
+def _watch_changes(stop: threading.Event):
+    pipeline = [{"$match": {"ns.coll": {"$in": list(WATCHED_COLLECTIONS)}}}]
+    try:
+        with get_mongo_client().watch(pipeline) as stream:
+            logger.info("👀 Tenant cache change stream started")
+            while not stop.is_set():
+                change = stream.try_next()
+                if change is None:
+                    stop.wait(1)
+                    continue
+                ns = change.get("ns", {})
+                invalidate_tenant(ns.get("db"), *WATCHED_COLLECTIONS[ns.get("coll")])
+    except Exception as e:
+        # Sin replica set no hay change streams: el TTL sigue acotando la antigüedad
+        logger.warning(f"⚠️ Tenant cache change stream stopped: {e}")
+
+
+def start_change_stream_invalidator() -> threading.Event:
+    """Lanza el watcher en un hilo daemon; retorna el Event para detenerlo"""
+    stop = threading.Event()
+    threading.Thread(target=_watch_changes, args=(stop,), name="tenant-cache-watch", daemon=True).start()
+    return stop
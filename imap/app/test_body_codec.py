@@ -0,0 +1,44 @@
+import pytest
+
+pytest.importorskip("bson")
+
+from app import body_codec
+from app.body_codec import decode_bodies, encode_bodies, expand_bodies
+
+HTML = "<p>Yapeaste S/ 25.50 a Juan Pérez</p>" * 20
+TEXT = "Yapeaste S/ 25.50 a Juan Pérez"
+
+
+@pytest.fixture
+def compressed(monkeypatch):
+    monkeypatch.setattr(body_codec, "RAW_BODY_STORAGE", "compressed")
+    return monkeypatch
+
+
+@pytest.mark.parametrize("codec", ["zlib", "zstd"])
+def test_round_trip(compressed, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    compressed.setattr(body_codec, "RAW_BODY_CODEC", codec)
+
+    doc = encode_bodies(HTML, TEXT)
+    assert doc["body_codec"] == codec
+    assert decode_bodies(doc) == (HTML, TEXT)
+    assert decode_bodies(encode_bodies(None, TEXT)) == (None, TEXT)
+    assert expand_bodies(doc)["body"] == HTML
+
+
+def test_zstd_without_module(compressed):
+    pytest.importorskip("zstandard")
+    compressed.setattr(body_codec, "RAW_BODY_CODEC", "zstd")
+    doc = encode_bodies(HTML, TEXT)
+
+    compressed.setattr(body_codec, "zstandard", None)
+    # Escritura: cae a zlib; lectura de un doc zstd: error explícito
+    assert encode_bodies(HTML, TEXT)["body_codec"] == "zlib"
+    with pytest.raises(RuntimeError, match="zstandard"):
+        decode_bodies(doc)
+
+
+def test_full_storage_untouched():
+    assert decode_bodies({"html_body": HTML, "text_body": TEXT}) == (HTML, TEXT)
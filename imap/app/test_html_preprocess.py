@@ -0,0 +1,43 @@
+import json
+import random
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("bs4")
+pytest.importorskip("lxml")
+
+from benchmarks.corpus import _bcp, _yape
+from app.html_preprocess import canonical_json, canonical_tables, canonical_text, preprocess_html
+
+
+@pytest.mark.parametrize("render", [_yape, _bcp])
+def test_canonical_payload_smaller_than_raw_html(render):
+    _, _, html = render(random.Random(7), datetime(2025, 1, 15, 22, 10))
+    canonical = preprocess_html(html)
+
+    assert len(canonical_json({"canonical": canonical})) < len(html.encode("utf-8"))
+
+
+def test_table_cells_reference_lines():
+    html = "<table><tr><td>Monto</td><td>S/ 25.50</td></tr><tr><td>Nota</td><td><b>a</b><i>b</i></td></tr></table>"
+    canonical = preprocess_html(html)
+
+    assert canonical["tables"][0] == [0, 1]
+    # "ab" no es una línea (son dos strings): viaja como texto
+    assert canonical["tables"][1] == [2, "ab"]
+    assert canonical_tables(canonical) == [["Monto", "S/ 25.50"], ["Nota", "ab"]]
+    assert "html" not in canonical
+
+
+def test_drops_scripts_and_styles():
+    canonical = preprocess_html("<html><head><style>p{}</style><script>x()</script></head><body><p>Hola</p></body></html>")
+
+    assert canonical_text(canonical) == "Hola"
+
+
+def test_canonical_json_is_compact_utf8():
+    body = canonical_json({"lines": ["Número de operación"]})
+
+    assert body == '{"lines":["Número de operación"]}'.encode("utf-8")
+    assert json.loads(body) == {"lines": ["Número de operación"]}
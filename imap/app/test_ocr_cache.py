@@ -0,0 +1,14 @@
+from app.ocr_cache import OcrCache
+
+SHA = "ab" * 32
+
+
+def test_settings_change_is_a_miss(tmp_path):
+    cache = OcrCache(tmp_path, {"dpi": 300})
+    cache.put_page(SHA, 1, "05ENE 05ENE PAGO 10.00", [], "ocr")
+    cache.mark_complete(SHA, 1)
+
+    assert OcrCache(tmp_path, {"dpi": 300}).is_complete(SHA)
+    other = OcrCache(tmp_path, {"dpi": 150})
+    assert not other.is_complete(SHA)
+    assert other.get_page(SHA, 1) is None
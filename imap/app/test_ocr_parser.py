@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip("pdf2image")
+pytest.importorskip("pytesseract")
+
+from app.ocr_parser import page_quality_ok
+
+GOOD = "05ENE 05ENE PAGO SERVICIO 120.50\n06ENE 06ENE ABONO PLANILLA 3,500.00"
+
+
+def test_low_confidence_fails():
+    assert not page_quality_ok(GOOD, 40.0)
+
+
+def test_candidate_lines_must_match():
+    assert page_quality_ok(GOOD, 90.0)
+    assert not page_quality_ok("05ENE basura ilegible\n06ENE 06ENE ABONO 10.00", 90.0)
+
+
+def test_page_without_candidates_passes():
+    assert page_quality_ok("ESTADO DE CUENTA\nResumen del periodo", 90.0)
+    assert page_quality_ok("", 90.0)
+
+
+def test_page_without_candidates_retry_is_opt_in():
+    assert not page_quality_ok("ESTADO DE CUENTA", 90.0, retry_no_candidates=True)
+    assert page_quality_ok("", 90.0, retry_no_candidates=True)
@@ -0,0 +1,280 @@
+"""
+Trazas por email: un trace por corrida de /ingest y un span por email.
+
+    ingest                    (root; continúa el `traceparent` entrante si hay)
+    ├── imap.connect / imap.search / imap.fetch (uno por lote)
+    └── ingest.email          (uid, message_id, remitente, resultado)
+        ├── preprocess_html
+        ├── agent.extract     → header traceparent al agente
+        ├── mongo.insert_raw
+        ├── parse
+        └── mongo.insert_processed
+
+Formato de ids y header según W3C Trace Context, así el agente (o un
+collector OpenTelemetry) puede unir sus spans al mismo trace. Los spans
+terminados se exportan en un hilo aparte por lotes, a un JSONL local o a
+un collector OTLP/HTTP (JSON), según TRACE_EXPORTER; con "none" solo se
+propagan los ids.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+import requests
+
+from .config import (
+    TRACE_EXPORTER, TRACE_FILE, OTLP_TRACES_ENDPOINT, TRACE_SERVICE_NAME,
+    TRACE_EXPORT_BATCH, TRACE_EXPORT_INTERVAL,
+)
+from .resources import lazy
+
+logger = logging.getLogger(__name__)
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+OTLP_KIND = {"internal": 1, "server": 2, "client": 3}
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "kind", "attributes",
+        "start_ns", "end_ns", "_started", "duration_ms", "error", "_token",
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: str, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.end_ns = None
+        self.duration_ms = None
+        self.error = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def record_error(self, exc: BaseException):
+        self.error = f"{type(exc).__name__}: {exc}"[:500]
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 3)
+        self.end_ns = self.start_ns + int(self.duration_ms * 1e6)
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        _export(self)
+
+    def to_record(self) -> dict:
+        """Una línea del JSONL local"""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": TRACE_SERVICE_NAME,
+            "start": datetime.fromtimestamp(self.start_ns / 1e9, tz=timezone.utc).isoformat(),
+            "duration_ms": self.duration_ms,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": OTLP_KIND.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def parse_traceparent(value) -> Optional[tuple]:
+    """(trace_id, parent_span_id) de un header traceparent válido, si no None"""
+    if not isinstance(value, str):
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    return match.groups() if match else None
+
+
+def start_span(name: str, kind: str = "internal", traceparent: str = None, **attributes) -> Span:
+    """
+    Abre un span hijo del span actual (o un trace nuevo) y lo deja como actual
+    hasta `end()`. Para bloques cortos usar `span()`.
+    """
+    parent = _current_span.get()
+    remote = parse_traceparent(traceparent) if parent is None else None
+    if parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    elif remote:
+        trace_id, parent_id = remote
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+
+    new_span = Span(name, trace_id, parent_id, kind, attributes)
+    new_span._token = _current_span.set(new_span)
+    return new_span
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", traceparent: str = None, **attributes):
+    current = start_span(name, kind=kind, traceparent=traceparent, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        current.end()
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_attributes(**attributes):
+    """Agrega atributos al span actual (no-op fuera de un trace)"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def propagation_headers() -> dict:
+    """Header traceparent del span actual para llamadas salientes"""
+    current = _current_span.get()
+    return {"traceparent": current.traceparent} if current is not None else {}
+
+
+# ============================================================================
+# EXPORT
+# ============================================================================
+
+class SpanExporter:
+    """Cola + hilo daemon: exporta por lotes sin bloquear la ingesta"""
+
+    def __init__(self, kind: str, batch_size: int = TRACE_EXPORT_BATCH,
+                 interval: float = TRACE_EXPORT_INTERVAL):
+        self.kind = kind
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=batch_size * 50)
+        self.dropped = 0
+        self.exported = 0
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, finished: Span):
+        try:
+            self.queue.put_nowait(finished)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, first=None) -> list:
+        batch = [first] if first is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                first = self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first))
+
+    def flush(self):
+        batch = self._drain()
+        while batch:
+            self._write(batch)
+            batch = self._drain()
+
+    def _write(self, batch: list):
+        try:
+            if self.kind == "otlp":
+                self._post_otlp(batch)
+            else:
+                self._append_jsonl(batch)
+            self.exported += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning(f"⚠️ Could not export {len(batch)} spans ({self.kind}): {e}")
+
+    def _append_jsonl(self, batch: list):
+        os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            for finished in batch:
+                f.write(json.dumps(finished.to_record(), ensure_ascii=False, default=str) + "\n")
+
+    def _post_otlp(self, batch: list):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", TRACE_SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "imap.app"}, "spans": [s.to_otlp() for s in batch]}],
+        }]}
+        resp = requests.post(OTLP_TRACES_ENDPOINT, json=payload, timeout=5)
+        resp.raise_for_status()
+
+    def stats(self) -> dict:
+        return {"exporter": self.kind, "exported": self.exported,
+                "dropped": self.dropped, "queued": self.queue.qsize()}
+
+
+def get_exporter() -> Optional[SpanExporter]:
+    if TRACE_EXPORTER not in ("file", "otlp"):
+        return None
+    return lazy("trace_exporter", lambda: SpanExporter(TRACE_EXPORTER))
+
+
+def _export(finished: Span):
+    exporter = get_exporter()
+    if exporter is not None:
+        exporter.submit(finished)
+
+
+def get_trace_stats() -> dict:
+    exporter = get_exporter()
+    return exporter.stats() if exporter is not None else {"exporter": "none"}
@@ -0,0 +1,3 @@
+"""
+Benchmarks reproducibles del servicio IMAP (ver benchmarks/run_ingest.py).
+"""
@@ -0,0 +1,205 @@
+"""
+Corpus sintético de notificaciones bancarias (Yape, Interbank, BCP).
+
+Genera mensajes RFC822 deterministas (misma semilla → mismos bytes) con
+la mezcla que ve la ingesta real: notificaciones válidas, devoluciones,
+correos del banco que no pasan el filtro de asunto y estados de cuenta
+en PDF adjuntos (con una fracción repetida para ejercitar el store
+direccionado por contenido).
+"""
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import format_datetime
+
+SENDERS = {
+    "yape": "notificaciones@yape.pe",
+    "interbank": "servicioalcliente@netinterbank.com.pe",
+    "bcp": "notificaciones@notificacionesbcp.com.pe",
+    # Sin email setup: lo descarta el FROM del SEARCH
+    "tienda": "pedidos@tienda.example.pe",
+}
+
+NAMES = [
+    "JUAN PEREZ", "MARIA LOPEZ", "CARLOS QUISPE", "ANA TORRES",
+    "LUIS MAMANI", "ROSA FLORES", "JORGE HUAMAN", "SOFIA RAMOS",
+]
+# Fechas relativas a un ancla fija: mismos bytes en cada corrida
+ANCHOR = datetime(2025, 1, 31, 12, 0, tzinfo=timezone.utc)
+
+MONTHS = [
+    "enero", "febrero", "marzo", "abril", "mayo", "junio", "julio",
+    "agosto", "septiembre", "octubre", "noviembre", "diciembre",
+]
+
+
+@dataclass
+class CorpusMessage:
+    uid: int
+    sender: str
+    date: datetime
+    raw: bytes
+    kind: str
+
+
+def _yape(rng, date):
+    amount = f"{rng.uniform(1, 500):.2f}"
+    hour = date.hour % 12 or 12
+    fecha = f"{date.day} {MONTHS[date.month - 1]} {date.year} - {hour:02d}:{date.minute:02d} {'p. m.' if date.hour >= 12 else 'a. m.'}"
+    html = f"""<html><head><style>td {{ font-family: Arial; }}</style></head><body>
+<p>¡Hola, {rng.choice(NAMES)}!</p>
+<p>Yapeaste <span style="color:rgb(96,3,145);font-size:32px">{amount}</span></p>
+<table>
+<tr><td>Nombre del Beneficiario</td><td>{rng.choice(NAMES)}</td></tr>
+<tr><td>Celular del Beneficiario</td><td>XXXXXX{rng.randint(100, 999)}</td></tr>
+<tr><td>Tu número de celular</td><td>XXXXXX{rng.randint(100, 999)}</td></tr>
+<tr><td>Fecha y hora</td><td>{fecha}</td></tr>
+<tr><td>N° de operación</td><td>{rng.randint(1000000, 9999999)}</td></tr>
+</table>
+<!-- footer -->
+</body></html>"""
+    return "Yapeo exitoso", None, html
+
+
+def _interbank(rng, date):
+    text = f"""Hola {rng.choice(NAMES)},
+Tu operación se realizó con éxito.
+Monto Total: S/ {rng.uniform(10, 3000):.2f}
+Cuenta cargo: Cuenta Simple Soles 200 {rng.randint(3000000000, 3999999999)}
+Cuenta destino: {rng.choice(NAMES)}
+898 {rng.randint(3000000000, 3999999999)}
+Fecha: {date.strftime('%d %b %Y %I:%M %p')}
+Código de operación: {rng.randint(100000, 999999)}
+Tipo de operación: Transferencia a terceros
+Comisión: S/ 0.00
+"""
+    return "Constancia de Transferencia a Terceros - Interbank", text, None
+
+
+def _bcp(rng, date):
+    html = f"""<html><body>
+<h2>Constancia de transferencia</h2>
+<table border="1" cellpadding="4">
+<tr><td>Monto</td><td>S/ {rng.uniform(10, 5000):,.2f}</td></tr>
+<tr><td>Cuenta origen</td><td>191 {rng.randint(10000000, 99999999)} 0 {rng.randint(10, 99)}</td></tr>
+<tr><td>Nombre del Beneficiario</td><td>{rng.choice(NAMES)}</td></tr>
+<tr><td>Cuenta destino</td><td>193 {rng.randint(10000000, 99999999)}</td></tr>
+<tr><td>Fecha y hora</td><td>{date.strftime('%d/%m/%Y %I:%M %p')}</td></tr>
+<tr><td>Número de operación</td><td>{rng.randint(10000000, 99999999)}</td></tr>
+</table></body></html>"""
+    text = "Constancia de transferencia BCP"
+    return "Constancia de Transferencia BCP", text, html
+
+
+def _refund(rng, date):
+    return "Devolución de consumo", f"Se devolvió S/ {rng.uniform(5, 200):.2f} a tu cuenta.", None
+
+
+def _newsletter(rng, date):
+    html = "<html><body>" + "<p>Conoce nuestras promociones de la semana.</p>" * 20 + "</body></html>"
+    return "Promociones de la semana", None, html
+
+
+def statement_pdf(seed: int, size_kb: int) -> bytes:
+    """PDF mínimo válido con filas de estado de cuenta y relleno hasta ~size_kb"""
+    rng = random.Random(seed)
+    rows = "\n".join(
+        f"({rng.randint(1, 28):02d}/{rng.randint(1, 12):02d} CONSUMO TIENDA {n} {rng.uniform(1, 900):.2f}) Tj T*"
+        for n in range(20)
+    )
+    stream = f"BT /F1 9 Tf 12 TL 40 800 Td\n{rows}\nET\n% {'x' * max(0, size_kb * 1024 - len(rows))}"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out, offsets = "%PDF-1.4\n", []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+
+def _foreign(rng, date):
+    return "Confirmación de tu cargo", f"Pedido {rng.randint(1000, 9999)} confirmado.", None
+
+
+KINDS = {
+    "yape": ("yape", _yape),
+    "interbank": ("interbank", _interbank),
+    "bcp": ("bcp", _bcp),
+    "refund": ("interbank", _refund),
+    "newsletter": ("bcp", _newsletter),
+    "foreign": ("tienda", _foreign),
+}
+
+DEFAULT_MIX = {
+    "yape": 0.45, "interbank": 0.2, "bcp": 0.15,
+    "refund": 0.05, "newsletter": 0.1, "foreign": 0.05,
+}
+
+
+def build_corpus(
+    count: int,
+    seed: int = 42,
+    mix: dict = None,
+    pdf_ratio: float = 0.1,
+    pdf_kb: int = 64,
+    pdf_dup_ratio: float = 0.3,
+    days: int = 30,
+    end: datetime = ANCHOR,
+):
+    """
+    Args:
+        count: número de mensajes
+        mix: proporción por tipo (ver DEFAULT_MIX)
+        pdf_ratio: fracción de mensajes con estado de cuenta PDF adjunto
+        pdf_dup_ratio: fracción de esos PDFs que repiten uno ya enviado
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = zip(*mix.items())
+
+    messages, pdf_seeds = [], []
+    for uid in range(1, count + 1):
+        kind = rng.choices(kinds, weights)[0]
+        bank, render = KINDS[kind]
+        date = end - timedelta(seconds=rng.randint(0, days * 86400))
+        subject, text, html = render(rng, date)
+
+        msg = EmailMessage()
+        msg["From"] = f"{bank.upper()} <{SENDERS[bank]}>"
+        msg["To"] = "cliente@example.com"
+        msg["Subject"] = subject
+        msg["Date"] = format_datetime(date)
+        msg["Message-ID"] = f"<bench.{seed}.{uid}@{SENDERS[bank].split('@')[1]}>"
+
+        msg.set_content(text or "Ver versión HTML")
+        if html:
+            msg.add_alternative(html, subtype="html")
+
+        if rng.random() < pdf_ratio:
+            if pdf_seeds and rng.random() < pdf_dup_ratio:
+                pdf_seed = rng.choice(pdf_seeds)
+            else:
+                pdf_seed = seed * 1_000_003 + uid
+                pdf_seeds.append(pdf_seed)
+            msg.add_attachment(
+                statement_pdf(pdf_seed, pdf_kb), maintype="application", subtype="pdf",
+                filename=f"estado_cuenta_{pdf_seed % 100000}.pdf",
+            )
+
+        for n, part in enumerate(p for p in msg.walk() if p.is_multipart()):
+            part.set_boundary(f"==bench-{seed}-{uid}-{n}==")
+
+        messages.append(CorpusMessage(uid, SENDERS[bank], date, msg.as_bytes(), kind))
+
+    return messages
@@ -0,0 +1,143 @@
+"""
+Servidor IMAP en proceso para benchmarks.
+
+`FakeIMAPServer` guarda el corpus y entrega clientes con la misma interfaz
+de `imapclient.IMAPClient` que usa `ingest_email` (login, list_folders,
+select_folder, search, fetch, add_flags, move, logout). SEARCH evalúa los
+criterios ALL / SINCE / BEFORE / FROM / OR igual que un servidor real
+(FROM por subcadena, sin distinguir mayúsculas).
+
+Se puede simular latencia de red con `rtt_ms` (por comando) y
+`bytes_per_sec` (ancho de banda del FETCH).
+"""
+import threading
+import time
+from datetime import datetime
+
+
+class FakeIMAPServer:
+    def __init__(self, messages, folders=None, rtt_ms: float = 0.0, bytes_per_sec: float = 0.0):
+        self.messages = {m.uid: m for m in messages}
+        self.folders = folders or ["INBOX", "[Gmail]/All Mail", "[Gmail]/Sent Mail"]
+        self.rtt = rtt_ms / 1000.0
+        self.bytes_per_sec = bytes_per_sec
+        self.flags = {}
+        self.commands = []
+        self._lock = threading.Lock()
+
+    def client(self, host=None, port=None, use_uid=True, ssl=True, timeout=None):
+        """Factory con la firma de IMAPClient(...)"""
+        return FakeIMAPClient(self)
+
+    def record(self, command: str, seconds: float, size: int = 0, bytes_: int = 0):
+        with self._lock:
+            self.commands.append({"command": command, "seconds": seconds, "size": size, "bytes": bytes_})
+
+    def reset_stats(self):
+        with self._lock:
+            self.commands = []
+            self.flags = {}
+
+
+def _matches(criteria, message) -> bool:
+    i = 0
+    while i < len(criteria):
+        token = criteria[i]
+        if isinstance(token, (list, tuple)):
+            if not _matches(token, message):
+                return False
+            i += 1
+            continue
+
+        key = str(token).upper()
+        if key == "ALL":
+            i += 1
+        elif key == "OR":
+            left, right, i = _or_operands(criteria, i + 1)
+            if not (_matches(left, message) or _matches(right, message)):
+                return False
+        elif key == "FROM":
+            if str(criteria[i + 1]).lower() not in message.sender.lower():
+                return False
+            i += 2
+        elif key in ("SINCE", "BEFORE"):
+            day = datetime.strptime(criteria[i + 1], "%d-%b-%Y").date()
+            msg_day = message.date.date()
+            if (key == "SINCE" and msg_day < day) or (key == "BEFORE" and msg_day >= day):
+                return False
+            i += 2
+        else:
+            raise ValueError(f"Unsupported search key in fake server: {token}")
+    return True
+
+
+def _or_operands(criteria, i):
+    """Cada operando de OR es una lista anidada o un par KEY valor"""
+    operands = []
+    for _ in range(2):
+        token = criteria[i]
+        if isinstance(token, (list, tuple)):
+            operands.append(list(token))
+            i += 1
+        else:
+            operands.append([token, criteria[i + 1]])
+            i += 2
+    return operands[0], operands[1], i
+
+
+class FakeIMAPClient:
+    def __init__(self, server: FakeIMAPServer):
+        self.server = server
+        self.selected = None
+
+    def _command(self, name, fn, size=0, payload_bytes=0):
+        started = time.perf_counter()
+        delay = self.server.rtt
+        if self.server.bytes_per_sec and payload_bytes:
+            delay += payload_bytes / self.server.bytes_per_sec
+        if delay:
+            time.sleep(delay)
+        result = fn()
+        self.server.record(name, time.perf_counter() - started, size, payload_bytes)
+        return result
+
+    def login(self, user, password):
+        return self._command("LOGIN", lambda: b"LOGIN completed")
+
+    def list_folders(self):
+        return self._command(
+            "LIST", lambda: [((b"\\HasNoChildren",), b"/", name) for name in self.server.folders]
+        )
+
+    def select_folder(self, folder, readonly=False):
+        self.selected = folder
+        return self._command("SELECT", lambda: {b"EXISTS": len(self.server.messages)})
+
+    def search(self, criteria="ALL", charset=None):
+        criteria = [criteria] if isinstance(criteria, str) else list(criteria)
+        return self._command(
+            "SEARCH",
+            lambda: [uid for uid, m in self.server.messages.items() if _matches(criteria, m)],
+        )
+
+    def fetch(self, uids, attrs):
+        messages = [self.server.messages[uid] for uid in uids if uid in self.server.messages]
+        payload = sum(len(m.raw) for m in messages)
+        return self._command(
+            "FETCH",
+            lambda: {m.uid: {b"RFC822": m.raw, b"SEQ": m.uid} for m in messages},
+            size=len(messages),
+            payload_bytes=payload,
+        )
+
+    def add_flags(self, uids, flags):
+        uids = uids if isinstance(uids, (list, tuple)) else [uids]
+        for uid in uids:
+            self.server.flags.setdefault(uid, set()).update(flags)
+        return {}
+
+    def move(self, uids, folder):
+        return None
+
+    def logout(self):
+        return self._command("LOGOUT", lambda: b"LOGOUT")
@@ -0,0 +1,193 @@
+"""
+Ollama stub local + chequeo de `OllamaClient.classify_many`.
+
+Levanta un `/api/generate` falso por HTTP local (sin modelo ni red) que
+entiende el prompt por lotes del cliente y responde un JSON con la
+categoría de cada línea. Con él se verifica:
+    - batching: cuántos POST salen y cuántas transacciones lleva cada uno
+    - cache LRU: las repetidas (mismo texto normalizado + sugerida) no
+      vuelven al LLM, y la más vieja se expulsa al pasar cache_size
+    - validación: categorías fuera de CATEGORIES, JSON inválido y HTTP 5xx
+      conservan la sugerida y no se cachean
+y el tiempo de classify_many con la latencia configurada por POST.
+
+Uso (desde imap/):
+    python -m benchmarks.llm_stub --items 200 --batch-size 25 --latency-ms 50
+"""
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.llm_client import CATEGORIES, OllamaClient
+
+MODEL = "stub-model"
+PROMPT_LINE_RE = re.compile(r'^(\d+)\. "(.*)" \(sugerida: ([^)]*)\)$', re.MULTILINE)
+
+# Texto que contiene la clave → categoría que responde el stub
+RULES = {
+    "sunat": "impuesto",
+    "retiro": "retiro_efectivo",
+    "planilla": "pago_sueldo",
+    "inventada": "categoria_inventada",  # fuera del catálogo a propósito
+}
+
+
+def stub_label(text: str, suggested: str) -> str:
+    lowered = text.lower()
+    for key, label in RULES.items():
+        if key in lowered:
+            return label
+    return suggested
+
+
+def start_stub_ollama(latency_ms: float = 0.0):
+    """
+    Ollama falso. `server.mode`: "ok" | "invalid_json" | "http_500".
+    `server.batches` guarda cuántas transacciones trajo cada POST.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            items = PROMPT_LINE_RE.findall(body.get("prompt", ""))
+            with server.lock:
+                server.batches.append(len(items))
+            if latency_ms:
+                time.sleep(latency_ms / 1000.0)
+
+            if server.mode == "http_500":
+                self.send_response(500)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            if server.mode == "invalid_json":
+                response = "esto no es json"
+            else:
+                response = json.dumps({n: stub_label(text, suggested) for n, text, suggested in items})
+            payload = json.dumps({"model": body.get("model"), "response": response, "done": True}).encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.mode = "ok"
+    server.batches = []
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_items(count: int):
+    """Transacciones sintéticas; una de cada 4 repite otra cambiando espacios/mayúsculas"""
+    kinds = ["PAGO SUNAT {n}", "RETIRO CAJERO {n}", "ABONO PLANILLA {n}", "SPOTIFY {n}", "CATEGORIA INVENTADA {n}"]
+    items = []
+    for n in range(count):
+        if n % 4 == 3:
+            text = "  " + items[n - 3][0].lower().replace(" ", "  ") + " "
+        else:
+            text = kinds[n % len(kinds)].format(n=n)
+        items.append((text, "servicio_consumo"))
+    return items
+
+
+def expected_label(text: str, suggested: str) -> str:
+    label = stub_label(text, suggested)
+    return label if label in CATEGORIES else suggested
+
+
+def run_checks(server, url: str, items, batch_size: int) -> dict:
+    checks = {}
+
+    def reset(mode="ok"):
+        server.mode = mode
+        with server.lock:
+            server.batches.clear()
+
+    def check(name, ok, detail):
+        checks[name] = {"ok": bool(ok), "detail": detail}
+
+    # --- batching + validación de categorías ---
+    client = OllamaClient(url, MODEL, batch_size=batch_size, cache_size=len(items) * 2)
+    reset()
+    started = time.perf_counter()
+    answers = client.classify_many(items)
+    cold_s = time.perf_counter() - started
+
+    unique = len({client._cache_key(t, s) for t, s in items})
+    batches = list(server.batches)
+    check("batching", sum(batches) == unique and all(b <= batch_size for b in batches)
+          and len(batches) == -(-unique // batch_size),
+          {"unique_items": unique, "posts": len(batches), "batch_sizes": batches})
+    wrong = [(t, a) for (t, s), a in zip(items, answers) if a != expected_label(t, s)]
+    check("categories", not wrong, {"wrong": wrong[:5]})
+    check("off_catalog_kept_suggested",
+          all(a == s for (t, s), a in zip(items, answers) if "inventada" in t.lower()),
+          {"suggested": items[0][1]})
+
+    # --- cache LRU ---
+    reset()
+    started = time.perf_counter()
+    warm = client.classify_many(items)
+    warm_s = time.perf_counter() - started
+    # Las no cacheadas (fuera de catálogo → None) vuelven a consultarse
+    uncached = len({client._cache_key(t, s) for t, s in items if "inventada" in t.lower()})
+    check("lru_hits", warm == answers and sum(server.batches) == uncached,
+          {"posts": len(server.batches), "items_sent": sum(server.batches), "expected_sent": uncached})
+
+    small = OllamaClient(url, MODEL, batch_size=batch_size, cache_size=2)
+    reset()
+    small.classify_many([("pago sunat a", "otros"), ("pago sunat b", "otros"), ("pago sunat c", "otros")])
+    reset()
+    small.classify_many([("PAGO  SUNAT C", "otros"), ("pago sunat a", "otros")])
+    check("lru_eviction", server.batches == [1],
+          {"cache_size": 2, "items_sent": sum(server.batches), "expected_sent": 1})
+
+    # --- respuestas inválidas ---
+    for mode in ("invalid_json", "http_500"):
+        fresh = OllamaClient(url, MODEL, batch_size=batch_size)
+        probe = [("pago sunat x", "otros"), ("retiro cajero x", "otros")]
+        reset(mode)
+        first = fresh.classify_many(probe)
+        second = fresh.classify_many(probe)
+        check(f"{mode}_kept_suggested",
+              first == second == ["otros", "otros"] and len(server.batches) == 2,
+              {"answers": first, "posts": len(server.batches)})
+    reset()
+
+    return {"checks": checks, "timing": {"cold_s": round(cold_s, 4), "warm_s": round(warm_s, 4)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OllamaClient.classify_many against a local stub")
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_stub_ollama(args.latency_ms)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        report = run_checks(server, url, build_items(args.items), args.batch_size)
+    finally:
+        server.shutdown()
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    failed = [name for name, c in report["checks"].items() if not c["ok"]]
+    if failed:
+        print(f"❌ Failed checks: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"✅ {len(report['checks'])} checks passed")
+
+
+if __name__ == "__main__":
+    main()
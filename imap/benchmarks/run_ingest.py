@@ -0,0 +1,242 @@
+"""
+Benchmark end-to-end de la ingesta IMAP.
+
+Levanta todo en proceso, sin red ni servicios externos:
+    - FakeIMAPServer con el corpus sintético (Yape / Interbank / BCP + PDFs)
+    - mongomock como Mongo (resources.override)
+    - un agente de extracción stub por HTTP local (latencia configurable)
+
+Mide `connect_and_download_pdfs` y el endpoint `/ingest` (llamado como
+función) en varias corridas: throughput, percentiles de latencia por
+corrida y por lote FETCH, y RSS pico. El resultado se guarda en JSON junto
+con el commit para comparar regresiones entre versiones.
+
+Uso (desde imap/):
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.run_ingest --messages 2000 --runs 5 --pdf-ratio 0.1
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from .corpus import build_corpus, SENDERS
+from .fake_imap import FakeIMAPServer
+
+TENANT_DB = "bench_tenant"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+AGENT_RESPONSE = json.dumps({
+    "transactionVariables": {
+        "originAccount": "XXXXXXXXX123",
+        "destinationAccount": "XXXXXXXXX456",
+        "amount": 25.5,
+        "currency": "PEN",
+        "operationDate": "2025-01-15T22:10:00",
+        "operationNumber": "1234567",
+    },
+    "transactionType": "transfer",
+    "confidence": 0.9,
+}).encode("utf-8")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q
+    lo, hi = int(pos), min(int(pos) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def summarize(values, scale=1.0):
+    return {
+        "p50": _round(percentile(values, 0.5), scale),
+        "p90": _round(percentile(values, 0.9), scale),
+        "p99": _round(percentile(values, 0.99), scale),
+        "max": _round(max(values) if values else None, scale),
+        "mean": _round(sum(values) / len(values) if values else None, scale),
+    }
+
+
+def _round(value, scale):
+    return None if value is None else round(value * scale, 3)
+
+
+def peak_rss_mb():
+    # Linux reporta KB, macOS bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def start_stub_agent(latency_ms: float):
+    """Agente de extracción falso: responde /extract y /extract/canonical"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if latency_ms:
+                time.sleep(latency_ms / 1000.0)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(AGENT_RESPONSE)))
+            self.end_headers()
+            self.wfile.write(AGENT_RESPONSE)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def configure_environment(workdir: Path, agent_url: str):
+    """Debe correr ANTES de importar app.*: config.py lee el entorno al importarse"""
+    os.environ.update({
+        "OUTPUT_DIR": str(workdir),
+        "ATTACHMENT_STORE_DIR": str(workdir / "attachments"),
+        "IA_EXTRACT_URL": f"{agent_url}/extract",
+        "IMAP_FOLDER": "INBOX",
+        "IMAP_LIMIT": "0",
+        "IMAP_SUBJECT_FILTER": "",
+        "IMAP_ONLY_WITH_ATTACHMENTS": "false",
+        "TENANT_CACHE_CHANGE_STREAM": "false",
+    })
+
+
+def reset_mongo():
+    """Mongo nuevo por corrida con los email setups del tenant"""
+    import mongomock
+    from app import resources
+    from app.tenant_cache import invalidate_tenant
+
+    client = mongomock.MongoClient()
+    resources.override("mongo_client", client)
+    client[TENANT_DB]["email_setups"].insert_many([
+        {"bank_name": bank.upper(), "bank_sender": sender, "service_type": "email"}
+        for bank, sender in SENDERS.items() if bank != "tienda"
+    ])
+    invalidate_tenant(TENANT_DB)
+    invalidate_tenant(None)
+    return client
+
+
+def run_phase(runs, fn, server, message_count):
+    walls, fetch_batches, outputs = [], [], []
+    for _ in range(runs):
+        client = reset_mongo()
+        server.reset_stats()
+        started = time.perf_counter()
+        output = fn()
+        walls.append(time.perf_counter() - started)
+        fetch_batches.extend(c["seconds"] for c in server.commands if c["command"] == "FETCH")
+        outputs.append(output)
+
+    return {
+        "runs": runs,
+        "messages_in_mailbox": message_count,
+        "wall_s": summarize(walls),
+        "messages_per_s": round(message_count / (sum(walls) / len(walls)), 2),
+        "fetch_batch_ms": summarize(fetch_batches, 1000),
+        "peak_rss_mb": peak_rss_mb(),
+        "last_run": outputs[-1],
+        "stored": {
+            "raw": client[TENANT_DB]["Transaction_Raw_IMAP"].count_documents({}),
+            "processed": client[TENANT_DB]["Transaction_Processed_IMAP"].count_documents({}),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IMAP ingest benchmark")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--pdf-ratio", type=float, default=0.1)
+    parser.add_argument("--pdf-kb", type=int, default=64)
+    parser.add_argument("--pdf-dup-ratio", type=float, default=0.3)
+    parser.add_argument("--imap-rtt-ms", type=float, default=0.0)
+    parser.add_argument("--imap-bytes-per-sec", type=float, default=0.0)
+    parser.add_argument("--agent-latency-ms", type=float, default=0.0)
+    parser.add_argument("--phases", default="download,ingest")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--out", help="JSON de salida (por defecto benchmarks/results/)")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="imap-bench-"))
+    agent = start_stub_agent(args.agent_latency_ms)
+    configure_environment(workdir, f"http://127.0.0.1:{agent.server_address[1]}")
+
+    from app import ingest_email, api
+
+    logging.getLogger().setLevel(args.log_level)
+
+    build_started = time.perf_counter()
+    corpus = build_corpus(
+        args.messages, seed=args.seed, pdf_ratio=args.pdf_ratio,
+        pdf_kb=args.pdf_kb, pdf_dup_ratio=args.pdf_dup_ratio,
+    )
+    corpus_seconds = time.perf_counter() - build_started
+
+    server = FakeIMAPServer(corpus, rtt_ms=args.imap_rtt_ms, bytes_per_sec=args.imap_bytes_per_sec)
+    ingest_email.IMAPClient = server.client
+
+    phases = {
+        "download": lambda: {"downloaded": len(ingest_email.connect_and_download_pdfs(db_name=TENANT_DB))},
+        "ingest": lambda: api.ingest(
+            x_database_name=TENANT_DB, limit=None, force=False, date_from=None, date_to=None
+        )["summary"],
+    }
+
+    results = {}
+    for name in [p.strip() for p in args.phases.split(",") if p.strip()]:
+        print(f"⏱️ {name}: {args.runs} runs over {len(corpus)} messages...")
+        results[name] = run_phase(args.runs, phases[name], server, len(corpus))
+
+    report = {
+        "benchmark": "imap_ingest",
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": vars(args),
+        "corpus": {
+            "messages": len(corpus),
+            "bytes": sum(len(m.raw) for m in corpus),
+            "build_s": round(corpus_seconds, 3),
+            "kinds": {k: sum(1 for m in corpus if m.kind == k) for k in sorted({m.kind for m in corpus})},
+        },
+        "results": results,
+    }
+
+    out = Path(args.out) if args.out else RESULTS_DIR / (
+        f"ingest_{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}_{report['commit'] or 'nogit'}.json"
+    )
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2, ensure_ascii=False, default=str))
+    print(json.dumps(results, indent=2, default=str))
+    print(f"✅ Results saved to {out}")
+    agent.shutdown()
+
+
+if __name__ == "__main__":
+    main()